@@ -4,16 +4,29 @@
 Выводит данные в формате JSON  в поток вывода
 """
 import argparse
-import json
-import http.client
-import re
+import logging
+import os
 import sys
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import cli  # noqa: E402
+from common.client import fetch_json  # noqa: E402
+from common.concurrency import host_of, iter_ordered  # noqa: E402
+from common.errors import DeadlineExceeded, MyException  # noqa: E402
+from common.fields import compile_fields  # noqa: E402
+from common.filters import Filter, Range  # noqa: E402
+from common.metrics import METRICS  # noqa: E402
+from common.output import open_output  # noqa: E402
+from common.processes import open_pool  # noqa: E402
+from common.promos import PromoParser, PromoRule, load_rules  # noqa: E402
+
 MIN_S = 0
 MAX_S = 200000000000
 MIN_PRICE = 0
 MAX_PRICE = 25000000000000000
 ROOM_COUNT = 10
+COMPLEX_NAME = 'LOFT FM (Москва)'
 
 HEADERS = {
     'authority': 'loftfm.mrloft.ru',
@@ -30,10 +43,6 @@ HEADERS = {
     'referer': 'https://loftfm.mrloft.ru/',
     'accept-language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
 }
-FIELDS = ['complex', 'type', 'phase', 'building', 'section', 'price', 'price_base', 'price_finished', 'price_sale',
-          'price_finished_sale', 'area', 'living_area', 'number', 'number_on_site', 'rooms', 'floor', 'in_sale',
-          'sale_status', 'finished', 'currency', 'ceil', 'article', 'finishing_name', 'furniture', 'furniture_price',
-          'plan', 'feature', 'view', 'euro_planning', 'sale', 'discount_percent', 'discount', 'comment']
 MATCHING = {
     'area': {
         'name': 's',
@@ -44,7 +53,7 @@ MATCHING = {
         'calc': lambda x: float(x) if x else None
     },
     'complex': {
-        'calc': lambda x: 'LOFT FM (Москва)'
+        'calc': lambda x: COMPLEX_NAME
     },
     'price_base': {
         'name': 'priceToSort',
@@ -78,27 +87,27 @@ MATCHING = {
         'calc': lambda x: 0
     },
 }
+# Матчинг компилируется один раз при импорте
+cast_fields = compile_fields(MATCHING)
+FILTER_KEYS = {'price': 'priceToSort', 'area': 's', 'floor': 'floor', 'rooms': 'rooms'}
+# Акции: скидка - все цифры текста, цена становится ценой со скидкой;
+# отделка в подарок - слово перед "отделка", цена (или цена со скидкой) становится ценой с отделкой со скидкой
+PROMO_RULES = [
+    PromoRule(name='discount', marker='Цена указана с учетом скидки', pattern=r'\d', type='float',
+              field='discount', price='price_sale'),
+    PromoRule(name='finishing', marker=' отделка в подарок', pattern=r'\w+ отделка', strip=' отделка',
+              field='finishing_name', set={'finished': 1}, price='price_finished_sale'),
+]
+PROMOS = PromoParser(PROMO_RULES)
 
 
-def cast_fields(record: dict, fields: list, matching: dict):
+def configure_promos(rules):
     """
-    Для каждого поля из fields определяет значение на основе матчинга полей и преобразований типов
-    :param record: Данные из API
-    :param fields: Поля, к которым нужно привести каждую запись
-    :param matching: Данные для матчинга полей и преобразования
+    Заменяет таблицу правил акций, так же настраиваются процессы пула преобразования
+    :param rules: Список PromoRule
     :return:
     """
-    obj = {}
-    # Для каждого поля определяем значение на основе матчинга полей и преобразований типов
-    for field in fields:
-        matching_params = matching.get(field, {})
-        site_field = matching_params.get('name')
-        value = record.get(site_field)
-        calc = matching_params.get('calc')
-        if calc:
-            value = calc(value)
-        obj[field] = value
-    return obj
+    PROMOS.configure(rules)
 
 
 def check_sales_and_finishing(obj):
@@ -109,71 +118,177 @@ def check_sales_and_finishing(obj):
     """
     sale = obj.get('sale')
     if sale and isinstance(sale, str):
-        rub = sale.find('Цена указана с учетом скидки')
-        if rub >= 0:
-            pattern = re.compile(r'\d')
-            discount = float(''.join(pattern.findall(sale)))
-            obj['discount'] = discount
-            obj['price_sale'] = obj['price_base']
-            obj['price_base'] = None
-        finishing = sale.find(' отделка в подарок')
-        if finishing >= 0:
-            pattern = re.compile(r'\w+ отделка')
-            finishing_name = ''.join(pattern.findall(sale)).replace(' отделка', '')
-            obj['finishing_name'] = finishing_name
-            obj['finished'] = 1
-            # Если есть акция на ремонт - цена уже как бы со скидкой
-            obj['price_finished_sale'] = obj['price_base']
-            obj['price_base'] = None
-            if obj.get('price_sale'):
-                obj['price_finished_sale'] = obj['price_sale']
-                obj['price_sale'] = None
-
-
-def main(room_filter=ROOM_COUNT):
-    rooms = ''.join([f'&room%5B%5D={room}' for room in range(room_filter)])
-    conn = http.client.HTTPSConnection("loftfm.mrloft.ru")
-    payload = f'min_s={MIN_S}&max_s={MAX_S}&min_price={MIN_PRICE}&max_price={MAX_PRICE}{rooms}'
-    conn.request("POST", "/getflatdatasearchLoftfm", payload, HEADERS)
-    res = conn.getresponse()
-    data = res.read()
-    data = data.decode("utf-8")
-    json_data = json.loads(data)
-    result = []
-    for record in json_data.get('data'):
-        # Получаем основные поля из матчинга
-        obj = cast_fields(record, FIELDS, MATCHING)
-
-        # Отдельно читаем информацию о скидках и отделках из акций
-        check_sales_and_finishing(obj)
-
-        # Аккумулируем значение статуса из полей "Продано" и "Забронировано"
-        if not obj['in_sale']:
-            obj['sale_status'] = 'Продано'
-        elif record['reserved']:
-            obj['sale_status'] = 'Забронировано'
-        else:
-            obj['sale_status'] = 'Продается'
-
-        # Аккумулируем значение типа, тут это облако тегов. Если помещение нежилое - считаем его коммерческим
-        obj_type = [r['name'] for r in record['type']]
-        if 'Апартаменты' in obj_type:
-            obj['type'] = 'apartment'
-        else:
-            obj['type'] = 'commercial'
-        result.append(obj)
-
-    output = json.dumps(result, ensure_ascii=False)
-    # Выводим данные в поток
-    sys.stdout.write(output)
+        PROMOS.apply(obj, sale)
+
+
+def transform(record):
+    """
+    Приводит запись API к формату FIELDS
+    :param record: Данные из API
+    :return:
+    """
+    # Получаем основные поля из матчинга
+    return post_process(cast_fields(record), record)
+
+
+def post_process(obj, record):
+    """
+    Дополняет результат матчинга данными из акций, статусом и типом
+    :param obj: Результат cast_fields
+    :param record: Данные из API
+    :return:
+    """
+    # Отдельно читаем информацию о скидках и отделках из акций
+    check_sales_and_finishing(obj)
+
+    # Аккумулируем значение статуса из полей "Продано" и "Забронировано"
+    if not obj['in_sale']:
+        obj['sale_status'] = 'Продано'
+    elif record['reserved']:
+        obj['sale_status'] = 'Забронировано'
+    else:
+        obj['sale_status'] = 'Продается'
+
+    # Аккумулируем значение типа, тут это облако тегов. Если помещение нежилое - считаем его коммерческим
+    obj_type = [r['name'] for r in record['type']]
+    if 'Апартаменты' in obj_type:
+        obj['type'] = 'apartment'
+    else:
+        obj['type'] = 'commercial'
+    return obj
+
+
+def build_payload(area, price, rooms):
+    """
+    Тело запроса поиска
+    :param area: Range площади
+    :param price: Range цены
+    :param rooms: Числа комнат
+    :return:
+    """
+    room_params = ''.join([f'&room%5B%5D={room}' for room in rooms])
+    return f'min_s={area.low}&max_s={area.high}&min_price={price.low}&max_price={price.high}{room_params}'
+
+
+def split_range(bounds, cuts):
+    """
+    Делит диапазон точками cuts. API включает границы, поэтому соседние части пересекаются на точке деления
+    :param bounds: Range
+    :param cuts: Точки деления, лежащие вне диапазона, пропускаются
+    :return: Список Range
+    """
+    points = [bounds.low] + sorted(cut for cut in set(cuts) if bounds.low < cut < bounds.high) + [bounds.high]
+    return [Range(low, high) for low, high in zip(points, points[1:])]
+
+
+def make_shards(area, price, rooms, shard_rooms=False, shard_prices=(), shard_areas=()):
+    """
+    Делит запрос поиска на части по числу комнат и диапазонам цены и площади
+    :param area: Range площади
+    :param price: Range цены
+    :param rooms: Числа комнат
+    :param shard_rooms: Отдельный запрос на каждое число комнат
+    :param shard_prices: Точки деления диапазона цены
+    :param shard_areas: Точки деления диапазона площади
+    :return: Список тел запросов
+    """
+    room_groups = [[room] for room in rooms] if shard_rooms else [list(rooms)]
+    return [build_payload(area_part, price_part, group)
+            for group in room_groups
+            for price_part in split_range(price, shard_prices)
+            for area_part in split_range(area, shard_areas)]
+
+
+def process_shard(address, payload, accept=None, pool=None):
+    """
+    Запрашивает одну часть поиска и отдает пары (id квартиры, запись в формате FIELDS)
+    :param address: Адрес сайта
+    :param payload: Тело запроса
+    :param accept: Проверка записи API фильтром
+    :param pool: TransformPool или None
+    :return:
+    """
+    # Записи из массива data разбираются потоково, по мере получения ответа
+    records = fetch_json(address, "/getflatdatasearchLoftfm", "POST", payload, HEADERS, path=('data',))
+    if pool is not None:
+        return pool.records(records, accept, host=host_of(address), key=lambda record: record['id'])
+    return METRICS.records(records, accept, cast_fields,
+                           lambda obj, record: (record['id'], post_process(obj, record)), host_of(address))
+
+
+def main(room_filter=ROOM_COUNT, options=None, stream=None, shard_rooms=False, shard_prices=(), shard_areas=()):
+    options = options or cli.default_options()
+    deadline = cli.configure(options)
+    logger = logging.getLogger('loftfm')
+    spec = options.filter or Filter()
+    # Площадь, цена и комнаты передаются в запрос, ограничения фильтра заменяют значения по умолчанию
+    area = Range(MIN_S, MAX_S).override(spec.area)
+    price = Range(MIN_PRICE, MAX_PRICE).override(spec.price)
+    room_range = Range(0, room_filter - 1).override(spec.rooms)
+    rooms = range(int(room_range.low), int(room_range.high) + 1)
+    payloads = make_shards(area, price, rooms, shard_rooms, shard_prices, shard_areas)
+    # Остальные ограничения и проверка границ, которые API могло не учесть, - на записях до преобразования
+    accept = spec.compile(FILTER_KEYS, available=lambda record: not record['sold'] and not record['reserved'])
+    writer = open_output(options, 'loftfm', stream)
+    sharded = len(payloads) > 1
+    # Процессы пула получают те же правила акций, что и основной
+    pool = open_pool(options, 'loftfm', setup=('configure_promos', ([rule for rule, _ in PROMOS.rules],)))
+    tasks = [("loftfm.mrloft.ru", payload, accept, pool) for payload in payloads]
+    # Части запрашиваются параллельно и выводятся по порядку, каждая - как только готовы предыдущие.
+    # Один запрос обрабатывается последовательно, записи выводятся по мере разбора ответа
+    seen = set()
+    failed = {}
+    for (_, payload, *_), records, e in iter_ordered(process_shard, tasks, workers=options.workers if sharded else 1,
+                                                    per_host=options.per_host, handled=(MyException,),
+                                                    url_index=0, deadline=deadline):
+        try:
+            for record_id, obj in records if not e else ():
+                # Квартира на границе диапазонов приходит в двух частях
+                if sharded:
+                    if record_id in seen:
+                        continue
+                    seen.add(record_id)
+                writer.write(obj)
+        except MyException as error:
+            e = error
+        if e:
+            if not isinstance(e, DeadlineExceeded):
+                logger.error(f'Ошибка при парсинге части поиска {payload}: {e.msg}, подробнее: {e.err}')
+            failed[payload] = e
+            # Записи комплекса получены не полностью: в режимах --diff и --history они не считаются удаленными
+            writer.fail(COMPLEX_NAME)
+            continue
+        writer.flush()
+
+    if pool is not None:
+        pool.close()
+    writer.close()
+    timed_out = [payload for payload, e in failed.items() if isinstance(e, DeadlineExceeded)]
+    if timed_out:
+        logger.warning(f'Время работы истекло, не получены части поиска: {"; ".join(timed_out)}')
+    METRICS.finish('loftfm', options.metrics)
+    # Части поиска, которые не удалось получить, с ошибками
+    return failed
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
+    parser = cli.add_arguments(argparse.ArgumentParser())
     parser.add_argument("--rooms", type=int, nargs='?',
                         const=10, default=False,
                         help="Rooms filter.")
+    parser.add_argument("--shard-rooms", action='store_true',
+                        help="Query every room count separately and concurrently.")
+    parser.add_argument("--shard-prices", type=cli.number_list, default=(),
+                        help="Comma-separated price cut points, e.g. 15000000,30000000: "
+                             "one concurrent query per range.")
+    parser.add_argument("--shard-areas", type=cli.number_list, default=(),
+                        help="Comma-separated area cut points, e.g. 60,120: one concurrent query per range.")
+    parser.add_argument("--promo-rules",
+                        help="JSON file with promo rules appended to the built-in ones, see common/promos.py.")
 
     args = parser.parse_args()
+    if args.promo_rules:
+        configure_promos(PROMO_RULES + load_rules(args.promo_rules))
     rooms_param = ROOM_COUNT if not args.rooms else args.rooms + 1
-    main(room_filter=rooms_param)
+    main(room_filter=rooms_param, options=args, shard_rooms=args.shard_rooms,
+         shard_prices=args.shard_prices, shard_areas=args.shard_areas)
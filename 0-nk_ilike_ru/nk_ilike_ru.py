@@ -3,18 +3,25 @@
 Использует данные из API flatmodels, затем приводит их к формату FIELDS с необходимыми преобразованиями.
 Выводит данные в формате JSON  в поток вывода
 """
-import json
-import http.client
+import argparse
 import logging
+import os
 import sys
-from json import JSONDecodeError
 
-from bs4 import BeautifulSoup
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import cli  # noqa: E402
+from common.client import fetch_json  # noqa: E402
+from common.concurrency import host_of, iter_ordered  # noqa: E402
+from common.discovery import get_subdomains  # noqa: E402
+from common.errors import DeadlineExceeded, MyException  # noqa: E402
+from common.fields import compile_fields  # noqa: E402
+from common.filters import Filter, Range  # noqa: E402
+from common.health import open_health  # noqa: E402
+from common.metrics import METRICS  # noqa: E402
+from common.output import open_output  # noqa: E402
+from common.processes import open_pool  # noqa: E402
 
-FIELDS = ['complex', 'type', 'phase', 'building', 'section', 'price', 'price_base', 'price_finished', 'price_sale',
-          'price_finished_sale', 'area', 'living_area', 'number', 'number_on_site', 'rooms', 'floor', 'in_sale',
-          'sale_status', 'finished', 'currency', 'ceil', 'article', 'finishing_name', 'furniture', 'furniture_price',
-          'plan', 'feature', 'view', 'euro_planning', 'sale', 'discount_percent', 'discount', 'comment']
 MATCHING = {
     'type': {
         'name': 'type',
@@ -81,114 +88,129 @@ MATCHING = {
         'calc': lambda x: str(x) if x else None
     },
 }
+# Матчинг компилируется один раз при импорте
+cast_fields = compile_fields(MATCHING)
+# Фильтр по умолчанию: свободные квартиры дороже 1 и дешевле 10 млн, площадью больше 19 и меньше 96 м2.
+# API отдает все квартиры комплекса, поэтому фильтр проверяется на записях API
+DEFAULT_FILTER = Filter(price=Range(1000000, 10000000, True, True), area=Range(19, 96, True, True), available=True)
+FILTER_KEYS = {'price': 'price', 'area': 'space', 'floor': 'floor', 'rooms': 'room_count'}
 
 
-def cast_fields(record: dict, fields: list, matching: dict):
+def plan_url(record, complex_url):
     """
-    Для каждого поля из fields определяет значение на основе матчинга полей и преобразований типов
+    Ссылка на PDF с планом квартиры
     :param record: Данные из API
-    :param fields: Поля, к которым нужно привести каждую запись
-    :param matching: Данные для матчинга полей и преобразования
+    :param complex_url: Адрес комплекса
     :return:
     """
-    obj = {}
-    # Для каждого поля определяем значение на основе матчинга полей и преобразований типов
-    for field in fields:
-        matching_params = matching.get(field, {})
-        site_field = matching_params.get('name')
-        value = record.get(site_field)
-        calc = matching_params.get('calc')
-        if calc:
-            value = calc(value)
-        obj[field] = value
-    return obj
-
-
-def get_html(address, endpoint, method, payload):
-    if 'https://' in address:
-        address = address.replace('https://', '')
-    if address[-1] == '/':
-        address = address[:-1]
-    conn = http.client.HTTPSConnection(address)
-    conn.request(method, endpoint, payload)
-    res = conn.getresponse()
-    data = res.read()
-    return data.decode("utf-8")
-
-
-def get_subdomains():
-    data = get_html('ilike.ru', '/#complexes', 'GET', '')
-
-    soup = BeautifulSoup(data, 'html.parser')
-    complexes = soup.findAll("li", {"class": "complexes__item"})
-    complex_links = {f'{complex.a.figure.figcaption.h3.text} ({str(complex.a.figure.figcaption.p.text).strip()})': complex.a.attrs['href']
-                     for complex in complexes}
-    return complex_links
-
-
-def process_data(complex_name, complex_url, endpoint):
-    try:
-        data = get_html(complex_url, endpoint, 'GET', '')
-    except Exception as e:
-        raise MyException(f'Сетевая ошибка, вероятно API {endpoint} не реализовано', e)
-    try:
-        json_data = json.loads(data)
-    except JSONDecodeError as e:
-        raise MyException(f'JSON не получен, вероятно API {endpoint} не реализовано', e)
-    # with open('response.json', 'w', encoding='utf-8') as f:
-    #     json.dump(json_data, f)
-    # with open('response.json', encoding='utf-8') as f:
-    #     json_data = json.load(f)
-    json_data = [x for x in json_data if not x['reserved'] and 1000000 < x['price'] < 10000000 and 19 < x['space'] < 96]
-    result = []
-    for record in json_data:
-        if record['reserved']:
-            continue
-        # Получаем основные поля из матчинга
-        obj = cast_fields(record, FIELDS, MATCHING)
+    return f'{complex_url}api/pdf?' \
+           f'flatNumber={record["flat_numer"]}&' \
+           f'cost={record["price"]}&' \
+           f'space={record["space"]}&' \
+           f'section={record["section"]}&' \
+           f'floor={record["floor"]}&' \
+           f'decor={record["decor"]}&' \
+           f'room_count={record["room_count"]}&' \
+           f'house={record["house"]}'
+
+
+def transform(record, complex_name, complex_url):
+    """
+    Приводит запись API к формату FIELDS
+    :param record: Данные из API
+    :param complex_name: Название комплекса
+    :param complex_url: Адрес комплекса
+    :return:
+    """
+    # Получаем основные поля из матчинга
+    return post_process(cast_fields(record), record, complex_name, complex_url)
 
-        if obj['finished']:
-            obj['price_finished'] = obj['price_base']
-            obj['price_base'] = None
-        else:
-            obj['finishing_name'] = None
-        obj['complex'] = complex_name
-        # Ссылка на план
-        obj['plan'] = f'{complex_url}api/pdf?' \
-                      f'flatNumber={record["flat_numer"]}&' \
-                      f'cost={record["price"]}&' \
-                      f'space={record["space"]}&' \
-                      f'section={record["section"]}&' \
-                      f'floor={record["floor"]}&' \
-                      f'decor={record["decor"]}&' \
-                      f'room_count={record["room_count"]}&' \
-                      f'house={record["house"]}'
-        result.append(obj)
 
-    return result
+def post_process(obj, record, complex_name, complex_url):
+    """
+    Дополняет результат матчинга полями, которые зависят от нескольких полей записи и от комплекса
+    :param obj: Результат cast_fields
+    :param record: Данные из API
+    :param complex_name: Название комплекса
+    :param complex_url: Адрес комплекса
+    :return:
+    """
+    if obj['finished']:
+        obj['price_finished'] = obj['price_base']
+        obj['price_base'] = None
+    else:
+        obj['finishing_name'] = None
+    obj['complex'] = complex_name
+    # Ссылка на план
+    obj['plan'] = plan_url(record, complex_url)
+    return obj
 
 
-class MyException(Exception):
-    def __init__(self, msg, err):
-        self.msg = msg
-        self.err = err
+def process_data(complex_name, complex_url, endpoint, accept=None, pool=None):
+    # Записи разбираются потоково, по мере получения ответа, отфильтрованные не преобразуются
+    records = fetch_json(complex_url, endpoint, 'GET', '')
+    if pool is not None:
+        return pool.records(records, accept, (complex_name, complex_url), host_of(complex_url), complex_name)
+    return METRICS.records(records, accept, cast_fields,
+                           lambda obj, record: post_process(obj, record, complex_name, complex_url),
+                           host_of(complex_url), complex_name)
 
 
-def main():
+def main(options=None, stream=None):
+    options = options or cli.default_options()
+    deadline = cli.configure(options)
     logger = logging.getLogger('ilike')
-    complex_links = get_subdomains()
-    result = []
+    with METRICS.stage('discovery'):
+        complex_links = get_subdomains(ttl=options.discovery_ttl, refresh=options.refresh_discovery,
+                                       cache_dir=options.cache_dir)
+    writer = open_output(options, 'nk', stream)
     endpoint = '/api/flatmodels/getAllFlatData'
+    accept = DEFAULT_FILTER.override(options.filter).compile(FILTER_KEYS,
+                                                             available=lambda record: not record['reserved'])
+    pool = open_pool(options, 'nk')
+    health = open_health(options, 'nk')
+    tasks, failed = [], {}
     for complex_name, complex_url in complex_links.items():
+        if health.due(complex_url, endpoint):
+            tasks.append((complex_name, complex_url, endpoint, accept, pool))
+        else:
+            failed[complex_name] = health.skipped(complex_url)
+            writer.fail(complex_name)
+    if failed:
+        logger.warning(f'Пропущены комплексы, API которых не отвечало в прошлых запусках: {", ".join(failed)}')
+    # Комплексы обрабатываются параллельно, самые медленные запускаются первыми,
+    # результаты собираются в порядке обнаружения
+    for (complex_name, complex_url, *_), records, e in iter_ordered(health.track(process_data), tasks,
+                                                                   workers=options.workers,
+                                                                   per_host=options.per_host,
+                                                                   handled=(MyException,),
+                                                                   deadline=deadline,
+                                                                   priority=lambda item: health.priority(item[1])):
         try:
-            result.extend(process_data(complex_name, complex_url, endpoint))
-        except MyException as e:
-            pass
-            # logger.error(f'Ошибка при парсинге {complex_url + endpoint}: {e.msg}, подробнее: {e.err}')
-    output = json.dumps(result, ensure_ascii=False)
-    # Выводим данные в поток
-    sys.stdout.write(output)
+            # В последовательном режиме записи выводятся по мере их обработки
+            if not e:
+                writer.write_all(records)
+        except MyException as error:
+            e = error
+        if e:
+            if not isinstance(e, DeadlineExceeded):
+                logger.error(f'Ошибка при парсинге {complex_url + endpoint}: {e.msg}, подробнее: {e.err}')
+            failed[complex_name] = e
+            writer.fail(complex_name)
+            continue
+        writer.flush()
+    if pool is not None:
+        pool.close()
+    health.save()
+    writer.close()
+    timed_out = [complex_name for complex_name, e in failed.items() if isinstance(e, DeadlineExceeded)]
+    if timed_out:
+        logger.warning(f'Время работы истекло, не получены комплексы: {", ".join(timed_out)}')
+    METRICS.finish('nk', options.metrics)
+    # Комплексы, которые не удалось получить, с ошибками
+    return failed
 
 
 if __name__ == '__main__':
-    main()
+    parser = cli.add_arguments(argparse.ArgumentParser())
+    main(parser.parse_args())
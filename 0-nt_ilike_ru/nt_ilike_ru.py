@@ -3,18 +3,27 @@
 Использует данные из API search, затем приводит их к формату FIELDS с необходимыми преобразованиями.
 Выводит данные в формате JSON  в поток вывода
 """
+import argparse
 import json
-import http.client
 import logging
+import os
 import sys
-from json import JSONDecodeError
+from urllib.parse import parse_qsl, urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import cli  # noqa: E402
+from common.client import fetch_json  # noqa: E402
+from common.concurrency import host_of, iter_ordered  # noqa: E402
+from common.discovery import get_subdomains  # noqa: E402
+from common.errors import DeadlineExceeded, MyException  # noqa: E402
+from common.fields import compile_fields  # noqa: E402
+from common.filters import Filter  # noqa: E402
+from common.health import open_health  # noqa: E402
+from common.metrics import METRICS  # noqa: E402
+from common.output import open_output  # noqa: E402
+from common.processes import open_pool  # noqa: E402
 
-from bs4 import BeautifulSoup
-
-FIELDS = ['complex', 'type', 'phase', 'building', 'section', 'price', 'price_base', 'price_finished', 'price_sale',
-          'price_finished_sale', 'area', 'living_area', 'number', 'number_on_site', 'rooms', 'floor', 'in_sale',
-          'sale_status', 'finished', 'currency', 'ceil', 'article', 'finishing_name', 'furniture', 'furniture_price',
-          'plan', 'feature', 'view', 'euro_planning', 'sale', 'discount_percent', 'discount', 'comment']
 MATCHING = {
         'type': {
         'name': 'type',
@@ -69,101 +78,110 @@ MATCHING = {
         'calc': lambda x: str(x) if x else None
     },
 }
+# Матчинг компилируется один раз при импорте
+cast_fields = compile_fields(MATCHING)
+FILTER_KEYS = {'price': 'price', 'area': 'space', 'floor': 'floor', 'rooms': 'rooms'}
+# Ограничения, которые API search принимает в запросе
+SEARCH_PARAMS = {'price': ('priceMin', 'priceMax'), 'area': ('spaceMin', 'spaceMax'), 'floor': ('floorMin', 'floorMax')}
 
 
-def cast_fields(record: dict, fields: list, matching: dict):
+def plan_url(record, complex_url):
     """
-    Для каждого поля из fields определяет значение на основе матчинга полей и преобразований типов
+    Ссылка на план квартиры: SVG для vb2 и nt, PDF для oblaka, для остальных комплексов плана нет
     :param record: Данные из API
-    :param fields: Поля, к которым нужно привести каждую запись
-    :param matching: Данные для матчинга полей и преобразования
+    :param complex_url: Адрес комплекса
     :return:
     """
-    obj = {}
-    # Для каждого поля определяем значение на основе матчинга полей и преобразований типов
-    for field in fields:
-        matching_params = matching.get(field, {})
-        site_field = matching_params.get('name')
-        value = record.get(site_field)
-        calc = matching_params.get('calc')
-        if calc:
-            value = calc(value)
-        obj[field] = value
+    if complex_url in ['https://vb2.ilike.ru/', 'https://nt.ilike.ru/']:
+        return f'{complex_url}assets/floor-plans/house_{record["house"]}' \
+               f'/section_{record["section"]}' \
+               f'/floor_{record["floor"]}' \
+               f'/{record["floor"]}floor_{record["flat"]}flat.svg'
+    elif complex_url == 'https://oblaka.ilike.ru/':
+        return f'{complex_url}api/pdf?' \
+               f'id={record["_id"]}'
+    return None
+
+
+def transform(record, complex_name, complex_url):
+    """
+    Приводит запись API к формату FIELDS
+    :param record: Данные из API
+    :param complex_name: Название комплекса
+    :param complex_url: Адрес комплекса
+    :return:
+    """
+    # Получаем основные поля из матчинга
+    return post_process(cast_fields(record), record, complex_name, complex_url)
+
+
+def post_process(obj, record, complex_name, complex_url):
+    """
+    Дополняет результат матчинга полями, которые зависят от нескольких полей записи и от комплекса
+    :param obj: Результат cast_fields
+    :param record: Данные из API
+    :param complex_name: Название комплекса
+    :param complex_url: Адрес комплекса
+    :return:
+    """
+    if obj['finished']:
+        obj['price_finished'] = obj['price_base']
+        obj['price_base'] = None
+    obj['complex'] = complex_name
+
+    if not obj['number'] and obj['rooms'] == 1:
+        obj['type'] = 'commercial'
+    # Ссылка на план
+    obj['plan'] = plan_url(record, complex_url)
     return obj
 
 
-def get_html(address, endpoint, method, payload):
-    if 'https://' in address:
-        address = address.replace('https://', '')
-    if address[-1] == '/':
-        address = address[:-1]
-    conn = http.client.HTTPSConnection(address)
-    conn.request(method, endpoint, payload)
-    res = conn.getresponse()
-    data = res.read()
-    return data.decode("utf-8")
-
-
-def get_subdomains():
-    data = get_html('ilike.ru', '/#complexes', 'GET', '')
-
-    soup = BeautifulSoup(data, 'html.parser')
-    complexes = soup.findAll("li", {"class": "complexes__item"})
-    complex_links = {f'{complex.a.figure.figcaption.h3.text} ({str(complex.a.figure.figcaption.p.text).strip()})': complex.a.attrs['href']
-                     for complex in complexes}
-    return complex_links
-
-
-def process_data(complex_name, complex_url, endpoint, payload):
-
-    try:
-        data = get_html(complex_url, endpoint, 'GET', payload)
-    except Exception as e:
-        raise MyException(f'Сетевая ошибка, вероятно API {endpoint} не реализовано', e)
-    try:
-        json_data = json.loads(data)
-    except JSONDecodeError as e:
-        raise MyException(f'JSON не получен, вероятно API {endpoint} не реализовано', e)
-    # with open('response.json', 'w', encoding='utf-8') as f:
-    #     json.dump(json_data, f)
-    # with open('response.json', encoding='utf-8') as f:
-    #     json_data = json.load(f)
-    result = []
-    for record in json_data:
-        # Получаем основные поля из матчинга
-        obj = cast_fields(record, FIELDS, MATCHING)
-
-        if obj['finished']:
-            obj['price_finished'] = obj['price_base']
-            obj['price_base'] = None
-        obj['complex'] = complex_name
-
-        if not obj['number'] and obj['rooms'] == 1:
-            obj['type'] = 'commercial'
-        # Ссылка на план
-        if complex_url in ['https://vb2.ilike.ru/', 'https://nt.ilike.ru/']:
-            obj['plan'] = f'{complex_url}assets/floor-plans/house_{record["house"]}' \
-                          f'/section_{record["section"]}' \
-                          f'/floor_{record["floor"]}' \
-                          f'/{record["floor"]}floor_{record["flat"]}flat.svg'
-        elif complex_url == 'https://oblaka.ilike.ru/':
-            obj['plan'] = f'{complex_url}api/pdf?' \
-                          f'id={record["_id"]}'
-        result.append(obj)
-
-    return result
-
-
-class MyException(Exception):
-    def __init__(self, msg, err):
-        self.msg = msg
-        self.err = err
-
-
-def main():
+def push_filter(endpoint, payload, spec):
+    """
+    Передает ограничения фильтра в запрос к API search: в JSON-тело, если комплекс запрашивается с ним,
+    или в строку запроса, если параметры поиска передаются в ней. Остальным комплексам запрос не меняется
+    :param endpoint: Путь запроса
+    :param payload: Тело запроса
+    :param spec: Фильтр
+    :return: Кортеж (путь, тело)
+    """
+    params = {}
+    for name, (low_key, high_key) in SEARCH_PARAMS.items():
+        bounds = getattr(spec, name)
+        if bounds.low is not None:
+            params[low_key] = bounds.low
+        if bounds.high is not None:
+            params[high_key] = bounds.high
+    if not params:
+        return endpoint, payload
+    if payload:
+        body = json.loads(payload)
+        body['search'].update(params)
+        return endpoint, json.dumps(body, ensure_ascii=False)
+    path, _, query = endpoint.partition('?')
+    if query:
+        return f'{path}?{urlencode(dict(parse_qsl(query), **params))}', payload
+    return endpoint, payload
+
+
+def process_data(complex_name, complex_url, endpoint, payload, accept=None, pool=None):
+    # Записи разбираются потоково, по мере получения ответа, отфильтрованные не преобразуются
+    records = fetch_json(complex_url, endpoint, 'GET', payload)
+    if pool is not None:
+        return pool.records(records, accept, (complex_name, complex_url), host_of(complex_url), complex_name)
+    return METRICS.records(records, accept, cast_fields,
+                           lambda obj, record: post_process(obj, record, complex_name, complex_url),
+                           host_of(complex_url), complex_name)
+
+
+def main(options=None, stream=None):
+    options = options or cli.default_options()
+    deadline = cli.configure(options)
     logger = logging.getLogger('ilike')
-    complex_links = get_subdomains()
-    result = []
+    with METRICS.stage('discovery'):
+        complex_links = get_subdomains(ttl=options.discovery_ttl, refresh=options.refresh_discovery,
+                                       cache_dir=options.cache_dir)
+    writer = open_output(options, 'nt', stream)
     endpoint = '/api/search'
     payloads = {
         'https://nt.ilike.ru/': '{"search":{"spaceMin":17,"spaceMax":120,"priceMin":1400000,"priceMax":8000000,"floorMin":2,"floorMax":17}}',
@@ -175,19 +193,52 @@ def main():
         'https://oblaka.ilike.ru/': '/api/search?spaceMin=10&spaceMax=100&priceMin=1000000&priceMax=10000000&floorMin=2&floorMax=25',
         'https://vb2.ilike.ru/': '/api/search'
     }
+    spec = options.filter or Filter()
+    # Ограничения, заданные в командной строке, проверяются и на записях: не все комплексы принимают их в запросе
+    accept = spec.compile(FILTER_KEYS, available=lambda record: record['status'] in ['1', '4', '8'])
+    pool = open_pool(options, 'nt')
+    health = open_health(options, 'nt')
+    tasks, failed = [], {}
     for complex_name, complex_url in complex_links.items():
+        complex_endpoint, payload = endpoints.get(complex_url, endpoint), payloads.get(complex_url, '')
+        # Состояние API привязано к запросу комплекса без ограничений фильтра
+        if health.due(complex_url, f'{complex_endpoint} {payload}'.rstrip()):
+            tasks.append((complex_name, complex_url, *push_filter(complex_endpoint, payload, spec), accept, pool))
+        else:
+            failed[complex_name] = health.skipped(complex_url)
+            writer.fail(complex_name)
+    if failed:
+        logger.warning(f'Пропущены комплексы, API которых не отвечало в прошлых запусках: {", ".join(failed)}')
+    # Комплексы обрабатываются параллельно, самые медленные запускаются первыми,
+    # результаты собираются в порядке обнаружения
+    for (complex_name, complex_url, complex_endpoint, *_), records, e in iter_ordered(
+            health.track(process_data), tasks, workers=options.workers, per_host=options.per_host,
+            handled=(MyException,), deadline=deadline, priority=lambda item: health.priority(item[1])):
         try:
-            result.extend(process_data(complex_name, complex_url,
-                                       endpoints.get(complex_url, endpoint),
-                                       payloads.get(complex_url, '')))
-        except MyException as e:
-            pass
-            # logger.error(f'Ошибка при парсинге {complex_url + endpoint}: {e.msg}, подробнее: {e.err}')
-    x = [x for x in result if not x['plan']]
-    output = json.dumps(result, ensure_ascii=False)
-    # Выводим данные в поток
-    sys.stdout.write(output)
+            # В последовательном режиме записи выводятся по мере их обработки
+            if not e:
+                writer.write_all(records)
+        except MyException as error:
+            e = error
+        if e:
+            if not isinstance(e, DeadlineExceeded):
+                logger.error(f'Ошибка при парсинге {complex_url + complex_endpoint}: {e.msg}, подробнее: {e.err}')
+            failed[complex_name] = e
+            writer.fail(complex_name)
+            continue
+        writer.flush()
+    if pool is not None:
+        pool.close()
+    health.save()
+    writer.close()
+    timed_out = [complex_name for complex_name, e in failed.items() if isinstance(e, DeadlineExceeded)]
+    if timed_out:
+        logger.warning(f'Время работы истекло, не получены комплексы: {", ".join(timed_out)}')
+    METRICS.finish('nt', options.metrics)
+    # Комплексы, которые не удалось получить, с ошибками
+    return failed
 
 
 if __name__ == '__main__':
-    main()
+    parser = cli.add_arguments(argparse.ArgumentParser())
+    main(parser.parse_args())
@@ -0,0 +1,3 @@
+"""
+Офлайн-бенчмарки и нагрузочные проверки парсеров
+"""
@@ -0,0 +1,139 @@
+"""
+Сквозной нагрузочный прогон парсеров против локального стенда bench/standin.py.
+Для каждого сочетания парсера, числа комплексов и задержки стенда main() парсера выполняется целиком:
+поиск комплексов, запросы, разбор, преобразование и вывод. Выводятся время прогона, запросы в секунду
+и время ответа стенда (p50, p95, p99), измеренное на стороне сервера. Неизвестные аргументы передаются парсерам.
+
+    python bench/loadtest.py --complexes 10 50 200 --latency 0 0.05 --records 500
+    python bench/loadtest.py --stall-rate 0.05 --stall 2 --hedge 95 --deadline 10
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import standin  # noqa: E402
+from bench.microbench import NullStream  # noqa: E402
+from common import cli  # noqa: E402
+from common.errors import MyException  # noqa: E402
+from common.files import cache_path  # noqa: E402
+from common.parsers import PARSERS, load_parser  # noqa: E402
+
+
+def percentile(values: list, q: float):
+    """
+    Перцентиль по ближайшему рангу
+    :param values: Отсортированные значения
+    :param q: Доля от 0 до 1
+    :return:
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+
+def run_parser(name: str, options):
+    """
+    Выполняет main() парсера, вывод отбрасывается
+    :return: Кортеж (число выведенных символов, число неполученных комплексов, текст ошибки или None)
+    """
+    module = load_parser(name)
+    stream = NullStream()
+    failed = error = None
+    with contextlib.redirect_stdout(stream):
+        try:
+            failed = module.main(options=options)
+        except MyException as e:
+            error = str(e)
+    return stream.size, len(failed or ()), error
+
+
+def run_load(parsers, complexes, latencies, records: int = 1000, workers=None, jitter: float = 0.0,
+             error_rate: float = 0.0, non_json_rate: float = 0.0, stall_rate: float = 0.0, stall: float = 0.0,
+             seed: int = 0, parser_args=()):
+    site = standin.StandIn(records=records, jitter=jitter, error_rate=error_rate, non_json_rate=non_json_rate,
+                           stall_rate=stall_rate, stall=stall, seed=seed)
+    server = standin.start(site)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            options = cli.add_arguments(argparse.ArgumentParser()).parse_args(list(parser_args))
+            options.target = server.url
+            options.cache_dir = cache_dir
+            options.discovery_ttl = 0
+            if workers is not None:
+                options.workers = workers
+            for name in parsers:
+                # loftfm не зависит от числа комплексов
+                for count in complexes if name != 'loftfm' else complexes[:1]:
+                    for latency in latencies:
+                        site.complexes, site.latency = count, latency
+                        # Состояние API комплексов не переходит из прогона в прогон: иначе комплексы, не ответившие
+                        # в прошлых прогонах, пропускались бы. За прогрев комплекс не успевает попасть в пропуск
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(cache_path('health', f'{name}.json', cache_dir=cache_dir))
+                        # Прогрев: тела ответов генерируются вне измерения
+                        run_parser(name, options)
+                        site.reset()
+                        start = time.perf_counter()
+                        size, failed, error = run_parser(name, options)
+                        wall = time.perf_counter() - start
+                        timings = sorted(seconds for _, seconds in site.reset())
+                        row = {
+                            'parser': name,
+                            'complexes': count if name != 'loftfm' else None,
+                            'latency': latency,
+                            'wall': wall,
+                            'requests': len(timings),
+                            'requests_per_sec': len(timings) / wall if wall else None,
+                            'p50': percentile(timings, 0.5),
+                            'p95': percentile(timings, 0.95),
+                            'p99': percentile(timings, 0.99),
+                            'output_bytes': size,
+                            'failed': failed,
+                            'error': error,
+                        }
+                        results.append(row)
+                        print_row(row)
+    finally:
+        server.shutdown()
+    return results
+
+
+def print_row(row: dict):
+    ms = [f'{row[q] * 1000:8.1f}' if row[q] is not None else f"{'-':>8}" for q in ('p50', 'p95', 'p99')]
+    complexes = row['complexes'] if row['complexes'] is not None else '-'
+    print(f"{row['parser']:8} {complexes:>9} {row['latency']:8.3f} {row['wall']:8.2f} {row['requests']:8} "
+          f"{row['requests_per_sec']:8.1f} {' '.join(ms)} {row['output_bytes']:12,} {row['failed']:6} "
+          f"{row['error'] or ''}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load test of the parsers against the local stand-in.')
+    parser.add_argument('--parsers', nargs='+', choices=list(PARSERS), default=list(PARSERS))
+    parser.add_argument('--complexes', nargs='+', type=int, default=[10, 50],
+                        help='Complex counts on the stand-in landing page.')
+    parser.add_argument('--latency', nargs='+', type=float, default=[0.0, 0.05],
+                        help='Stand-in response delays to test, seconds.')
+    parser.add_argument('--records', type=int, default=1000, help='Records per API response.')
+    parser.add_argument('--workers', type=int, help='Parser --workers, by default the parser default.')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--non-json-rate', type=float, default=0.0)
+    parser.add_argument('--stall-rate', type=float, default=0.0)
+    parser.add_argument('--stall', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args, parser_args = parser.parse_known_args()
+
+    print(f"{'parser':8} {'complexes':>9} {'latency':>8} {'wall s':>8} {'requests':>8} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'output bytes':>12} {'failed':>6}")
+    run_load(args.parsers, args.complexes, args.latency, args.records, args.workers, args.jitter,
+             args.error_rate, args.non_json_rate, args.stall_rate, args.stall, args.seed, parser_args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Микробенчмарки горячего пути парсеров на синтетических ответах, без сети.
+Для каждого парсера и размера ответа отдельно измеряются этапы: потоковый разбор JSON, cast_fields,
+построение ссылки на план (nk, nt), check_sales_and_finishing (loftfm), полное преобразование записи и вывод JSON.
+Выводит записи в секунду и пиковую память каждого этапа, умеет сохранять результат и сравнивать его с сохраненным.
+
+    python bench/microbench.py --sizes 1000 100000 --save bench/baseline.json
+    python bench/microbench.py --compare bench/baseline.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.payloads import PAYLOADS, chunked, encode  # noqa: E402
+from common.fields import FIELDS  # noqa: E402
+from common.fields import cast_fields as cast_fields_interpreted  # noqa: E402
+from common.jsonstream import iter_items  # noqa: E402
+from common.output import make_writer  # noqa: E402
+from common.parsers import load_parser  # noqa: E402
+
+SIZES = [1000, 100000]
+COMPLEXES = {
+    'nk': ('Новокрасково (МО)', 'https://nk.ilike.ru/'),
+    'nt': ('Нахабино (МО)', 'https://nt.ilike.ru/'),
+}
+
+
+class NullStream:
+    """
+    Поток вывода, который только считает символы
+    """
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data: str):
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+
+def serialize(objs):
+    writer = make_writer('json', NullStream())
+    writer.write_all(objs)
+    writer.close()
+
+
+def stages(name: str, n: int, seed: int = 0):
+    """
+    Этапы бенчмарка парсера: список кортежей (этап, подготовка входа, измеряемая функция)
+    :param name: Имя парсера
+    :param n: Число записей в ответе
+    :param seed: Seed генератора данных
+    :return:
+    """
+    module = load_parser(name)
+    payload = PAYLOADS[name](n, seed)
+    chunks = chunked(encode(payload))
+    if name == 'loftfm':
+        path, records = ('data',), payload['data']
+    else:
+        path, records = (), payload
+    del payload
+    matching = module.MATCHING
+    cast_fields = module.cast_fields
+    result = [
+        ('decode', lambda: chunks, lambda c: list(iter_items(c, path))),
+        ('cast_interpreted', lambda: records, lambda rs: [cast_fields_interpreted(r, FIELDS, matching) for r in rs]),
+        ('cast', lambda: records, lambda rs: [cast_fields(r) for r in rs]),
+    ]
+    if name == 'loftfm':
+        check = module.check_sales_and_finishing
+        transform = module.transform
+        result += [
+            ('sales', lambda: [cast_fields(r) for r in records], lambda objs: [check(obj) for obj in objs]),
+            ('transform', lambda: records, lambda rs: [transform(r) for r in rs]),
+        ]
+        objs = [transform(r) for r in records]
+    else:
+        complex_name, complex_url = COMPLEXES[name]
+        plan_url = module.plan_url
+        transform = module.transform
+        result += [
+            ('plan', lambda: records, lambda rs: [plan_url(r, complex_url) for r in rs]),
+            ('transform', lambda: records, lambda rs: [transform(r, complex_name, complex_url) for r in rs]),
+        ]
+        objs = [transform(r, complex_name, complex_url) for r in records]
+    result.append(('serialize', lambda: objs, serialize))
+    return result
+
+
+def measure(prepare, run, repeat: int, memory: bool):
+    """
+    Возвращает лучшее время из repeat запусков и пиковую память одного запуска в байтах
+    :return:
+    """
+    best = None
+    for _ in range(repeat):
+        arg = prepare()
+        gc.collect()
+        start = time.perf_counter()
+        run(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del arg
+    peak = None
+    if memory:
+        arg = prepare()
+        gc.collect()
+        tracemalloc.start()
+        run(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(parsers, sizes, repeat: int = 3, memory: bool = True, seed: int = 0):
+    results = {}
+    for name in parsers:
+        for n in sizes:
+            for stage, prepare, run in stages(name, n, seed):
+                seconds, peak = measure(prepare, run, repeat if n <= 100000 else 1, memory)
+                key = f'{name}.{stage}.{n}'
+                results[key] = {
+                    'records': n,
+                    'seconds': seconds,
+                    'records_per_sec': n / seconds if seconds else None,
+                    'peak_mb': peak / 1e6 if peak is not None else None,
+                }
+                print_row(key, results[key])
+    return results
+
+
+def print_row(key: str, row: dict, note: str = ''):
+    peak = f"{row['peak_mb']:10.1f}" if row['peak_mb'] is not None else f"{'-':>10}"
+    print(f"{key:32} {row['records_per_sec']:14,.0f} {peak} {note}", flush=True)
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """
+    Сравнивает записи в секунду с сохраненным результатом
+    :return: Список ключей этапов, замедлившихся больше чем на threshold
+    """
+    regressions = []
+    print(f"\n{'stage':32} {'baseline rec/s':>14} {'current rec/s':>14} {'ratio':>7}")
+    for key, row in results.items():
+        old = baseline.get(key)
+        if not old or not old.get('records_per_sec') or not row['records_per_sec']:
+            continue
+        ratio = row['records_per_sec'] / old['records_per_sec']
+        mark = ''
+        if ratio < 1 - threshold:
+            mark = 'REGRESSION'
+            regressions.append(key)
+        print(f"{key:32} {old['records_per_sec']:14,.0f} {row['records_per_sec']:14,.0f} {ratio:7.2f} {mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline microbenchmarks of the parsers transform path.')
+    parser.add_argument('--parsers', nargs='+', choices=list(PAYLOADS), default=list(PAYLOADS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES,
+                        help='Records per synthetic response, e.g. 1000 100000 1000000.')
+    parser.add_argument('--repeat', type=int, default=3, help='Best of N runs, sizes above 100k run once.')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc peak memory pass.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='Write results to a JSON file to use as a baseline.')
+    parser.add_argument('--compare', help='Baseline JSON file to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed slowdown relative to the baseline, 0.2 means 20%%.')
+    args = parser.parse_args()
+
+    print(f"{'stage':32} {'records/sec':>14} {'peak MB':>10}")
+    results = run_benchmarks(args.parsers, args.sizes, args.repeat, not args.no_memory, args.seed)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} stage(s) slower than baseline by more than {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Синтетические ответы API в форме ответов сайтов nk.ilike.ru, nt.ilike.ru и loftfm.mrloft.ru.
+Генерация детерминирована при одинаковом seed.
+"""
+import json
+import random
+
+NK_TYPES = ['Квартира', 'Студия', 'Аппартаменты', 'Кладовая', 'Машиноместо']
+NK_DECOR = [-1, -1, -1, 1, 3, 4]
+
+NT_STATUSES = [('1', 'Свободно'), ('4', 'Свободно'), ('8', 'Акция'), ('2', 'Забронировано'), ('3', 'Продано')]
+NT_DECORATIONS = [('00', 'Без отделки'), ('00', 'Без отделки'), ('01', 'Предчистовая'), ('02', 'Чистовая')]
+
+LOFTFM_PROMOS = [
+    None,
+    None,
+    '',
+    'Акция!!! Цена указана с учетом скидки в размере 944 129 рублей!',
+    'Акция!!! Цена указана с учетом скидки в размере 733 076 рублей !',
+    'Акция!!! Цена указана с учетом скидки 659 708 рублей !',
+    'Акция!!! Цена указана с учетом скидки в размере 525 163 рублей!!! ',
+    'Акция!!! Предчистовая отделка в подарок !',
+    'Акция!!! Чистовая отделка в подарок! Цена указана с учетом скидки в размере 412 000 рублей!',
+]
+LOFTFM_TYPES = [
+    [{'id': 1, 'name': 'Апартаменты'}],
+    [{'id': 1, 'name': 'Апартаменты'}, {'id': 3, 'name': 'С террасой'}],
+    [{'id': 4, 'name': 'Офисы'}, {'id': 5, 'name': 'Ритейл, Ресторан'}],
+]
+
+
+def nk_records(n: int, seed: int = 0):
+    rnd = random.Random(seed)
+    records = []
+    for i in range(n):
+        house, section, floor = rnd.randint(1, 9), rnd.randint(1, 6), rnd.randint(1, 17)
+        room_count = rnd.randint(0, 4)
+        decor = rnd.choice(NK_DECOR)
+        furniture = []
+        if decor in (3, 4) and rnd.random() < 0.5:
+            furniture = [{'price': rnd.randint(100, 900) * 1000, 'name': f'Комплект {j}'} for j in range(rnd.randint(1, 3))]
+        records.append({
+            'uid': f'НК-{house}-{section:02}-{floor:02}-{i % 12:02}-{i:05}',
+            'house': house,
+            'floor': floor,
+            'price': round(rnd.uniform(900000, 11000000), 2),
+            'space': round(rnd.uniform(18, 100), 2),
+            'room_count': room_count,
+            'isEuro': rnd.random() < 0.2,
+            'flat_numer': i + 1,
+            'section': section,
+            'type': rnd.choice(NK_TYPES) if room_count else 'Студия',
+            'reserved': rnd.random() < 0.15,
+            'decor': decor,
+            'furniture': furniture,
+        })
+    return records
+
+
+def nt_records(n: int, seed: int = 0):
+    rnd = random.Random(seed)
+    records = []
+    for i in range(n):
+        section, floor = rnd.randint(1, 4), rnd.randint(2, 25)
+        status, status_name = rnd.choice(NT_STATUSES)
+        decoration, decoration_name = rnd.choice(NT_DECORATIONS)
+        flat = '' if rnd.random() < 0.05 else str(i + 1)
+        records.append({
+            '_id': f'{0x5f7d922020459d6f60409000 + i:024x}',
+            'type': 'КВ',
+            'flat': flat,
+            'house': rnd.randint(1, 3),
+            'section': str(section),
+            'floor': floor,
+            'article': f'ОБ-КВ-{section:02}-{floor:02}-{i % 12:02}-{i}',
+            'status': status,
+            'statusName': status_name,
+            'decoration': decoration,
+            'decorationName': decoration_name,
+            'rooms': str(rnd.randint(0, 3)),
+            'space': round(rnd.uniform(17, 120), 1),
+            'price': round(rnd.uniform(1400000, 9000000), 2),
+        })
+    return records
+
+
+def loftfm_payload(n: int, seed: int = 0):
+    rnd = random.Random(seed)
+    data = []
+    for i in range(n):
+        price = rnd.randint(8000, 60000) * 1000
+        plan = [[f'http://mrloft.ru/files/flat/{6500 + i}/Lot_{i}.png']] if rnd.random() < 0.9 else []
+        data.append({
+            'id': 6500 + i,
+            'number': str(100 + i),
+            's': round(rnd.uniform(30, 200), 1),
+            's_living': rnd.choice([0, round(rnd.uniform(20, 150), 1)]),
+            'floor': rnd.randint(1, 9),
+            'rooms': rnd.randint(0, 5),
+            'description': '<p><span>Лофт в ЖК LOFT FM, Таганский район</span></p>' * 3,
+            'price': f" <font>{price:,}<span style='display:none' itemprop='priceCurrency'>RUB</span> "
+                     f"<i class=\"fa fa-rub\"></i></font>".replace(',', ' '),
+            'priceToSort': str(price),
+            'special_text': rnd.choice(LOFTFM_PROMOS),
+            'sold': rnd.random() < 0.2,
+            'reserved': rnd.random() < 0.1,
+            'ipoteka': True,
+            'house_id': 134,
+            'plan_url': plan,
+            'first_plan_url': plan,
+            'type': rnd.choice(LOFTFM_TYPES),
+        })
+    return {'success': True, 'data': data}
+
+
+PAYLOADS = {
+    'nk': nk_records,
+    'nt': nt_records,
+    'loftfm': loftfm_payload,
+}
+
+
+def encode(payload):
+    """
+    Сериализует ответ так же, как сайты: JSON с экранированием не-ASCII символов
+    :param payload: Данные ответа
+    :return:
+    """
+    return json.dumps(payload).encode('utf-8')
+
+
+def chunked(body: bytes, size: int = 64 * 1024):
+    return [body[i:i + size] for i in range(0, len(body), size)]
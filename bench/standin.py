@@ -0,0 +1,328 @@
+"""
+Локальный стенд, заменяющий ilike.ru, его комплексы и loftfm.mrloft.ru для сквозных прогонов парсеров.
+Сайт определяется по заголовку Host, поэтому парсеры направляются на стенд аргументом --target:
+
+    python bench/standin.py --port 8080 --complexes 50 --records 2000 --latency 0.05
+    python 0-nk_ilike_ru/nk_ilike_ru.py --target http://127.0.0.1:8080
+
+Главная страница содержит заданное число комплексов, комплексы отдают синтетические ответы из bench/payloads.py.
+Задержка, доля ответов 500 и доля ответов не в формате JSON настраиваются.
+Ссылки на планы отвечают одним из PLAN_VARIANTS небольших файлов с ETag, на HEAD - только заголовками.
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import random
+import ssl
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.payloads import encode, loftfm_payload, nk_records, nt_records  # noqa: E402
+
+# Комплексы, для которых в парсерах есть особые правила, идут в начале списка
+KNOWN_COMPLEXES = [
+    ('nk', 'Новокрасково', 'МО'),
+    ('nt', 'Нахабино', 'МО'),
+    ('oblaka', 'Облака', 'Москва'),
+    ('vb2', 'Видное 2', 'МО'),
+]
+# Число различных файлов планов: у многих квартир один план
+PLAN_VARIANTS = 8
+HTML_PAGE = '<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>{}</body></html>'
+
+
+def plan_file(path: str):
+    """
+    Содержимое плана: один из PLAN_VARIANTS файлов, выбранный по адресу
+    :param path: Путь запроса
+    :return: Байты
+    """
+    variant = zlib.crc32(path.encode('utf-8')) % PLAN_VARIANTS
+    return f'plan {variant}\n'.encode('utf-8') * 256
+
+
+def loftfm_search(payload: dict, form: str):
+    """
+    Отбирает квартиры loftfm по параметрам поиска, как API сайта: границы площади и цены включаются
+    :param payload: Ответ со всеми квартирами
+    :param form: Тело запроса поиска
+    :return:
+    """
+    params = parse_qs(form)
+    if not params:
+        return payload
+
+    def bound(name, default):
+        return float(params[name][0]) if name in params else default
+
+    min_s, max_s = bound('min_s', float('-inf')), bound('max_s', float('inf'))
+    min_price, max_price = bound('min_price', float('-inf')), bound('max_price', float('inf'))
+    rooms = {int(room) for room in params.get('room[]', [])}
+    data = [record for record in payload['data']
+            if min_s <= record['s'] <= max_s and min_price <= int(record['priceToSort']) <= max_price
+            and (not rooms or record['rooms'] in rooms)]
+    return dict(payload, data=data)
+
+
+def complexes(count: int):
+    """
+    Список комплексов стенда: кортежи (поддомен, название, регион)
+    :param count: Число комплексов
+    :return:
+    """
+    result = KNOWN_COMPLEXES[:count]
+    for i in range(len(result), count):
+        result.append((f'c{i}', f'Комплекс {i}', 'МО'))
+    return result
+
+
+class StandIn:
+    """
+    Содержимое стенда и статистика запросов. Тела ответов генерируются один раз на хост и хранятся вместе с gzip-версией
+    """
+    def __init__(self, complexes: int = 20, records: int = 1000, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, non_json_rate: float = 0.0, stall_rate: float = 0.0, stall: float = 0.0,
+                 seed: int = 0):
+        """
+        :param complexes: Число комплексов на главной странице
+        :param records: Число записей в ответе API комплекса или loftfm
+        :param latency: Задержка перед ответом, секунды
+        :param jitter: Случайная добавка к задержке от 0 до jitter, секунды
+        :param error_rate: Доля ответов 500
+        :param non_json_rate: Доля ответов API страницей HTML вместо JSON
+        :param stall_rate: Доля ответов, задержанных дополнительно на stall секунд
+        :param stall: Дополнительная задержка зависших ответов, секунды
+        :param seed: Seed генератора данных и ошибок
+        """
+        self.complexes = complexes
+        self.records = records
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.non_json_rate = non_json_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.bodies = {}
+        self.payloads = {}
+        self.timings = []
+        self.lock = threading.Lock()
+
+    def landing(self):
+        items = ''.join(
+            f'<li class="complexes__item"><a href="https://{subdomain}.ilike.ru/"><figure><img src="/{subdomain}.jpg">'
+            f'<figcaption><h3>{title}</h3><p> {region} </p></figcaption></figure></a></li>'
+            for subdomain, title, region in complexes(self.complexes))
+        return HTML_PAGE.format(f'<section id="complexes"><ul class="complexes">{items}</ul></section>').encode('utf-8')
+
+    def body(self, kind: str, host: str, form: str = ''):
+        """
+        Тело ответа и его gzip-версия, генерируются при первом запросе
+        :param kind: landing, nk, nt или loftfm
+        :param host: Хост сайта, от него зависит seed данных
+        :param form: Тело запроса поиска loftfm
+        :return: Кортеж (тело, тело в gzip)
+        """
+        key = (kind, host, form, self.complexes, self.records)
+        with self.lock:
+            cached = self.bodies.get(key)
+        if cached is None:
+            seed = self.seed ^ zlib.crc32(host.encode('utf-8'))
+            if kind == 'landing':
+                raw = self.landing()
+            elif kind == 'nk':
+                raw = encode(nk_records(self.records, seed))
+            elif kind == 'nt':
+                raw = encode(nt_records(self.records, seed))
+            else:
+                # Все квартиры генерируются один раз, запросы с разными параметрами поиска только отбирают их
+                with self.lock:
+                    payload = self.payloads.get((host, self.records))
+                if payload is None:
+                    payload = self.payloads[(host, self.records)] = loftfm_payload(self.records, seed)
+                raw = encode(loftfm_search(payload, form))
+            cached = (raw, gzip.compress(raw, compresslevel=5))
+            with self.lock:
+                self.bodies[key] = cached
+        return cached
+
+    def route(self, method: str, host: str, path: str):
+        """
+        Выбирает ответ на запрос
+        :return: Кортеж (статус, Content-Type, вид тела или само тело в байтах)
+        """
+        path = path.split('#', 1)[0]
+        if host == 'ilike.ru':
+            return 200, 'text/html; charset=utf-8', 'landing'
+        if host == 'loftfm.mrloft.ru':
+            if method == 'POST' and path.startswith('/getflatdatasearchLoftfm'):
+                return 200, 'application/json', 'loftfm'
+        elif host.endswith('.ilike.ru'):
+            if path.startswith('/api/flatmodels/getAllFlatData'):
+                return 200, 'application/json', 'nk'
+            if path.startswith('/api/search'):
+                return 200, 'application/json', 'nt'
+            if path.startswith('/api/pdf') or path.startswith('/assets/floor-plans/'):
+                return 200, 'application/octet-stream', plan_file(path)
+        elif host == 'mrloft.ru' and path.startswith('/files/flat/'):
+            return 200, 'application/octet-stream', plan_file(path)
+        return 404, 'text/html; charset=utf-8', HTML_PAGE.format('<h1>Страница не найдена</h1>').encode('utf-8')
+
+    def respond(self, method: str, host: str, path: str, accept_gzip: bool, form: str = ''):
+        """
+        Ответ на запрос с учетом внесенных ошибок
+        :return: Кортеж (статус, заголовки, тело)
+        """
+        status, content_type, body = self.route(method, host, path)
+        if status == 200 and content_type == 'application/json':
+            roll = self.random.random()
+            if roll < self.error_rate:
+                status, content_type = 500, 'text/html; charset=utf-8'
+                body = HTML_PAGE.format('<h1>Internal Server Error</h1>').encode('utf-8')
+            elif roll < self.error_rate + self.non_json_rate:
+                content_type = 'text/html; charset=utf-8'
+                body = HTML_PAGE.format('<div id="app"></div>').encode('utf-8')
+        headers = {'Content-Type': content_type}
+        if content_type == 'application/octet-stream':
+            headers['ETag'] = f'"{hashlib.md5(body).hexdigest()}"'
+        if isinstance(body, str):
+            raw, compressed = self.body(body, host, form if body == 'loftfm' else '')
+            if accept_gzip:
+                body = compressed
+                headers['Content-Encoding'] = 'gzip'
+            else:
+                body = raw
+        return status, headers, body
+
+    def delay(self):
+        seconds = self.latency + self.random.uniform(0, self.jitter)
+        if self.stall_rate and self.random.random() < self.stall_rate:
+            seconds += self.stall
+        if seconds:
+            time.sleep(seconds)
+
+    def record(self, path: str, seconds: float):
+        with self.lock:
+            self.timings.append((path, seconds))
+
+    def reset(self):
+        """
+        Сбрасывает статистику запросов и возвращает накопленную
+        :return: Список кортежей (путь, время ответа в секундах)
+        """
+        with self.lock:
+            timings, self.timings = self.timings, []
+        return timings
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело отправляются отдельно: без TCP_NODELAY мелкие ответы ждут подтверждения клиента
+    disable_nagle_algorithm = True
+
+    def handle_request(self):
+        start = time.perf_counter()
+        length = int(self.headers.get('Content-Length') or 0)
+        form = self.rfile.read(length).decode('utf-8') if length else ''
+        standin = self.server.standin
+        host = (self.headers.get('Host') or '').rsplit(':', 1)[0]
+        standin.delay()
+        accept_gzip = 'gzip' in (self.headers.get('Accept-Encoding') or '')
+        status, headers, body = standin.respond(self.command, host, self.path, accept_gzip, form)
+        if 'ETag' in headers and headers['ETag'] == self.headers.get('If-None-Match'):
+            status, body = 304, b''
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        self.wfile.flush()
+        standin.record(self.path, time.perf_counter() - start)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_HEAD = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, standin: StandIn):
+        super().__init__(address, Handler)
+        self.standin = standin
+
+    def handle_error(self, request, client_address):
+        # Клиент закрыл соединение, не дочитав ответ, например опоздавший дублирующий запрос
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        scheme = 'https' if isinstance(self.socket, ssl.SSLSocket) else 'http'
+        host, port = self.server_address[:2]
+        return f'{scheme}://{host}:{port}'
+
+
+def start(standin: StandIn, host: str = '127.0.0.1', port: int = 0, certfile: str = None, keyfile: str = None):
+    """
+    Запускает стенд в фоновом потоке
+    :param standin: Содержимое стенда
+    :param host: Адрес, на котором слушает сервер
+    :param port: Порт, 0 - любой свободный
+    :param certfile: Сертификат для HTTPS, без него сервер работает по HTTP
+    :param keyfile: Закрытый ключ сертификата
+    :return: StandInServer, адрес для --target в атрибуте url
+    """
+    server = StandInServer((host, port), standin)
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for ilike.ru and loftfm.mrloft.ru.')
+    parser.add_argument('--complexes', type=int, default=20, help='Complexes listed on the ilike.ru landing page.')
+    parser.add_argument('--records', type=int, default=1000, help='Records per API response.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Delay before every response, seconds.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random extra delay up to this value, seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of API responses answered with 500.')
+    parser.add_argument('--non-json-rate', type=float, default=0.0,
+                        help='Share of API responses answered with an HTML page instead of JSON.')
+    parser.add_argument('--stall-rate', type=float, default=0.0, help='Share of responses delayed by --stall.')
+    parser.add_argument('--stall', type=float, default=0.0, help='Extra delay of stalled responses, seconds.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--certfile', help='Serve HTTPS with this certificate, the client must trust it.')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+    standin = StandIn(args.complexes, args.records, args.latency, args.jitter,
+                      args.error_rate, args.non_json_rate, args.stall_rate, args.stall, args.seed)
+    server = start(standin, args.host, args.port, args.certfile, args.keyfile)
+    print(f'Serving on {server.url}, run parsers with --target {server.url}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""
+Общий код парсеров: сетевой слой, преобразование полей, вывод данных.
+Скрипты парсеров добавляют корень репозитория в sys.path и импортируют модули отсюда.
+"""
@@ -0,0 +1,128 @@
+"""
+Дисковый кэш ответов HTTP.
+Запись кэша - один файл pickle: сначала метаданные ответа (ETag, Last-Modified), затем части тела
+или уже разобранные записи JSON. При повторном запросе отправляются If-None-Match/If-Modified-Since,
+на ответ 304 данные берутся из кэша без скачивания и без разбора JSON.
+В режиме replay все ответы отдаются только из кэша, сеть не используется.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+from common.files import cache_path
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+class CacheEntry:
+    """
+    Запись кэша для одного запроса
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._meta = None
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    self._meta = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self._meta = {}
+        return self._meta
+
+    def exists(self):
+        return bool(self.meta)
+
+    def validators(self):
+        """
+        Заголовки условного запроса по сохраненному ответу
+        :return:
+        """
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+    def load(self):
+        """
+        Отдает сохраненные элементы: части тела или записи
+        :return:
+        """
+        with open(self.path, 'rb') as f:
+            pickle.load(f)
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+
+    def writer(self, res):
+        return EntryWriter(self, res)
+
+
+class EntryWriter:
+    """
+    Пишет новую версию записи во временный файл и заменяет ею старую только после полного получения ответа
+    """
+    def __init__(self, entry: CacheEntry, res):
+        self.entry = entry
+        fd, self.tmp = tempfile.mkstemp(dir=os.path.dirname(entry.path), prefix='.tmp-')
+        self.file = os.fdopen(fd, 'wb')
+        self.meta = {
+            'etag': res.getheader('ETag'),
+            'last_modified': res.getheader('Last-Modified'),
+            'stored': time.time(),
+        }
+        self.pickler = pickle.Pickler(self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.done = False
+        self.dump(self.meta)
+
+    def dump(self, item):
+        # Каждый элемент пишется самостоятельным pickle, без ссылок на ранее записанные объекты
+        self.pickler.clear_memo()
+        self.pickler.dump(item)
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp, self.entry.path)
+        self.entry._meta = self.meta
+        self.done = True
+
+    def abort(self):
+        if not self.done:
+            self.file.close()
+            os.unlink(self.tmp)
+            self.done = True
+
+
+class ResponseCache:
+    """
+    Кэш ответов в каталоге cache_dir/responses
+    """
+    def __init__(self, cache_dir: str = None, replay: bool = False):
+        self.cache_dir = cache_dir
+        self.replay = replay
+
+    def entry(self, host: str, method: str, endpoint: str, payload, kind: str = 'body'):
+        """
+        Возвращает запись кэша для запроса
+        :param host: Хост
+        :param method: HTTP-метод
+        :param endpoint: Путь запроса
+        :param payload: Тело запроса
+        :param kind: Что хранится в записи: 'body' - части тела, иначе описание разобранных записей
+        :return:
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8', 'replace')
+        key = hashlib.sha256(json.dumps([host, method, endpoint, payload or '', kind]).encode('utf-8')).hexdigest()
+        return CacheEntry(cache_path('responses', key[:2], f'{key}.pickle', cache_dir=self.cache_dir))
@@ -0,0 +1,141 @@
+"""
+Общие аргументы командной строки парсеров
+"""
+import argparse
+import time
+
+from common import client, columnar, concurrency, discovery, files, filters, output, resilience
+from common.cache import ResponseCache
+from common.metrics import METRICS, PROFILERS
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """
+    Добавляет в parser аргументы, общие для всех парсеров
+    :param parser: Парсер аргументов скрипта
+    :return:
+    """
+    parser.add_argument("--workers", type=int, default=concurrency.WORKERS,
+                        help="Global concurrency limit, 1 disables parallel fetching.")
+    parser.add_argument("--per-host", type=int, default=concurrency.PER_HOST,
+                        help="Concurrency limit per host.")
+    parser.add_argument("--pool-size", type=int, default=client.POOL_SIZE,
+                        help="Max keep-alive connections per host.")
+    parser.add_argument("--connect-timeout", type=float, default=client.CONNECT_TIMEOUT,
+                        help="Connect timeout, seconds.")
+    parser.add_argument("--read-timeout", type=float, default=client.READ_TIMEOUT,
+                        help="Socket read timeout, seconds.")
+    parser.add_argument("--retries", type=int, default=resilience.RETRIES,
+                        help="Retries of transient failures: network errors, timeouts, 429 and 5xx responses.")
+    parser.add_argument("--retry-backoff", type=float, default=resilience.BACKOFF,
+                        help="Base retry delay, seconds, doubled on every attempt with random jitter.")
+    parser.add_argument("--hedge", type=float, metavar='PERCENTILE',
+                        help="Send a duplicate request when a host is slower than this percentile of its "
+                             "recent response times, e.g. 95. Off by default.")
+    parser.add_argument("--deadline", type=float,
+                        help="Time limit for the whole run, seconds: unfinished complexes are reported as failed "
+                             "and the partial result is written.")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Convert records in this many worker processes, in batches, keeping their order. "
+                             "Pays off on very large responses and several free cores; 0 or 1 converts "
+                             "in the main process.")
+    parser.add_argument("--target",
+                        help="Send every request to this server instead of the real hosts, keeping the Host "
+                             "header, e.g. http://127.0.0.1:8080 for the bench/standin.py stand-in.")
+    parser.add_argument("--format", choices=output.FORMATS, default='json',
+                        help="Output format: one JSON array at the end (default), "
+                             "JSON array streamed per record, NDJSON, or compressed binary column blocks "
+                             "(read with python -m common.columnar).")
+    parser.add_argument("--compression", choices=columnar.COMPRESSIONS, default='gzip',
+                        help="Compression of the columnar format, zstd needs the zstandard package.")
+    parser.add_argument("--cache-dir", default=files.CACHE_DIR,
+                        help="Directory for local caches and indexes.")
+    parser.add_argument("--discovery-ttl", type=float, default=discovery.DISCOVERY_TTL,
+                        help="Lifetime of cached ilike.ru complex list, seconds, 0 disables the cache.")
+    parser.add_argument("--refresh-discovery", action='store_true',
+                        help="Ignore cached complex list and fetch ilike.ru again.")
+    parser.add_argument("--http-cache", action='store_true',
+                        help="Keep responses on disk and revalidate them with ETag/If-Modified-Since.")
+    parser.add_argument("--replay", action='store_true',
+                        help="Serve every request from the response cache, without network.")
+    parser.add_argument("--recheck-broken", action='store_true',
+                        help="Query complexes whose API failed in previous runs now, instead of waiting "
+                             "for their backoff to expire.")
+    parser.add_argument("--filter", type=filters.parse_filter,
+                        help="Listing filter, e.g. "
+                             "'price=1000000..10000000,area=19..96,floor=2..,rooms=..3,available'. "
+                             "Bounds are pushed into the API query where supported and checked before conversion "
+                             "otherwise; they override the parser's own defaults.")
+    parser.add_argument("--diff", action='store_true',
+                        help="Output only listings added, changed or removed since the previous --diff run.")
+    parser.add_argument("--history", nargs='?', const='', metavar='PATH',
+                        help="Store changed listings in a SQLite price-history database, by default "
+                             "history.sqlite3 in the cache directory. Query it with python -m common.history.")
+    parser.add_argument("--check-plans", action='store_true',
+                        help="Check plan links concurrently with HEAD requests and add plan_alive to the records.")
+    parser.add_argument("--mirror-plans", action='store_true',
+                        help="Check plan links and keep the plans in a content-addressed store under the cache "
+                             "directory, adding plan_hash to the records. Known plans are revalidated, "
+                             "not downloaded again.")
+    parser.add_argument("--metrics", metavar='PATH',
+                        help="Write run metrics to this file: time per stage and complex, bytes, record counts "
+                             "and peak memory. JSON, or Prometheus text format if the name ends with .prom.")
+    parser.add_argument("--profile", choices=PROFILERS,
+                        help="Profile record parsing and conversion, with --metrics: cprofile adds the slowest "
+                             "functions to the metrics and saves .pstats next to them, tracemalloc adds "
+                             "the largest allocations.")
+    # True, если клиент уже настроил владелец процесса (демон): запуск задает только срок и метрики
+    parser.set_defaults(client_configured=False)
+    return parser
+
+
+def number_list(text: str):
+    """
+    Тип аргумента: числа через запятую
+    :param text: Значение аргумента
+    :return: Кортеж чисел
+    """
+    try:
+        return tuple(filters.number(part) for part in text.split(',') if part.strip())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected comma-separated numbers, got {text!r}')
+
+
+def configure_client(options):
+    """
+    Применяет аргументы HTTP-клиента к разделяемому CLIENT: пул соединений, таймауты, повторы и кэш ответов
+    :param options: Результат разбора аргументов
+    :return:
+    """
+    client.CLIENT.configure(pool_size=options.pool_size,
+                            connect_timeout=options.connect_timeout,
+                            read_timeout=options.read_timeout,
+                            target=options.target,
+                            retry=resilience.RetryPolicy(options.retries, options.retry_backoff),
+                            hedge=options.hedge)
+    client.CLIENT.cache = ResponseCache(options.cache_dir, replay=options.replay) \
+        if options.http_cache or options.replay else None
+
+
+def configure(options):
+    """
+    Начинает запуск: применяет общие аргументы к разделяемым объектам и задает срок и метрики запуска.
+    Клиент не перенастраивается, если он уже настроен владельцем процесса (options.client_configured), как в демоне
+    :param options: Результат разбора аргументов
+    :return: Срок окончания запуска по time.monotonic() или None
+    """
+    if not options.client_configured:
+        configure_client(options)
+    deadline = time.monotonic() + options.deadline if options.deadline else None
+    METRICS.start(enabled=bool(options.metrics), profiler=options.profile)
+    # Срок - свой у каждого запуска, в демоне запуски идут одновременно
+    client.DEADLINE.set(deadline)
+    return deadline
+
+
+def default_options():
+    """
+    Значения общих аргументов по умолчанию, для вызова main() без командной строки
+    :return:
+    """
+    return add_arguments(argparse.ArgumentParser()).parse_args([])
@@ -0,0 +1,537 @@
+"""
+HTTP-клиент с пулом keep-alive соединений по хостам.
+Запрашивает сжатые ответы (gzip/deflate, br при установленном brotli) и распаковывает их потоково,
+ограничивает время установки соединения и чтения, а также число соединений к одному хосту.
+Временные ошибки повторяются с задержкой, медленным хостам можно отправлять дублирующий запрос,
+а общий срок работы ограничивает все запросы запуска.
+"""
+import contextvars
+import http.client
+import queue
+import threading
+import time
+import zlib
+from json import JSONDecodeError
+from urllib.parse import urlsplit
+
+from common.cache import CacheMiss, ResponseCache
+from common.concurrency import in_context
+from common.errors import DeadlineExceeded, MyException
+from common.jsonstream import iter_items
+from common.metrics import METRICS
+from common.resilience import TRANSIENT_STATUSES, LatencyTracker, RetryPolicy, is_transient
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+POOL_SIZE = 4
+CHUNK_SIZE = 64 * 1024
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli else 'gzip, deflate'
+
+# Срок запуска по time.monotonic() или None. Задается в контексте потока запуска, а не в общем клиенте:
+# в демоне одновременно идут запуски с разными сроками. В рабочие потоки переходит через concurrency.in_context
+DEADLINE = contextvars.ContextVar('deadline', default=None)
+
+# Ошибки, при которых переиспользованное соединение считается закрытым сервером и запрос повторяется на новом
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+def split_address(address: str):
+    """
+    Разбирает адрес вида https://nk.ilike.ru/ или nk.ilike.ru на схему и хост
+    :param address: Адрес сайта
+    :return: Кортеж (scheme, host)
+    """
+    if '//' not in address:
+        address = f'https://{address}'
+    parts = urlsplit(address)
+    return parts.scheme or 'https', parts.netloc
+
+
+class DeflateDecoder:
+    """
+    Распаковщик deflate: часть серверов отдает поток с zlib-заголовком, часть без него
+    """
+    def __init__(self):
+        self.obj = zlib.decompressobj()
+        self.first = True
+
+    def decompress(self, data: bytes):
+        if self.first and data:
+            self.first = False
+            try:
+                return self.obj.decompress(data)
+            except zlib.error:
+                self.obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.obj.decompress(data)
+
+    def flush(self):
+        return self.obj.flush()
+
+
+class BrotliDecoder:
+    def __init__(self):
+        self.obj = brotli.Decompressor()
+
+    def decompress(self, data: bytes):
+        return self.obj.process(data)
+
+    def flush(self):
+        return b''
+
+
+class IdentityDecoder:
+    def decompress(self, data: bytes):
+        return data
+
+    def flush(self):
+        return b''
+
+
+def make_decoder(encoding: str):
+    """
+    Возвращает потоковый распаковщик для значения заголовка Content-Encoding
+    :param encoding: Значение Content-Encoding
+    :return:
+    """
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return DeflateDecoder()
+    if encoding == 'br' and brotli:
+        return BrotliDecoder()
+    return IdentityDecoder()
+
+
+class Response:
+    """
+    Ответ сервера. Тело читается частями и распаковывается на лету,
+    после полного чтения соединение возвращается в пул
+    """
+    def __init__(self, pool, key, conn, res, deadline: float = None, sock=None):
+        """
+        :param sock: Сокет соединения. http.client обнуляет conn.sock, если сервер закрывает соединение после
+        ответа (Connection: close, HTTP/1.0), а тело читается из того же сокета
+        """
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.res = res
+        self.sock = sock or conn.sock
+        self.deadline = deadline
+        self.status = res.status
+        self.reason = res.reason
+        self.bytes_received = 0
+        self.closed = False
+
+    def getheader(self, name: str, default=None):
+        return self.res.getheader(name, default)
+
+    def iter_chunks(self, chunk_size: int = CHUNK_SIZE):
+        """
+        Отдает распакованное тело ответа частями
+        :param chunk_size: Размер читаемой из сокета части
+        :return:
+        """
+        decoder = make_decoder(self.getheader('Content-Encoding'))
+        try:
+            while True:
+                if self.deadline is not None and not self.res.isclosed():
+                    # Чтение не должно выйти за общий срок работы. Прочитанный ответ без keep-alive уже закрыл сокет
+                    self.sock.settimeout(remaining(self.deadline, self.pool.read_timeout))
+                try:
+                    raw = self.res.read(chunk_size)
+                except TimeoutError:
+                    remaining(self.deadline)
+                    raise
+                if not raw:
+                    break
+                self.bytes_received += len(raw)
+                data = decoder.decompress(raw)
+                if data:
+                    yield data
+            tail = decoder.flush()
+            if tail:
+                yield tail
+        finally:
+            self.close()
+
+    def read(self):
+        return b''.join(self.iter_chunks())
+
+    def text(self, encoding: str = 'utf-8'):
+        return self.read().decode(encoding)
+
+    def iter_json(self, path=()):
+        """
+        Разбирает тело ответа потоково и отдает элементы JSON-массива по одному
+        :param path: Ключи объектов до массива
+        :return:
+        """
+        return iter_items(self.iter_chunks(), path)
+
+    def close(self):
+        """
+        Возвращает соединение в пул, если ответ прочитан полностью и сервер не просил закрыть соединение
+        :return:
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.res.isclosed() and not self.res.will_close:
+            self.pool.release(self.key, self.conn)
+        else:
+            self.pool.discard(self.key, self.conn)
+
+
+def remaining(deadline: float = None, limit: float = None):
+    """
+    Время до срока, не больше limit
+    :param deadline: Срок по time.monotonic(), None - без срока
+    :param limit: Обычный таймаут
+    :return: Секунды
+    """
+    if deadline is None:
+        return limit
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left if limit is None else min(left, limit)
+
+
+def check_deadline(error: BaseException, deadline: float = None):
+    """
+    Таймаут сокета, укороченный до срока запуска, - это истечение срока, а не сетевая ошибка
+    :param error: Ошибка запроса
+    :param deadline: Срок по time.monotonic() или None
+    :return:
+    """
+    if isinstance(error, TimeoutError):
+        remaining(deadline)
+
+
+class ConnectionPool:
+    """
+    Пул соединений по хостам. Ограничивает число открытых соединений к хосту значением size,
+    свободные соединения переиспользуются
+    """
+    def __init__(self, size: int = POOL_SIZE, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, target: str = None):
+        """
+        :param target: Адрес сервера, к которому открываются все соединения вместо настоящих хостов
+        """
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.target = target
+        self.idle = {}
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def slot(self, key):
+        with self.lock:
+            semaphore = self.slots.get(key)
+            if semaphore is None:
+                semaphore = self.slots[key] = threading.BoundedSemaphore(self.size)
+            return semaphore
+
+    def acquire(self, key, fresh: bool = False, deadline: float = None):
+        """
+        Возвращает кортеж (соединение, переиспользовано ли оно)
+        :param key: Кортеж (scheme, host)
+        :param fresh: Не брать свободное соединение, а открыть новое
+        :param deadline: Срок по time.monotonic(), после которого ожидание и соединение прерываются
+        :return:
+        """
+        if deadline is None:
+            self.slot(key).acquire()
+        elif not self.slot(key).acquire(timeout=remaining(deadline)):
+            raise DeadlineExceeded()
+        with self.lock:
+            idle = self.idle.get(key)
+            conn = idle.pop() if idle and not fresh else None
+        try:
+            if conn is not None:
+                conn.sock.settimeout(remaining(deadline, self.read_timeout))
+                return conn, True
+            return self.connect(key, deadline), False
+        except BaseException:
+            if conn is not None:
+                conn.close()
+            self.slot(key).release()
+            raise
+
+    def connect(self, key, deadline: float = None):
+        scheme, host = split_address(self.target) if self.target else key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        conn = connection_class(host, timeout=remaining(deadline, self.connect_timeout))
+        start = time.perf_counter()
+        conn.connect()
+        METRICS.add(key[1], connect=time.perf_counter() - start)
+        # После установки соединения действует таймаут чтения
+        conn.sock.settimeout(remaining(deadline, self.read_timeout))
+        return conn
+
+    def release(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+        self.slot(key).release()
+
+    def discard(self, key, conn):
+        conn.close()
+        self.slot(key).release()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+
+class HttpClient:
+    """
+    Общий для парсеров HTTP-клиент
+    """
+    def __init__(self, pool_size: int = POOL_SIZE, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, cache: ResponseCache = None, target: str = None):
+        self.pool = ConnectionPool(pool_size, connect_timeout, read_timeout, target)
+        self.cache = cache
+        self.retry = RetryPolicy()
+        self.hedge = None
+        self.latencies = LatencyTracker()
+
+    def configure(self, pool_size: int = POOL_SIZE, connect_timeout: float = CONNECT_TIMEOUT,
+                  read_timeout: float = READ_TIMEOUT, target: str = None, retry: RetryPolicy = None,
+                  hedge: float = None):
+        """
+        Меняет настройки клиента. Если поменялись параметры пула, свободные соединения закрываются
+        :param target: Адрес сервера, на который отправляются все запросы с сохранением заголовка Host,
+        например локального стенда
+        :param retry: Правила повтора временных ошибок
+        :param hedge: Перцентиль времени ответа хоста, после которого отправляется дублирующий запрос,
+        None - не отправлять
+        :return:
+        """
+        pool = self.pool
+        settings = (pool_size, connect_timeout, read_timeout, target)
+        if (pool.size, pool.connect_timeout, pool.read_timeout, pool.target) != settings:
+            self.pool = ConnectionPool(*settings)
+            pool.close()
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge
+
+    def send(self, address: str, endpoint: str, method: str = 'GET', payload='', headers: dict = None):
+        """
+        Отправляет запрос на переиспользуемом соединении, без повторов временных ошибок
+        :return: Response
+        """
+        key = split_address(address)
+        request_headers = {'Accept-Encoding': ACCEPT_ENCODING}
+        request_headers.update(headers or {})
+        pool = self.pool
+        if pool.target:
+            # Соединение открыто к подменному серверу, сайт он определяет по заголовку Host
+            request_headers['Host'] = key[1]
+        if isinstance(payload, str):
+            # http.client кодирует строки в latin-1, а тела запросов бывают с кириллицей
+            payload = payload.encode('utf-8')
+        deadline = DEADLINE.get()
+        start = time.monotonic()
+        conn, reused = pool.acquire(key, deadline=deadline)
+        try:
+            conn.request(method, endpoint, payload, request_headers)
+            sock = conn.sock
+            res = conn.getresponse()
+        except STALE_ERRORS:
+            pool.discard(key, conn)
+            if not reused:
+                raise
+            # Сервер закрыл простаивавшее соединение, повторяем запрос на новом
+            conn, _ = pool.acquire(key, fresh=True, deadline=deadline)
+            try:
+                conn.request(method, endpoint, payload, request_headers)
+                sock = conn.sock
+                res = conn.getresponse()
+            except BaseException as e:
+                pool.discard(key, conn)
+                check_deadline(e, deadline)
+                raise
+        except BaseException as e:
+            pool.discard(key, conn)
+            check_deadline(e, deadline)
+            raise
+        self.latencies.record(key[1], time.monotonic() - start)
+        METRICS.add(key[1], requests=1)
+        return Response(pool, key, conn, res, deadline, sock)
+
+    def send_hedged(self, address: str, endpoint: str, method: str = 'GET', payload='', headers: dict = None):
+        """
+        Отправляет запрос и, если ответа нет дольше перцентиля hedge времени ответа хоста, его дубль.
+        Используется ответ, пришедший первым, второй закрывается
+        :return: Response
+        """
+        threshold = self.latencies.percentile(split_address(address)[1], self.hedge)
+        if threshold is None:
+            return self.send(address, endpoint, method, payload, headers)
+        results = queue.Queue()
+
+        def attempt():
+            try:
+                results.put((self.send(address, endpoint, method, payload, headers), None))
+            except BaseException as e:
+                results.put((None, e))
+
+        threading.Thread(target=in_context(attempt), daemon=True).start()
+        pending = 1
+        try:
+            res, error = results.get(timeout=threshold)
+        except queue.Empty:
+            threading.Thread(target=in_context(attempt), daemon=True).start()
+            pending += 1
+            res, error = results.get()
+        pending -= 1
+        if error is not None and pending:
+            res, error = results.get()
+            pending -= 1
+        if pending:
+            # Опоздавший ответ не читается, его соединение закрывается
+            def close_late():
+                late, _ = results.get()
+                if late is not None:
+                    late.close()
+            threading.Thread(target=close_late, daemon=True).start()
+        if error is not None:
+            raise error
+        return res
+
+    def request(self, address: str, endpoint: str, method: str = 'GET', payload='', headers: dict = None):
+        """
+        Выполняет запрос, повторяя его при временных ошибках: сетевых сбоях, таймаутах и ответах 429/5xx.
+        Если попытки кончились, выбрасывается последняя ошибка или возвращается последний ответ
+        :param address: Адрес сайта
+        :param endpoint: Путь запроса
+        :param method: HTTP-метод
+        :param payload: Тело запроса
+        :param headers: Дополнительные заголовки
+        :return: Response
+        """
+        send = self.send_hedged if self.hedge else self.send
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                res = send(address, endpoint, method, payload, headers)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if attempt >= self.retry.retries or not is_transient(e):
+                    raise
+            else:
+                if attempt >= self.retry.retries or res.status not in TRANSIENT_STATUSES:
+                    return res
+                retry_after = res.getheader('Retry-After')
+                res.close()
+            delay = self.retry.delay(attempt, retry_after)
+            deadline = DEADLINE.get()
+            if deadline is not None:
+                delay = min(delay, remaining(deadline))
+            time.sleep(delay)
+            attempt += 1
+
+    def fetch(self, address: str, endpoint: str, method: str = 'GET', payload='', headers: dict = None,
+              parse=None, kind: str = 'body'):
+        """
+        Выполняет запрос через кэш ответов, если он включен, и отдает части тела ответа
+        или, если задана функция parse, результат её применения к частям тела.
+        Сохраненный ответ переиспользуется при 304 Not Modified, а в режиме replay - без обращения к сети
+        :param address: Адрес сайта
+        :param endpoint: Путь запроса
+        :param method: HTTP-метод
+        :param payload: Тело запроса
+        :param headers: Дополнительные заголовки
+        :param parse: Функция, превращающая итератор частей тела в итератор элементов
+        :param kind: Вид элементов в кэше, должен однозначно соответствовать parse
+        :return:
+        """
+        entry = None
+        if self.cache:
+            entry = self.cache.entry(split_address(address)[1], method, endpoint, payload, kind)
+            if self.cache.replay:
+                if not entry.exists():
+                    raise CacheMiss(f'Нет сохраненного ответа {method} {address}{endpoint}')
+                yield from entry.load()
+                return
+            headers = dict(headers or {}, **entry.validators())
+        res = self.request(address, endpoint, method, payload, headers)
+        try:
+            if entry is not None and res.status == 304 and entry.exists():
+                # Ответ не изменился: тело не скачивается и не разбирается заново
+                res.read()
+                yield from entry.load()
+                return
+            if METRICS.enabled:
+                items = METRICS.body(split_address(address)[1], res, parse)
+            else:
+                items = res.iter_chunks()
+                if parse:
+                    items = parse(items)
+            if entry is None or res.status != 200:
+                yield from items
+                return
+            writer = entry.writer(res)
+            try:
+                for item in items:
+                    writer.dump(item)
+                    yield item
+                writer.commit()
+            finally:
+                writer.abort()
+        finally:
+            res.close()
+
+    def get_html(self, address: str, endpoint: str, method: str, payload, headers: dict = None):
+        return b''.join(self.fetch(address, endpoint, method, payload, headers)).decode('utf-8')
+
+    def fetch_json(self, address: str, endpoint: str, method: str = 'GET', payload='', headers: dict = None,
+                   path=()):
+        """
+        Запрашивает API и отдает записи из JSON-массива ответа по мере их получения.
+        Сетевые ошибки и ответы не в формате JSON превращаются в MyException
+        :param address: Адрес сайта
+        :param endpoint: Путь запроса
+        :param method: HTTP-метод
+        :param payload: Тело запроса
+        :param headers: Дополнительные заголовки
+        :param path: Ключи объектов до массива записей в ответе
+        :return:
+        """
+        records = self.fetch(address, endpoint, method, payload, headers,
+                             parse=lambda chunks: iter_items(chunks, path), kind=f'json:{list(path)}')
+        try:
+            yield from records
+        except DeadlineExceeded:
+            raise
+        except JSONDecodeError as e:
+            raise MyException(f'JSON не получен, вероятно API {endpoint} не реализовано', e)
+        except Exception as e:
+            raise MyException(f'Сетевая ошибка, вероятно API {endpoint} не реализовано', e)
+
+    def close(self):
+        self.pool.close()
+
+
+CLIENT = HttpClient()
+
+
+def get_html(address, endpoint, method, payload, headers=None):
+    return CLIENT.get_html(address, endpoint, method, payload, headers)
+
+
+def fetch_json(address, endpoint, method='GET', payload='', headers=None, path=()):
+    return CLIENT.fetch_json(address, endpoint, method, payload, headers, path)
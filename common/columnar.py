@@ -0,0 +1,333 @@
+"""
+Двоичный колоночный формат вывода и его чтение.
+Записи собираются в RecordBatch и выводятся блоками по колонкам: числа - массивами float64/int64 с маской пустых
+значений, поля с небольшим числом различных значений - словарем значений и кодами, остальные - JSON-списком.
+Поток сжимается gzip или, если установлен zstandard, zstd и пишется по мере готовности блоков.
+
+Поток (после распаковки): MAGIC, затем блоки <uint32 длина><блок>, в конце блок нулевой длины.
+Блок: <uint32 число записей><uint16 число колонок>, затем колонки:
+<uint16 длина имени><имя utf-8><тип колонки>, дальше по типу:
+    f, q - <uint8 есть ли пустые>[маска, байт на запись]<значения little-endian, 8 байт на запись>
+    d - <код типа массива кодов B/H/I><значения словаря JSON-списком><коды little-endian>
+    j - <значения JSON-списком>
+JSON-список - <uint32 длина><JSON utf-8>. Чтение:
+
+    python -m common.columnar result.bin > result.json
+"""
+import argparse
+import gzip
+import json
+import struct
+import sys
+from array import array
+
+from common.records import DictColumn, FloatColumn, IntColumn, RecordBatch
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'SCRB\x01'
+BLOCK_SIZE = 10000
+COMPRESSIONS = ['gzip', 'zstd', 'none'] if zstandard else ['gzip', 'none']
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+LITTLE_ENDIAN = sys.byteorder == 'little'
+UINT16 = struct.Struct('<H')
+UINT32 = struct.Struct('<I')
+BLOCK_HEADER = struct.Struct('<IH')
+
+
+def to_le(values: array):
+    if not LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_le(typecode: str, data: bytes):
+    values = array(typecode)
+    values.frombytes(data)
+    if not LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def dump_json(values):
+    data = json.dumps(values, ensure_ascii=False).encode('utf-8')
+    return UINT32.pack(len(data)) + data
+
+
+def encode_column(name: str, column):
+    """
+    :param name: Имя поля
+    :param column: Колонка RecordBatch
+    :return: Части колонки в байтах
+    """
+    encoded = name.encode('utf-8')
+    parts = [UINT16.pack(len(encoded)), encoded]
+    if isinstance(column, FloatColumn):
+        parts.append(b'q' if isinstance(column, IntColumn) else b'f')
+        has_nulls = 1 in column.nulls
+        parts.append(b'\x01' if has_nulls else b'\x00')
+        if has_nulls:
+            parts.append(bytes(column.nulls))
+        parts.append(to_le(column.values))
+    elif isinstance(column, DictColumn):
+        parts += [b'd', column.codes.typecode.encode('ascii'), dump_json(column.values), to_le(column.codes)]
+    else:
+        parts += [b'j', dump_json(list(column))]
+    return parts
+
+
+def encode_block(batch: RecordBatch):
+    """
+    :param batch: Записи блока
+    :return: Блок с длиной в начале
+    """
+    parts = [BLOCK_HEADER.pack(len(batch), len(batch.fields))]
+    for name, column in zip(batch.fields, batch.columns):
+        parts += encode_column(name, column)
+    body = b''.join(parts)
+    return UINT32.pack(len(body)) + body
+
+
+def open_compressed(stream, compression: str = 'gzip'):
+    """
+    Поток записи с потоковым сжатием
+    :param stream: Двоичный поток вывода
+    :param compression: Способ сжатия из COMPRESSIONS
+    :return:
+    """
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='wb', compresslevel=6, mtime=0)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package')
+        return zstandard.ZstdCompressor(level=3).stream_writer(stream, closefd=False)
+    return stream
+
+
+class ColumnarWriter:
+    """
+    Выводит записи двоичными колоночными блоками. Блок выводится, когда набрано BLOCK_SIZE записей
+    и при каждом flush, то есть после каждого комплекса
+    """
+    def __init__(self, stream, compression: str = 'gzip'):
+        """
+        :param stream: Поток вывода: двоичный или текстовый с атрибутом buffer, как sys.stdout
+        :param compression: Способ сжатия из COMPRESSIONS
+        """
+        self.stream = getattr(stream, 'buffer', stream)
+        if self.stream is not stream:
+            stream.flush()
+        self.output = open_compressed(self.stream, compression)
+        self.output.write(MAGIC)
+        self.batch = RecordBatch()
+
+    def write(self, obj: dict):
+        try:
+            self.batch.append(obj)
+        except ValueError:
+            # Набор полей поменялся, например у удаленных записей в режиме --diff: запись начинает новый блок
+            self.write_block()
+            self.batch.append(obj)
+        if len(self.batch) >= BLOCK_SIZE:
+            self.write_block()
+
+    def write_all(self, records):
+        for obj in records:
+            self.write(obj)
+
+    def write_block(self):
+        if len(self.batch):
+            self.output.write(encode_block(self.batch))
+            self.batch = RecordBatch()
+
+    def fail(self, complex_name: str):
+        pass
+
+    def flush(self):
+        self.write_block()
+        self.output.flush()
+        self.stream.flush()
+
+    def close(self):
+        self.write_block()
+        self.output.write(UINT32.pack(0))
+        if self.output is not self.stream:
+            self.output.close()
+        self.stream.flush()
+
+
+class BlockReader:
+    """
+    Чтение полей блока по порядку
+    """
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def take(self, size: int):
+        chunk = self.data[self.offset:self.offset + size]
+        if len(chunk) != size:
+            raise ValueError('Truncated columnar block')
+        self.offset += size
+        return chunk
+
+    def uint16(self):
+        return UINT16.unpack(self.take(2))[0]
+
+    def uint32(self):
+        return UINT32.unpack(self.take(4))[0]
+
+    def json(self):
+        return json.loads(bytes(self.take(self.uint32())).decode('utf-8'))
+
+
+def decode_column(reader: BlockReader, size: int):
+    """
+    :param reader: Блок, позиция - начало колонки
+    :param size: Число записей блока
+    :return: Кортеж (имя поля, список значений)
+    """
+    name = bytes(reader.take(reader.uint16())).decode('utf-8')
+    kind = bytes(reader.take(1))
+    if kind in (b'f', b'q'):
+        nulls = bytes(reader.take(size)) if reader.take(1)[0] else None
+        values = from_le('d' if kind == b'f' else 'q', reader.take(size * 8)).tolist()
+        if nulls is not None:
+            values = [None if null else value for value, null in zip(values, nulls)]
+        return name, values
+    if kind == b'd':
+        typecode = bytes(reader.take(1)).decode('ascii')
+        dictionary = reader.json()
+        codes = from_le(typecode, reader.take(size * array(typecode).itemsize))
+        if len(dictionary) == 1:
+            return name, dictionary * size
+        return name, [dictionary[code] for code in codes]
+    if kind == b'j':
+        return name, reader.json()
+    raise ValueError(f'Unknown column type {kind!r} in columnar block')
+
+
+def decode_block(data: bytes):
+    """
+    :param data: Блок без длины в начале
+    :return: Список записей
+    """
+    reader = BlockReader(data)
+    size, count = BLOCK_HEADER.unpack(reader.take(BLOCK_HEADER.size))
+    fields, columns = [], []
+    for _ in range(count):
+        name, values = decode_column(reader, size)
+        fields.append(name)
+        columns.append(values)
+    return [dict(zip(fields, row)) for row in zip(*columns)]
+
+
+class PrefixedReader:
+    """
+    Поток чтения: сначала уже прочитанное начало, затем остаток исходного потока.
+    В отличие от io.BufferedReader не читает исходный поток наперед и не закрывает его
+    """
+    def __init__(self, head: bytes, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size: int = -1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        return data
+
+
+def open_decompressed(stream):
+    """
+    Поток чтения с распаковкой, способ сжатия определяется по началу потока
+    :param stream: Двоичный поток, остается открытым
+    :return:
+    """
+    if hasattr(stream, 'peek'):
+        head = stream.peek(4)[:4]
+    else:
+        head = b''
+        while len(head) < 4:
+            chunk = stream.read(4 - len(head))
+            if not chunk:
+                break
+            head += chunk
+        stream = PrefixedReader(head, stream)
+    if head.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError('Reading zstd-compressed output requires the zstandard package')
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    return stream
+
+
+def read_exact(stream, size: int):
+    data = stream.read(size)
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError('Truncated columnar stream')
+        data += chunk
+    return data
+
+
+def iter_blocks(stream):
+    """
+    Отдает записи потока блоками по мере чтения
+    :param stream: Двоичный поток, сжатый или нет
+    :return: Итератор списков записей
+    """
+    stream = open_decompressed(stream)
+    if read_exact(stream, len(MAGIC)) != MAGIC:
+        raise ValueError('Not a columnar stream')
+    while True:
+        size = UINT32.unpack(read_exact(stream, 4))[0]
+        if not size:
+            return
+        yield decode_block(read_exact(stream, size))
+
+
+def iter_records(stream):
+    """
+    Отдает записи потока по одной
+    :param stream: Двоичный поток, сжатый или нет
+    :return:
+    """
+    for block in iter_blocks(stream):
+        yield from block
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert columnar parser output to JSON.')
+    parser.add_argument('path', nargs='?', help='Columnar file, stdin by default.')
+    parser.add_argument('--ndjson', action='store_true', help='One record per line instead of a JSON array.')
+    args = parser.parse_args(argv)
+    stream = open(args.path, 'rb') if args.path else sys.stdin.buffer
+    with stream:
+        if args.ndjson:
+            for obj in iter_records(stream):
+                sys.stdout.write(json.dumps(obj, ensure_ascii=False))
+                sys.stdout.write('\n')
+        else:
+            # Тот же JSON-массив, что выводит формат json
+            sys.stdout.write('[')
+            separator = ''
+            for block in iter_blocks(stream):
+                if block:
+                    sys.stdout.write(separator + json.dumps(block, ensure_ascii=False)[1:-1])
+                    separator = ', '
+            sys.stdout.write(']')
+
+
+if __name__ == '__main__':
+    main()
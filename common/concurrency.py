@@ -0,0 +1,114 @@
+"""
+Параллельный обход комплексов с ограничением числа одновременных запросов.
+Результаты отдаются в том же порядке, в котором были переданы комплексы.
+"""
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from common.errors import DeadlineExceeded
+
+# Значения по умолчанию для общего и похостового ограничения параллельности
+WORKERS = 8
+PER_HOST = 2
+
+
+def in_context(func):
+    """
+    Функция, выполняемая в копии контекста текущего потока: срок запуска переходит в рабочие потоки.
+    Копия нужна на каждый вызов в другом потоке, один контекст нельзя выполнять в двух потоках сразу
+    :param func: Функция для рабочего потока
+    :return:
+    """
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def host_of(url: str):
+    """
+    Возвращает имя хоста из адреса вида https://nk.ilike.ru/ или nk.ilike.ru
+    :param url: Адрес комплекса
+    :return:
+    """
+    if '//' not in url:
+        url = f'//{url}'
+    return urlsplit(url).hostname or url
+
+
+class HostLimiter:
+    """
+    Набор семафоров по хостам, не дает превысить число одновременных запросов к одному хосту
+    """
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def get(self, host: str):
+        with self.lock:
+            semaphore = self.semaphores.get(host)
+            if semaphore is None:
+                semaphore = self.semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return semaphore
+
+
+def iter_ordered(func, items, workers: int = WORKERS, per_host: int = PER_HOST, handled=(), url_index: int = 1,
+                 deadline: float = None, priority=None):
+    """
+    Вызывает func(*item) для каждого элемента items и отдает кортежи (item, result, error) в исходном порядке.
+    Исключения из handled перехватываются и возвращаются в error, остальные пробрасываются.
+    При workers <= 1 работает последовательно, без потоков, и результат func отдается как есть:
+    если это генератор, исключения из него возникают при чтении записей вызывающим кодом.
+    В параллельном режиме результат func собирается в список в рабочем потоке.
+    :param func: Функция обработки одного комплекса
+    :param items: Последовательность кортежей аргументов func
+    :param workers: Общее ограничение числа одновременных обработок
+    :param per_host: Ограничение числа одновременных обработок одного хоста
+    :param handled: Кортеж типов исключений, которые изолируются в пределах одного элемента
+    :param url_index: Позиция адреса комплекса в кортеже аргументов, по нему определяется хост
+    :param deadline: Срок по time.monotonic(): элементы, не обработанные к этому времени,
+    отдаются с ошибкой DeadlineExceeded
+    :param priority: Функция элемента: в параллельном режиме элементы запускаются по возрастанию ее значения,
+    порядок выдачи от этого не меняется
+    :return:
+    """
+    items = list(items)
+    if workers <= 1:
+        for item in items:
+            if deadline is not None and time.monotonic() >= deadline:
+                yield item, None, DeadlineExceeded()
+                continue
+            try:
+                yield item, func(*item), None
+            except handled as e:
+                yield item, None, e
+        return
+
+    limiter = HostLimiter(max(per_host, 1))
+
+    def call(item):
+        with limiter.get(host_of(item[url_index])):
+            try:
+                # Результат, отданный генератором, вычисляется целиком в рабочем потоке
+                return list(func(*item)), None
+            except handled as e:
+                return None, e
+
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(items) or 1))
+    try:
+        futures = [None] * len(items)
+        order = range(len(items)) if priority is None else sorted(range(len(items)), key=lambda i: priority(items[i]))
+        for index in order:
+            futures[index] = executor.submit(in_context(call), items[index])
+        # Ждем результаты по порядку: элемент отдается, как только готовы все предыдущие
+        for item, future in zip(items, futures):
+            try:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                result, error = future.result(timeout=timeout)
+            except TimeoutError:
+                result, error = None, DeadlineExceeded()
+            yield item, result, error
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
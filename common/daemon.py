@@ -0,0 +1,271 @@
+"""
+Режим демона: парсеры загружаются один раз, соединения, кэши и обнаруженные комплексы остаются теплыми между запусками.
+Запуски заказываются по HTTP на локальном адресе или unix-сокете, результат отдается по мере получения
+в том же формате, что и в stdout у скриптов:
+
+    GET /run/nk             - запуск одного парсера, ответ - JSON-массив
+    GET /run/all            - все парсеры, по одному JSON-массиву в строке
+    GET /run/nk?format=ndjson
+    GET /latest/nk          - результат последнего завершенного запуска
+    GET /status             - идущие запуски
+
+Запрос запуска сайта, который уже выполняется с тем же форматом, не запускает его повторно,
+а подключается к идущему запуску и получает его вывод с начала.
+HTTP-клиент, кэш ответов и прочие общие аргументы задаются один раз при старте демона, у запуска свои только
+формат, срок (--deadline) и метрики.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from common import cli, output
+from common.parsers import PARSERS, load_parser
+
+logger = logging.getLogger('ilike')
+
+
+class Run:
+    """
+    Один запуск парсера. Служит потоком вывода для него и раздает вывод подписчикам,
+    каждый подписчик получает его с начала
+    """
+    def __init__(self, site: str, fmt: str):
+        self.site = site
+        self.format = fmt
+        self.started = time.time()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def write(self, data):
+        with self.condition:
+            self.chunks.append(data)
+            self.condition.notify_all()
+
+    def flush(self):
+        pass
+
+    def finish(self, error: Exception = None):
+        with self.condition:
+            self.error = error
+            self.done = True
+            self.condition.notify_all()
+
+    def __iter__(self):
+        position = 0
+        while True:
+            with self.condition:
+                while position == len(self.chunks) and not self.done:
+                    self.condition.wait()
+                chunks = self.chunks[position:]
+                position = len(self.chunks)
+                done = self.done
+            yield from chunks
+            if done and position == len(self.chunks):
+                return
+
+
+class Scheduler:
+    """
+    Выполняет запуски парсеров в фоновых потоках, совпадающие по времени запуски одного сайта объединяются
+    """
+    def __init__(self, options, sites=None):
+        """
+        :param options: Общие аргументы, с которыми выполняются все запуски
+        :param sites: Имена парсеров, по умолчанию все из PARSERS
+        """
+        self.options = options
+        self.sites = list(sites or PARSERS)
+        self.runs = {}
+        self.latest = {}
+        self.lock = threading.Lock()
+        # Клиент разделяют все запуски: перенастраивать его, пока идут другие запуски, нельзя
+        cli.configure_client(options)
+        # Модули загружаются и матчинг компилируется один раз, при старте
+        for site in self.sites:
+            load_parser(site)
+
+    def submit(self, site: str, fmt: str = None):
+        """
+        Возвращает идущий запуск сайта или начинает новый
+        :param site: Имя парсера
+        :param fmt: Формат вывода из output.FORMATS, по умолчанию формат из аргументов демона
+        :return: Run
+        """
+        key = (site, fmt or self.options.format)
+        with self.lock:
+            run = self.runs.get(key)
+            if run is None:
+                run = self.runs[key] = Run(*key)
+                threading.Thread(target=self.execute, args=(run,), daemon=True).start()
+        return run
+
+    def execute(self, run: Run):
+        options = copy.copy(self.options)
+        options.format = run.format
+        options.client_configured = True
+        error = None
+        try:
+            load_parser(run.site).main(options=options, stream=run)
+        except Exception as e:
+            logger.error(f'Запуск {run.site} завершился ошибкой: {e}')
+            error = e
+        finally:
+            # Запрос, пришедший после завершения, начинает новый запуск
+            with self.lock:
+                del self.runs[(run.site, run.format)]
+                if error is None:
+                    self.latest[(run.site, run.format)] = run
+            run.finish(error)
+
+    def status(self):
+        with self.lock:
+            return [{'site': run.site, 'format': run.format, 'started': run.started} for run in self.runs.values()]
+
+    def schedule(self, interval: float):
+        """
+        Периодически запускает все сайты в фоновом потоке, результат доступен через /latest
+        :param interval: Период в секундах
+        :return:
+        """
+        def loop():
+            while True:
+                for run in [self.submit(site) for site in self.sites]:
+                    for _ in run:
+                        pass
+                time.sleep(interval)
+
+        threading.Thread(target=loop, daemon=True).start()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        scheduler = self.server.scheduler
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        fmt = parse_qs(url.query).get('format', [None])[0]
+        if fmt is not None and fmt not in output.FORMATS:
+            return self.send_text(400, f'Unknown format {fmt}, expected one of {", ".join(output.FORMATS)}')
+        if parts == ['status']:
+            return self.send_text(200, json.dumps(scheduler.status()), 'application/json')
+        if len(parts) != 2 or parts[0] not in ('run', 'latest'):
+            return self.send_text(404, 'Expected /run/<site>, /run/all, /latest/<site> or /status')
+        action, site = parts
+        sites = scheduler.sites if site == 'all' and action == 'run' else [site]
+        if any(name not in scheduler.sites for name in sites):
+            return self.send_text(404, f'Unknown site {site}, expected one of {", ".join(scheduler.sites)} or all')
+        if len(sites) > 1 and (fmt or scheduler.options.format) == 'columnar':
+            return self.send_text(400, 'The columnar format is one stream per site, request /run/<site>')
+        if action == 'latest':
+            run = scheduler.latest.get((site, fmt or scheduler.options.format))
+            if run is None:
+                return self.send_text(404, f'No finished run of {site} yet')
+            runs = [run]
+        else:
+            runs = [scheduler.submit(name, fmt) for name in sites]
+        self.stream(runs, separator='\n' if len(runs) > 1 else '')
+
+    def stream(self, runs: list, separator: str = ''):
+        """
+        Отдает вывод запусков по мере его появления. Заголовки отправляются с первой частью вывода,
+        поэтому запуск, упавший до вывода, отдается ошибкой 502
+        """
+        started = False
+        for run in runs:
+            for chunk in run:
+                if not started:
+                    self.start_stream(run.format)
+                    started = True
+                self.wfile.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if run.error is not None and not started:
+                return self.send_text(502, f'Run of {run.site} failed: {run.error}')
+            if separator:
+                if not started:
+                    self.start_stream(run.format)
+                    started = True
+                self.wfile.write(separator.encode('utf-8'))
+        if not started:
+            self.start_stream(runs[-1].format)
+
+    def start_stream(self, fmt: str):
+        self.send_response(200)
+        if fmt == 'columnar':
+            self.send_header('Content-Type', 'application/octet-stream')
+        else:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def send_text(self, status: int, text: str, content_type: str = 'text/plain'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # У unix-сокета нет адреса клиента
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def serve(scheduler: Scheduler, host: str = '127.0.0.1', port: int = 8765, unix_socket: str = None):
+    """
+    Создает сервер демона, запускать его нужно через serve_forever()
+    :param scheduler: Планировщик запусков
+    :param host: Адрес HTTP-сервера
+    :param port: Порт HTTP-сервера
+    :param unix_socket: Путь к unix-сокету, если задан, сервер слушает его вместо TCP-порта
+    :return:
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = UnixHTTPServer(unix_socket, Handler)
+    else:
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+    server.scheduler = scheduler
+    return server
+
+
+def main(argv=None):
+    parser = cli.add_arguments(argparse.ArgumentParser(description='Run the parsers as a long-running daemon.'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix-socket', help='Listen on this unix socket instead of a TCP port.')
+    parser.add_argument('--sites', nargs='+', choices=list(PARSERS), default=list(PARSERS))
+    parser.add_argument('--interval', type=float,
+                        help='Run all sites every N seconds, results are served by /latest/<site>.')
+    options = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    scheduler = Scheduler(options, options.sites)
+    if options.interval:
+        scheduler.schedule(options.interval)
+    server = serve(scheduler, options.host, options.port, options.unix_socket)
+    logger.info(f'Listening on {options.unix_socket or f"http://{options.host}:{options.port}"}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,104 @@
+"""
+Режим изменений: выводятся только новые, изменившиеся и пропавшие с прошлого запуска записи.
+Индекс снимка хранит для каждой записи короткий хэш и поля, по которым она опознается, и заменяется атомарно
+только после успешного завершения запуска.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+from common.fields import FIELDS
+from common.files import write_atomic
+
+IDENTITY_FIELDS = ('complex', 'building', 'section', 'number', 'article')
+
+
+def record_key(obj: dict):
+    """
+    Ключ записи: артикул, если он есть, иначе комплекс, корпус, секция и номер
+    :param obj: Запись в формате FIELDS
+    :return:
+    """
+    if obj.get('article'):
+        return f"{obj['complex']}|{obj['article']}"
+    return f"{obj['complex']}|{obj['building']}|{obj['section']}|{obj['number']}"
+
+
+def record_hash(obj: dict):
+    """
+    Короткий хэш нормализованной записи
+    :param obj: Запись в формате FIELDS
+    :return:
+    """
+    data = json.dumps(obj, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+class SnapshotIndex:
+    """
+    Индекс последнего снимка: {ключ записи: (хэш, поля идентификации)}
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.entries = pickle.load(f)
+
+    def save(self, entries: dict):
+        write_atomic(self.path, pickle.dumps(entries, protocol=pickle.HIGHEST_PROTOCOL))
+        self.entries = entries
+
+
+class DiffWriter:
+    """
+    Обертка над объектом вывода, пропускающая неизменившиеся записи.
+    У выводимых записей добавляется поле change: added, changed или removed
+    """
+    def __init__(self, writer, index: SnapshotIndex):
+        self.writer = writer
+        self.index = index
+        self.seen = {}
+        self.failed = set()
+
+    def write(self, obj: dict):
+        key = record_key(obj)
+        digest = record_hash(obj)
+        old = self.index.entries.get(key)
+        self.seen[key] = (digest, tuple(obj.get(field) for field in IDENTITY_FIELDS))
+        if old is None:
+            self.writer.write(dict(obj, change='added'))
+        elif old[0] != digest:
+            self.writer.write(dict(obj, change='changed'))
+
+    def write_all(self, records):
+        for obj in records:
+            self.write(obj)
+
+    def fail(self, complex_name: str):
+        """
+        Отмечает комплекс, который не удалось получить: его записи не считаются удаленными
+        :param complex_name: Название комплекса
+        :return:
+        """
+        self.failed.add(complex_name)
+        self.writer.fail(complex_name)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        entries = self.seen
+        for key, (digest, identity) in self.index.entries.items():
+            if key in entries:
+                continue
+            if identity[0] in self.failed:
+                entries[key] = (digest, identity)
+                continue
+            obj = dict.fromkeys(FIELDS)
+            obj.update(zip(IDENTITY_FIELDS, identity))
+            obj['change'] = 'removed'
+            self.writer.write(obj)
+        self.writer.close()
+        self.index.save(entries)
@@ -0,0 +1,109 @@
+"""
+Поиск комплексов на ilike.ru.
+Ссылки на комплексы извлекаются из главной страницы потоковым разбором HTML и кэшируются на диске,
+так что парсеры nk и nt и повторные запуски в пределах TTL не запрашивают страницу заново.
+"""
+import codecs
+import time
+from html.parser import HTMLParser
+
+from common.client import CLIENT
+from common.files import cache_path, read_json, write_json
+
+DISCOVERY_TTL = 6 * 60 * 60
+
+
+class ComplexLinksParser(HTMLParser):
+    """
+    Собирает ссылки из элементов li.complexes__item:
+    href первой ссылки и текст h3 и p из её figure > figcaption
+    """
+    def __init__(self):
+        super().__init__()
+        self.links = {}
+        self.item = None
+        self.depth = 0
+        self.capture = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.item is None:
+            if tag == 'li' and 'complexes__item' in (dict(attrs).get('class') or '').split():
+                self.item = {'stage': 'a'}
+                self.depth = 1
+            return
+        item = self.item
+        if tag == 'li':
+            self.depth += 1
+        # Путь a > figure > figcaption, внутри него первые h3 и p
+        stage = item['stage']
+        if stage == 'a' and tag == 'a':
+            item['href'] = dict(attrs).get('href')
+            item['stage'] = 'figure'
+        elif stage == 'figure' and tag == 'figure':
+            item['stage'] = 'figcaption'
+        elif stage == 'figcaption' and tag == 'figcaption':
+            item['stage'] = 'text'
+        elif stage == 'text' and tag in ('h3', 'p') and tag not in item and self.capture is None:
+            item[tag] = []
+            self.capture = tag
+
+    def handle_endtag(self, tag):
+        if self.item is None:
+            return
+        if tag == self.capture:
+            self.capture = None
+        if tag == 'li':
+            self.depth -= 1
+            if not self.depth:
+                self.finish()
+
+    def handle_data(self, data):
+        if self.capture:
+            self.item[self.capture].append(data)
+
+    def finish(self):
+        item, self.item, self.capture = self.item, None, None
+        if item.get('href') is None or 'h3' not in item or 'p' not in item:
+            return
+        title = ''.join(item['h3'])
+        region = ''.join(item['p']).strip()
+        self.links[f'{title} ({region})'] = item['href']
+
+
+def scan_complexes(chunks, encoding: str = 'utf-8'):
+    """
+    Разбирает главную страницу по мере получения, без построения дерева документа
+    :param chunks: Части тела страницы в байтах
+    :param encoding: Кодировка страницы
+    :return: Словарь {название комплекса: адрес}
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    parser = ComplexLinksParser()
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    return parser.links
+
+
+def get_subdomains(ttl: float = DISCOVERY_TTL, refresh: bool = False, cache_dir: str = None):
+    """
+    Возвращает ссылки на комплексы ilike.ru из кэша или, если кэш устарел, с главной страницы
+    :param ttl: Время жизни кэша в секундах, 0 отключает кэш
+    :param refresh: Игнорировать кэш и запросить страницу заново
+    :param cache_dir: Каталог кэша
+    :return: Словарь {название комплекса: адрес}
+    """
+    path = cache_path('discovery', 'ilike.json', cache_dir=cache_dir)
+    replay = CLIENT.cache is not None and CLIENT.cache.replay
+    if (ttl or replay) and not refresh:
+        cached = read_json(path)
+        # В режиме replay подходит кэш любой давности
+        if cached and (replay or time.time() - cached['fetched'] < ttl):
+            return cached['links']
+
+    complex_links = scan_complexes(CLIENT.fetch('ilike.ru', '/#complexes', 'GET', ''))
+    # Пустой результат скорее всего означает сбой, его не кэшируем
+    if ttl and complex_links:
+        write_json(path, {'fetched': time.time(), 'links': complex_links})
+    return complex_links
@@ -0,0 +1,31 @@
+"""
+Исключения парсеров
+"""
+
+
+class MyException(Exception):
+    def __init__(self, msg, err):
+        self.msg = msg
+        self.err = err
+
+
+class DeadlineExceeded(MyException):
+    """
+    Время работы, заданное --deadline, истекло
+    """
+    def __init__(self, msg='Превышено время работы', err=None):
+        super().__init__(msg, err)
+
+    def __str__(self):
+        return self.msg
+
+
+class ComplexSkipped(MyException):
+    """
+    Комплекс не запрашивался: его API не отвечало в прошлых запусках, пауза до повторной проверки не истекла
+    """
+    def __init__(self, msg='API не отвечало в прошлых запусках', err=None):
+        super().__init__(msg, err)
+
+    def __str__(self):
+        return self.msg
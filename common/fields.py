@@ -0,0 +1,177 @@
+"""
+Формат записей FIELDS и преобразование записей API к нему.
+Матчинг полей компилируется один раз при импорте парсера в функцию, которая строит запись одним литералом словаря.
+"""
+import ast
+import builtins
+import keyword
+import linecache
+
+FIELDS = ['complex', 'type', 'phase', 'building', 'section', 'price', 'price_base', 'price_finished', 'price_sale',
+          'price_finished_sale', 'area', 'living_area', 'number', 'number_on_site', 'rooms', 'floor', 'in_sale',
+          'sale_status', 'finished', 'currency', 'ceil', 'article', 'finishing_name', 'furniture', 'furniture_price',
+          'plan', 'feature', 'view', 'euro_planning', 'sale', 'discount_percent', 'discount', 'comment']
+
+# Имена, занятые в генерируемой функции
+RESERVED_NAMES = {'record', 'get', 'obj', 'template'}
+
+
+def cast_fields(record: dict, fields: list, matching: dict):
+    """
+    Для каждого поля из fields определяет значение на основе матчинга полей и преобразований типов.
+    Эталонная интерпретирующая реализация, в парсерах используется compile_fields
+    :param record: Данные из API
+    :param fields: Поля, к которым нужно привести каждую запись
+    :param matching: Данные для матчинга полей и преобразования
+    :return:
+    """
+    obj = {}
+    # Для каждого поля определяем значение на основе матчинга полей и преобразований типов
+    for field in fields:
+        matching_params = matching.get(field, {})
+        site_field = matching_params.get('name')
+        value = record.get(site_field)
+        calc = matching_params.get('calc')
+        if calc:
+            value = calc(value)
+        obj[field] = value
+    return obj
+
+
+class RenameArg(ast.NodeTransformer):
+    def __init__(self, old: str, new: str):
+        self.old = old
+        self.new = new
+
+    def visit_Name(self, node):
+        if node.id == self.old:
+            return ast.copy_location(ast.Name(id=self.new, ctx=node.ctx), node)
+        return node
+
+
+def lambda_node(calc):
+    """
+    Находит в исходном коде модуля узел lambda, из которого получена функция calc
+    :param calc: Функция преобразования из матчинга
+    :return: ast.Lambda или None, если исходник недоступен или на строке несколько lambda
+    """
+    code = calc.__code__
+    source = ''.join(linecache.getlines(code.co_filename))
+    if not source:
+        return None
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+    nodes = [node for node in ast.walk(tree) if isinstance(node, ast.Lambda) and node.lineno == code.co_firstlineno]
+    return nodes[0] if len(nodes) == 1 else None
+
+
+def inline_calc(calc, var: str, namespace: dict):
+    """
+    Пытается превратить lambda из матчинга в выражение над локальной переменной var.
+    Встраиваются только lambda с одним аргументом, без замыканий и без присваивания своему аргументу,
+    глобальные имена из тела связываются со значениями на момент компиляции
+    :param calc: Функция преобразования из матчинга
+    :param var: Имя переменной со значением поля записи
+    :param namespace: Пространство имен генерируемой функции, в него добавляются глобальные имена lambda
+    :return: Исходный код выражения или None, если встроить нельзя
+    """
+    code = getattr(calc, '__code__', None)
+    if not hasattr(ast, 'unparse') or getattr(calc, '__name__', None) != '<lambda>' or code is None \
+            or code.co_freevars or code.co_argcount != 1:
+        return None
+    node = lambda_node(calc)
+    if node is None or node.args.args[0].arg != code.co_varnames[0]:
+        return None
+    arg = node.args.args[0].arg
+    names = {}
+    for child in ast.walk(node.body):
+        if isinstance(child, ast.Name):
+            if child.id == arg and not isinstance(child.ctx, ast.Load):
+                return None
+            names[child.id] = child
+        elif isinstance(child, (ast.Lambda, ast.NamedExpr)):
+            return None
+    body_locals = {child.id for child in ast.walk(node.body)
+                   if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store)}
+    for name in names:
+        if name in (arg, *body_locals):
+            continue
+        if name in RESERVED_NAMES or name.startswith('v_') or keyword.iskeyword(name):
+            return None
+        if name in calc.__globals__:
+            value = calc.__globals__[name]
+        elif hasattr(builtins, name):
+            value = getattr(builtins, name)
+        else:
+            return None
+        if namespace.setdefault(name, value) is not value:
+            return None
+    if arg in body_locals:
+        return None
+    body = RenameArg(arg, var).visit(ast.parse(ast.unparse(node.body), mode='eval').body)
+    return f'({ast.unparse(body)})'
+
+
+def is_immutable(value):
+    if isinstance(value, tuple):
+        return all(is_immutable(item) for item in value)
+    return value is None or isinstance(value, (str, bytes, int, float, complex))
+
+
+def compile_fields(matching: dict, fields: list = FIELDS):
+    """
+    Компилирует матчинг в функцию cast_fields(record) с тем же результатом, что и cast_fields(record, fields, matching).
+    Запись строится копированием шаблона, где поля без матчинга и константные поля уже заполнены,
+    остальные поля присваиваются по одному, тела lambda по возможности встраиваются в функцию
+    :param matching: Данные для матчинга полей и преобразования
+    :param fields: Поля, к которым нужно привести каждую запись
+    :return: Функция от одной записи API
+    """
+    template = dict.fromkeys(fields)
+    namespace = {'template': template}
+    lines = ['def cast_fields(record):', '    get = record.get']
+    assignments = []
+    values = {}
+    for i, field in enumerate(fields):
+        matching_params = matching.get(field, {})
+        site_field = matching_params.get('name')
+        calc = matching_params.get('calc')
+        if site_field is None:
+            if calc:
+                expression = inline_calc(calc, 'v_none', namespace)
+                if expression is not None:
+                    try:
+                        constant = ast.literal_eval(expression)
+                    except ValueError:
+                        pass
+                    else:
+                        # Преобразование без поля API, не зависящее от значения, - константа шаблона.
+                        # Шаблон копируется неглубоко, поэтому изменяемые значения в него не попадают
+                        if is_immutable(constant):
+                            template[field] = constant
+                            continue
+                namespace[f'calc_{i}'] = calc
+                assignments.append(f'    obj[{field!r}] = calc_{i}(None)')
+            continue
+        if site_field not in values:
+            # Значение поля API читается один раз, даже если от него зависят несколько полей FIELDS
+            values[site_field] = f'v_{len(values)}'
+            lines.append(f'    {values[site_field]} = get({site_field!r})')
+        value = values[site_field]
+        if calc:
+            expression = inline_calc(calc, value, namespace)
+            if expression is None:
+                namespace[f'calc_{i}'] = calc
+                expression = f'calc_{i}({value})'
+            value = expression
+        assignments.append(f'    obj[{field!r}] = {value}')
+    lines.append('    obj = template.copy()')
+    lines.extend(assignments)
+    lines.append('    return obj')
+    source = '\n'.join(lines) + '\n'
+    exec(compile(source, '<cast_fields>', 'exec'), namespace)
+    cast = namespace['cast_fields']
+    cast.source = source
+    return cast
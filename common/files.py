@@ -0,0 +1,50 @@
+"""
+Локальные файлы парсеров: каталог кэша и атомарная запись
+"""
+import json
+import os
+import tempfile
+
+CACHE_DIR = os.environ.get('SCRAPER_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'another_scrapping'))
+
+
+def cache_path(*parts: str, cache_dir: str = None):
+    """
+    Возвращает путь внутри каталога кэша, создавая промежуточные каталоги
+    :param parts: Части пути относительно каталога кэша
+    :param cache_dir: Каталог кэша, по умолчанию CACHE_DIR
+    :return:
+    """
+    path = os.path.join(cache_dir or CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def write_atomic(path: str, data: bytes):
+    """
+    Записывает файл через временный файл и os.replace, читатели видят либо старое, либо новое содержимое
+    :param path: Путь к файлу
+    :param data: Содержимое
+    :return:
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def read_json(path: str, default=None):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path: str, data):
+    write_atomic(path, json.dumps(data, ensure_ascii=False).encode('utf-8'))
@@ -0,0 +1,146 @@
+"""
+Декларативный фильтр записей, общий для всех парсеров.
+Задается строкой вида price=1000000..10000000,area=19..96,floor=2..,rooms=..3,available
+Парсеры передают в запрос к API те ограничения, которые API поддерживает, остальные проверяются
+на записях API сразу после разбора, до cast_fields, так что отброшенные записи не преобразуются.
+"""
+import argparse
+from typing import NamedTuple
+
+RANGES = ('price', 'area', 'floor', 'rooms')
+
+
+class Range(NamedTuple):
+    """
+    Диапазон значений, None - граница не задана. strict_* - граница не входит в диапазон
+    """
+    low: float = None
+    high: float = None
+    strict_low: bool = False
+    strict_high: bool = False
+
+    def override(self, other: 'Range'):
+        """
+        Диапазон, в котором заданные границы other заменяют границы этого диапазона
+        :param other: Диапазон с приоритетом
+        :return:
+        """
+        low, strict_low = (other.low, other.strict_low) if other.low is not None else (self.low, self.strict_low)
+        high, strict_high = (other.high, other.strict_high) if other.high is not None else (self.high, self.strict_high)
+        return Range(low, high, strict_low, strict_high)
+
+    def __contains__(self, value):
+        if self.low is not None and (value <= self.low if self.strict_low else value < self.low):
+            return False
+        if self.high is not None and (value >= self.high if self.strict_high else value > self.high):
+            return False
+        return True
+
+
+class Filter:
+    """
+    Ограничения на цену, площадь, этаж и число комнат и признак "только в продаже"
+    """
+    def __init__(self, price: Range = None, area: Range = None, floor: Range = None, rooms: Range = None,
+                 available: bool = False):
+        self.price = price or Range()
+        self.area = area or Range()
+        self.floor = floor or Range()
+        self.rooms = rooms or Range()
+        self.available = available
+
+    def __bool__(self):
+        return self.available or any(getattr(self, name) != Range() for name in RANGES)
+
+    def __repr__(self):
+        return f'Filter({format_filter(self)!r})'
+
+    def override(self, other: 'Filter' = None):
+        """
+        Фильтр, в котором заданные в other ограничения заменяют ограничения этого фильтра
+        :param other: Фильтр с приоритетом, обычно из командной строки
+        :return:
+        """
+        if other is None:
+            return self
+        return Filter(**{name: getattr(self, name).override(getattr(other, name)) for name in RANGES},
+                      available=self.available or other.available)
+
+    def compile(self, keys: dict, available=None):
+        """
+        Собирает проверку записи API
+        :param keys: {ограничение из RANGES: ключ записи API}, ограничения без ключа не проверяются
+        :param available: Функция, возвращающая по записи API, продается ли объект
+        :return: Функция record -> bool или None, если проверять нечего
+        """
+        checks = [(keys[name], getattr(self, name)) for name in RANGES
+                  if name in keys and getattr(self, name) != Range()]
+        available = available if self.available else None
+        if not checks and available is None:
+            return None
+
+        def accept(record):
+            if available is not None and not available(record):
+                return False
+            for key, bounds in checks:
+                try:
+                    value = float(record[key])
+                except (KeyError, TypeError, ValueError):
+                    return False
+                if value not in bounds:
+                    return False
+            return True
+
+        return accept
+
+
+def number(text: str):
+    value = float(text)
+    return int(value) if value.is_integer() and '.' not in text else value
+
+
+def parse_filter(spec: str):
+    """
+    Разбирает строку фильтра: ограничения через запятую, диапазон - min..max, любая граница может быть опущена,
+    одно число - точное значение, available - только объекты в продаже
+    :param spec: Строка фильтра
+    :return: Filter
+    """
+    ranges = {}
+    available = False
+    for part in filter(None, (part.strip() for part in spec.split(','))):
+        if part == 'available':
+            available = True
+            continue
+        name, sep, value = part.partition('=')
+        name = name.strip()
+        if not sep or name not in RANGES:
+            raise argparse.ArgumentTypeError(
+                f'invalid filter {part!r}, expected one of {", ".join(RANGES)} as name=min..max, or available')
+        try:
+            if '..' in value:
+                low, high = (number(v) if v.strip() else None for v in value.split('..', 1))
+            else:
+                low = high = number(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'invalid filter bounds {value!r}')
+        ranges[name] = Range(low, high)
+    return Filter(**ranges, available=available)
+
+
+def format_filter(spec: Filter):
+    """
+    Строка фильтра, обратная parse_filter. Строгие границы в строке не отличаются от нестрогих
+    :param spec: Фильтр
+    :return:
+    """
+    parts = []
+    for name in RANGES:
+        bounds = getattr(spec, name)
+        if bounds != Range():
+            low = '' if bounds.low is None else bounds.low
+            high = '' if bounds.high is None else bounds.high
+            parts.append(f'{name}={low}..{high}')
+    if spec.available:
+        parts.append('available')
+    return ','.join(parts)
@@ -0,0 +1,161 @@
+"""
+Состояние API комплексов между запусками: какой запрос комплекса проверялся, работает ли он, типичное время
+обработки и ошибки подряд. Хранится в каталоге кэша, health/<парсер>.json:
+{адрес комплекса: {endpoint, latency, failures, error, retry_at, checked, responses}}.
+Комплекс, API которого не отдало записи (MyException, кроме истечения срока запуска) FAILURES_TO_SKIP раз подряд,
+пропускается до retry_at: пауза начинается с RETRY_BASE и удваивается с каждой следующей ошибкой, до RETRY_MAX.
+Пропущенный комплекс парсер возвращает среди неполученных с ошибкой ComplexSkipped.
+Успешный ответ или другой запрос комплекса (переопределение endpoints в парсере) сбрасывают ошибки.
+Время обработки - скользящее среднее: самые медленные комплексы запускаются первыми, запуск заканчивается раньше.
+responses - последние времена ответа хоста комплекса: ими заполняется учет времени ответа клиента, чтобы --hedge
+работал с первого запроса к комплексу, а не после нескольких запросов к нему в одном запуске.
+"""
+import threading
+import time
+
+from common.client import CLIENT, split_address
+from common.errors import ComplexSkipped, DeadlineExceeded, MyException
+from common.files import cache_path, read_json, write_json
+from common.resilience import LatencyTracker
+
+FAILURES_TO_SKIP = 2
+RETRY_BASE = 3600
+RETRY_MAX = 7 * 86400
+# Вес последнего запуска в скользящем среднем времени обработки
+LATENCY_WEIGHT = 0.3
+# Сколько последних времен ответа хоста хранить
+RESPONSES_KEPT = 20
+
+
+def retry_delay(failures: int):
+    """
+    :param failures: Ошибок подряд
+    :return: Пауза до следующей проверки, секунды, 0 - не пропускать
+    """
+    if failures < FAILURES_TO_SKIP:
+        return 0
+    return min(RETRY_BASE * 2 ** (failures - FAILURES_TO_SKIP), RETRY_MAX)
+
+
+class ComplexHealth:
+    """
+    Состояние комплексов одного парсера
+    """
+    def __init__(self, path: str, recheck: bool = False, latencies: LatencyTracker = None):
+        """
+        :param path: Файл состояния
+        :param recheck: Проверить все комплексы, не дожидаясь окончания паузы
+        :param latencies: Учет времени ответа клиента: заполняется сохраненными значениями, при save
+        в файл попадают его последние значения. None - времена ответа не хранятся
+        """
+        self.path = path
+        self.recheck = recheck
+        self.state = read_json(path, {})
+        self.lock = threading.Lock()
+        self.latencies = latencies
+        if latencies is not None:
+            for url, entry in self.state.items():
+                latencies.seed(split_address(url)[1], entry.get('responses', ()))
+
+    def due(self, url: str, endpoint: str):
+        """
+        Нужно ли запрашивать комплекс в этом запуске
+        :param url: Адрес комплекса
+        :param endpoint: Запрос API комплекса, без ограничений фильтра
+        :return:
+        """
+        entry = self.state.get(url)
+        if entry is None or entry.get('endpoint') != endpoint:
+            # Новый комплекс или другой запрос: прежняя история к нему не относится
+            self.state[url] = {'endpoint': endpoint, 'latency': None, 'failures': 0, 'error': None,
+                               'retry_at': None, 'checked': None}
+            return True
+        return self.recheck or not entry['retry_at'] or time.time() >= entry['retry_at']
+
+    def skipped(self, url: str):
+        """
+        Ошибка для комплекса, который не запрашивается в этом запуске
+        :param url: Адрес комплекса
+        :return: ComplexSkipped с последней ошибкой комплекса
+        """
+        entry = self.state[url]
+        retry_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['retry_at']))
+        return ComplexSkipped(f'API не отвечало в прошлых запусках, следующая проверка {retry_at}', entry['error'])
+
+    def priority(self, url: str):
+        """
+        Ключ порядка запуска: сначала комплексы с неизвестным временем обработки, затем от медленных к быстрым
+        :param url: Адрес комплекса
+        :return:
+        """
+        latency = self.state.get(url, {}).get('latency')
+        return -latency if latency is not None else float('-inf')
+
+    def succeeded(self, url: str, seconds: float):
+        with self.lock:
+            entry = self.state[url]
+            latency = entry['latency']
+            entry['latency'] = seconds if latency is None else latency + LATENCY_WEIGHT * (seconds - latency)
+            entry.update(failures=0, error=None, retry_at=None, checked=time.time())
+
+    def failed(self, url: str, error: MyException):
+        with self.lock:
+            entry = self.state[url]
+            now = time.time()
+            failures = entry['failures'] + 1
+            delay = retry_delay(failures)
+            entry.update(failures=failures, error=error.msg, retry_at=now + delay if delay else None, checked=now)
+
+    def records(self, url: str, records):
+        """
+        Отдает записи комплекса и запоминает результат: время получения записей без времени их вывода или ошибку
+        :param url: Адрес комплекса
+        :param records: Записи комплекса
+        :return:
+        """
+        clock = time.perf_counter
+        elapsed = 0.0
+        records = iter(records)
+        while True:
+            start = clock()
+            try:
+                obj = next(records)
+            except StopIteration:
+                self.succeeded(url, elapsed + clock() - start)
+                return
+            except DeadlineExceeded:
+                raise
+            except MyException as e:
+                self.failed(url, e)
+                raise
+            elapsed += clock() - start
+            yield obj
+
+    def track(self, func, url_index: int = 1):
+        """
+        Оборачивает функцию обработки комплекса для iter_ordered
+        :param func: Функция, возвращающая записи комплекса
+        :param url_index: Позиция адреса комплекса в аргументах func
+        :return:
+        """
+        return lambda *item: self.records(item[url_index], func(*item))
+
+    def save(self):
+        with self.lock:
+            if self.latencies is not None:
+                for url, entry in self.state.items():
+                    responses = self.latencies.recent(split_address(url)[1], RESPONSES_KEPT)
+                    if responses:
+                        entry['responses'] = responses
+            write_json(self.path, self.state)
+
+
+def open_health(options, site: str):
+    """
+    Состояние комплексов парсера из каталога кэша
+    :param options: Результат разбора аргументов
+    :param site: Имя парсера
+    :return: ComplexHealth
+    """
+    return ComplexHealth(cache_path('health', f'{site}.json', cache_dir=options.cache_dir),
+                         recheck=options.recheck_broken, latencies=CLIENT.latencies)
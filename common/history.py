@@ -0,0 +1,252 @@
+"""
+История цен в локальной базе SQLite.
+Каждый запуск с --history сохраняет записи FIELDS одной короткой транзакцией в конце запуска.
+Строка истории добавляется только при изменении записи: новая квартира, изменившиеся поля или пропажа с сайта.
+Квартиры опознаются так же, как в режиме --diff (common/diff.py). Индексы по квартире и по (комплекс, время)
+позволяют быстро получать историю цены квартиры и изменения в комплексе за период:
+
+    python -m common.history flat 'Новокрасково (МО)|1|2|105'
+    python -m common.history drops 'Новокрасково (МО)' --days 7
+"""
+import argparse
+import json
+import sqlite3
+import time
+
+from common.diff import record_hash, record_key
+from common.files import CACHE_DIR, cache_path
+
+BATCH_SIZE = 1000
+# Поля цены по приоритету: цена квартиры - первое заполненное из них
+PRICE_FIELDS = ('price_finished_sale', 'price_sale', 'price_finished', 'price_base', 'price')
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    site TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    records INTEGER,
+    changes INTEGER
+);
+CREATE TABLE IF NOT EXISTS listings (
+    id INTEGER PRIMARY KEY,
+    site TEXT NOT NULL,
+    key TEXT NOT NULL,
+    complex TEXT,
+    hash BLOB,
+    removed INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS listings_key ON listings (key, site);
+CREATE TABLE IF NOT EXISTS history (
+    listing_id INTEGER NOT NULL REFERENCES listings (id),
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    ts REAL NOT NULL,
+    complex TEXT,
+    price REAL,
+    in_sale INTEGER,
+    removed INTEGER NOT NULL DEFAULT 0,
+    record TEXT
+);
+CREATE INDEX IF NOT EXISTS history_listing ON history (listing_id, ts);
+CREATE INDEX IF NOT EXISTS history_complex ON history (complex, ts);
+"""
+# Изменения запуска до записи в базу, видны только соединению запуска
+TEMP_SCHEMA = """
+CREATE TEMP TABLE changes (
+    key TEXT PRIMARY KEY,
+    complex TEXT,
+    hash BLOB,
+    price REAL,
+    in_sale INTEGER,
+    removed INTEGER NOT NULL,
+    record TEXT
+);
+CREATE TEMP TABLE seen (key TEXT PRIMARY KEY);
+CREATE TEMP TABLE failed (complex TEXT PRIMARY KEY);
+"""
+
+
+def default_path(cache_dir: str = None):
+    return cache_path('history.sqlite3', cache_dir=cache_dir)
+
+
+def connect(path: str):
+    """
+    Открывает базу истории, создавая таблицы и индексы
+    :param path: Путь к файлу базы
+    :return: sqlite3.Connection
+    """
+    # Транзакции открываются явно, одновременный запуск ждет окончания записи другого
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record_price(obj: dict):
+    for field in PRICE_FIELDS:
+        if obj.get(field) is not None:
+            return obj[field]
+    return None
+
+
+class HistoryWriter:
+    """
+    Обертка над объектом вывода, сохраняющая изменения записей в базу истории.
+    Во время запуска изменения копятся во временных таблицах соединения и базу не блокируют. В конце запуска
+    они записываются одной короткой транзакцией: при ошибке запуска база остается в прежнем состоянии
+    """
+    def __init__(self, writer, conn: sqlite3.Connection, site: str):
+        self.writer = writer
+        self.conn = conn
+        self.site = site
+        self.ts = time.time()
+        conn.executescript(TEMP_SCHEMA)
+        # Состояние квартир сайта на начало запуска: {ключ: (хэш, пропала ли с сайта)}
+        self.listings = {key: (digest, removed) for key, digest, removed in conn.execute(
+            'SELECT key, hash, removed FROM listings WHERE site = ?', (site,))}
+        self.seen = set()
+        self.failed = set()
+        self.records = 0
+        self.rows = []
+
+    def write(self, obj: dict):
+        self.writer.write(obj)
+        self.records += 1
+        key = record_key(obj)
+        if key in self.seen:
+            return
+        self.seen.add(key)
+        digest = record_hash(obj)
+        if self.listings.get(key) == (digest, 0):
+            return
+        self.rows.append((key, obj['complex'], digest, record_price(obj), obj.get('in_sale'), 0,
+                          json.dumps(obj, ensure_ascii=False)))
+        if len(self.rows) >= BATCH_SIZE:
+            self.insert()
+
+    def insert(self):
+        """
+        Переносит накопленные изменения во временную таблицу пачкой
+        :return:
+        """
+        self.conn.executemany('INSERT INTO temp.changes (key, complex, hash, price, in_sale, removed, record) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)', self.rows)
+        self.rows = []
+
+    def write_all(self, records):
+        for obj in records:
+            self.write(obj)
+
+    def fail(self, complex_name: str):
+        """
+        Отмечает комплекс, который не удалось получить: его квартиры не считаются пропавшими
+        :param complex_name: Название комплекса
+        :return:
+        """
+        self.failed.add(complex_name)
+        self.writer.fail(complex_name)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        self.insert()
+        conn, site = self.conn, self.site
+        conn.executemany('INSERT INTO temp.seen (key) VALUES (?)', ((key,) for key in self.seen))
+        conn.executemany('INSERT INTO temp.failed (complex) VALUES (?)', ((name,) for name in self.failed))
+        # Изменения сверяются с состоянием базы на конец запуска: его мог обновить одновременный запуск
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            'INSERT INTO temp.changes (key, complex, hash, removed) '
+            'SELECT key, complex, hash, 1 FROM listings l WHERE site = ? AND NOT removed '
+            'AND key NOT IN temp.seen AND NOT EXISTS (SELECT 1 FROM temp.failed f WHERE f.complex = l.complex)',
+            (site,))
+        conn.execute(
+            'DELETE FROM temp.changes WHERE EXISTS (SELECT 1 FROM listings l WHERE l.site = ? '
+            'AND l.key = changes.key AND l.hash IS changes.hash AND l.removed = changes.removed)', (site,))
+        changes = conn.execute('SELECT COUNT(*) FROM temp.changes').fetchone()[0]
+        run_id = conn.execute('INSERT INTO runs (site, started, finished, records, changes) VALUES (?, ?, ?, ?, ?)',
+                              (site, self.ts, time.time(), self.records, changes)).lastrowid
+        conn.execute(
+            'INSERT INTO listings (site, key, complex, hash, removed, updated) '
+            'SELECT ?, key, complex, hash, removed, ? FROM temp.changes WHERE true ORDER BY rowid '
+            'ON CONFLICT (key, site) DO UPDATE SET complex = excluded.complex, hash = excluded.hash, '
+            'removed = excluded.removed, updated = excluded.updated', (site, self.ts))
+        conn.execute(
+            'INSERT INTO history (listing_id, run_id, ts, complex, price, in_sale, removed, record) '
+            'SELECT l.id, ?, ?, c.complex, c.price, c.in_sale, c.removed, c.record '
+            'FROM temp.changes c JOIN listings l ON l.site = ? AND l.key = c.key ORDER BY c.rowid',
+            (run_id, self.ts, site))
+        conn.execute('COMMIT')
+        conn.close()
+
+
+def price_history(conn: sqlite3.Connection, key: str, site: str = None):
+    """
+    История квартиры
+    :param conn: База истории
+    :param key: Ключ квартиры, как в common.diff.record_key
+    :param site: Имя парсера, None - любой
+    :return: Список кортежей (время, цена, в продаже, снята ли с сайта)
+    """
+    query = 'SELECT h.ts, h.price, h.in_sale, h.removed FROM listings l JOIN history h ON h.listing_id = l.id ' \
+            'WHERE l.key = ?'
+    params = [key]
+    if site is not None:
+        query += ' AND l.site = ?'
+        params.append(site)
+    return conn.execute(query + ' ORDER BY h.ts', params).fetchall()
+
+
+def price_drops(conn: sqlite3.Connection, complex_name: str, since: float):
+    """
+    Снижения цены в комплексе начиная с момента since
+    :param conn: База истории
+    :param complex_name: Название комплекса
+    :param since: Время в секундах с начала эпохи
+    :return: Список кортежей (ключ квартиры, время, прежняя цена, новая цена)
+    """
+    # Для каждого изменения в периоде прежняя цена - цена предыдущего изменения той же квартиры
+    return conn.execute("""
+        SELECT key, ts, previous, price FROM (
+            SELECT l.key, h.ts, h.price, (SELECT p.price FROM history p
+                                          WHERE p.listing_id = h.listing_id AND p.ts < h.ts AND p.price IS NOT NULL
+                                          ORDER BY p.ts DESC LIMIT 1) AS previous
+            FROM history h JOIN listings l ON l.id = h.listing_id
+            WHERE h.complex = ? AND h.ts >= ? AND h.price IS NOT NULL
+        )
+        WHERE previous > price
+        ORDER BY ts
+    """, (complex_name, since)).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query the price history stored by --history.')
+    parser.add_argument('--db', help=f'History database, by default history.sqlite3 in {CACHE_DIR}.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    flat = commands.add_parser('flat', help='Price history of one listing.')
+    flat.add_argument('key', help="Listing key: 'complex|article' or 'complex|building|section|number'.")
+    flat.add_argument('--site')
+    drops = commands.add_parser('drops', help='Price drops in a complex.')
+    drops.add_argument('complex')
+    drops.add_argument('--days', type=float, default=7)
+    args = parser.parse_args(argv)
+    conn = connect(args.db or default_path())
+
+    def format_ts(ts):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))
+
+    if args.command == 'flat':
+        for ts, price, in_sale, removed in price_history(conn, args.key, args.site):
+            print(format_ts(ts), 'removed' if removed else f'{price} in_sale={in_sale}')
+    else:
+        for key, ts, previous, price in price_drops(conn, args.complex, time.time() - args.days * 86400):
+            print(format_ts(ts), key, previous, '->', price)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Потоковый разбор JSON-ответов.
+Записи массива отдаются по одной по мере получения частей тела ответа, тело целиком не собирается и не декодируется в str.
+"""
+import codecs
+import json
+from json import JSONDecodeError
+
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '0123456789.eE+-'
+
+
+class StreamReader:
+    """
+    Буфер над потоком частей тела ответа. Хранит только еще не разобранный хвост
+    """
+    def __init__(self, chunks, encoding: str = 'utf-8'):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size: int = 1):
+        """
+        Дочитывает из потока не меньше size символов
+        :param size: Сколько символов нужно дочитать
+        :return: False, если поток закончился
+        """
+        if self.eof:
+            return False
+        # Разобранная часть буфера отбрасывается
+        parts = [self.buf[self.pos:]]
+        self.pos = 0
+        read = 0
+        while read < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                parts.append(self.decoder.decode(b'', final=True))
+                self.eof = True
+                break
+            text = self.decoder.decode(chunk)
+            parts.append(text)
+            read += len(text)
+        self.buf = ''.join(parts)
+        return read > 0 or len(self.buf) > 0
+
+    def peek(self):
+        """
+        Пропускает пробельные символы и возвращает следующий символ, пустую строку в конце потока
+        :return:
+        """
+        while True:
+            buf = self.buf
+            pos = self.pos
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars: str):
+        char = self.peek()
+        if not char or char not in chars:
+            raise self.error(f'Expecting one of {chars!r}')
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Разбирает очередное JSON-значение, при необходимости дочитывая поток
+        :return:
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = self.json.raw_decode(self.buf, self.pos)
+            except JSONDecodeError:
+                if self.eof:
+                    raise
+                # Значение не поместилось в буфер: дочитываем не меньше, чем уже есть, чтобы не разбирать заново много раз
+                self.fill(max(len(self.buf) - self.pos, 1))
+                continue
+            # Число на границе буфера могло быть обрезано, например 15000000000. или 1.5e
+            if not self.eof and isinstance(obj, (int, float)) and not isinstance(obj, bool) \
+                    and not self.buf[end:].strip(NUMBER_CHARS):
+                self.fill()
+                continue
+            self.pos = end
+            return obj
+
+    def drain(self):
+        """
+        Дочитывает поток до конца, чтобы соединение можно было переиспользовать
+        :return:
+        """
+        for _ in self.chunks:
+            pass
+
+    def error(self, msg: str):
+        return JSONDecodeError(msg, self.buf, self.pos)
+
+
+def iter_items(chunks, path=(), encoding: str = 'utf-8'):
+    """
+    Отдает элементы JSON-массива по одному. Массив может быть корнем документа или лежать в объекте по ключам path.
+    Ошибки разбора выбрасываются как JSONDecodeError, первая из них - до первой отданной записи,
+    если ответ вообще не JSON
+    :param chunks: Итератор частей тела ответа в байтах
+    :param path: Последовательность ключей объектов до массива, например ('data',)
+    :param encoding: Кодировка тела ответа
+    :return:
+    """
+    reader = StreamReader(chunks, encoding)
+    for key in path:
+        reader.expect('{')
+        while True:
+            if reader.peek() != '"':
+                raise reader.error(f'Key {key!r} not found')
+            name = reader.value()
+            reader.expect(':')
+            if name == key:
+                break
+            # Значения остальных ключей пропускаем
+            reader.value()
+            if reader.expect(',}') == '}':
+                raise reader.error(f'Key {key!r} not found')
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+    else:
+        while True:
+            yield reader.value()
+            if reader.expect(',]') == ']':
+                break
+    reader.drain()
@@ -0,0 +1,440 @@
+"""
+Метрики запуска парсера: время этапов и объем данных по комплексам, пиковая память.
+Этапы: discovery - поиск комплексов, connect - установка соединений, download - чтение и распаковка ответов,
+decode - потоковый разбор JSON, cast - cast_fields, post - остальное преобразование записи,
+plans - проверка ссылок на планы, serialize - вывод.
+Счетчики: запросы, полученные байты, записи API, отброшенные фильтром и выведенные записи.
+Сбор включается аргументом --metrics, без него замеры не выполняются. У каждого запуска свой объект Metrics
+в контексте его потока, в режиме демона одновременные запуски не смешивают значения. Общими для процесса остаются
+пиковая память и tracemalloc.
+Аргумент --profile включает cProfile или tracemalloc на время разбора и преобразования записей. cProfile
+одновременно работает только один: комплексы, обработка которых пересекается с уже профилируемым, измеряются,
+но не профилируются, полный профиль дает --workers 1.
+"""
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGES = ('discovery', 'connect', 'download', 'decode', 'cast', 'post', 'plans', 'serialize')
+COUNTERS = ('requests', 'bytes', 'records_in', 'filtered', 'records_out')
+PROFILERS = ['cprofile', 'tracemalloc']
+# Сколько самых затратных функций или строк попадает в отчет профилировщика
+PROFILE_TOP = 20
+# Профилировщик в процессе может быть включен только один (с Python 3.12 это проверяется)
+PROFILE_LOCK = threading.Lock()
+# tracemalloc общий для процесса: работает, пока его использует хотя бы один запуск
+TRACEMALLOC_LOCK = threading.Lock()
+tracemalloc_runs = 0
+
+
+class SourceStats:
+    """
+    Время этапов и счетчики одного хоста
+    """
+    def __init__(self, host: str = None):
+        self.host = host
+        self.complex = None
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+
+    def add(self, **values):
+        """
+        Прибавляет значения: имена из STAGES - секунды, из COUNTERS - количества
+        :return:
+        """
+        with self.lock:
+            for name, value in values.items():
+                if name in self.times:
+                    self.times[name] += value
+                else:
+                    self.counts[name] += value
+
+    def report(self):
+        return {'host': self.host, 'complex': self.complex, 'stages': dict(self.times), 'counters': dict(self.counts)}
+
+
+class Timed:
+    """
+    Итератор, считающий время, потраченное на получение элементов
+    """
+    def __init__(self, items):
+        self.items = iter(items)
+        self.spent = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return next(self.items)
+        finally:
+            self.spent += time.perf_counter() - start
+
+
+class TimedWriter:
+    """
+    Объект вывода, время работы которого учитывается как serialize
+    """
+    def __init__(self, writer, stats: SourceStats):
+        self.writer = writer
+        self.stats = stats
+
+    def write(self, obj: dict):
+        start = time.perf_counter()
+        self.writer.write(obj)
+        self.stats.add(serialize=time.perf_counter() - start)
+
+    def write_all(self, records):
+        # Записи получаются вне замера: их скачивание и разбор учитываются в своих этапах
+        for obj in records:
+            self.write(obj)
+
+    def fail(self, complex_name: str):
+        self.writer.fail(complex_name)
+
+    def flush(self):
+        start = time.perf_counter()
+        self.writer.flush()
+        self.stats.add(serialize=time.perf_counter() - start)
+
+    def close(self):
+        start = time.perf_counter()
+        self.writer.close()
+        self.stats.add(serialize=time.perf_counter() - start)
+
+
+def transform_records(records, accept, cast, post):
+    """
+    Отбрасывает записи API, не прошедшие accept, и преобразует остальные в post(cast(record), record)
+    """
+    for record in records:
+        if accept is not None and not accept(record):
+            continue
+        yield post(cast(record), record)
+
+
+def start_tracemalloc():
+    global tracemalloc_runs
+    with TRACEMALLOC_LOCK:
+        tracemalloc_runs += 1
+        if tracemalloc.is_tracing():
+            if tracemalloc_runs == 1:
+                tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+
+
+def stop_tracemalloc():
+    global tracemalloc_runs
+    with TRACEMALLOC_LOCK:
+        tracemalloc_runs -= 1
+        if not tracemalloc_runs:
+            tracemalloc.stop()
+
+
+def peak_rss():
+    """
+    Пиковый размер памяти процесса за все время его работы
+    :return: Байты или None, если модуль resource недоступен
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: dict):
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in labels.items() if value is not None)
+
+
+class Metrics:
+    """
+    Метрики одного запуска: общий этап (host None) и этапы по хостам комплексов
+    """
+    def __init__(self, enabled: bool = False, profiler: str = None):
+        """
+        :param enabled: Собирать метрики
+        :param profiler: Профилировщик из PROFILERS или None
+        """
+        self.enabled = enabled
+        self.profiler = profiler if enabled else None
+        self.lock = threading.Lock()
+        self.sources = {}
+        self.profile = None
+        self.started = time.monotonic()
+        if self.profiler == 'tracemalloc':
+            start_tracemalloc()
+
+    def source(self, host: str = None):
+        """
+        :param host: Хост, None - этапы всего запуска
+        :return: SourceStats
+        """
+        stats = self.sources.get(host)
+        if stats is None:
+            with self.lock:
+                stats = self.sources.setdefault(host, SourceStats(host))
+        return stats
+
+    def add(self, host: str = None, **values):
+        """
+        Прибавляет значения этапов и счетчиков хоста, если сбор включен
+        :param host: Хост, None - этапы всего запуска
+        :return:
+        """
+        if self.enabled:
+            self.source(host).add(**values)
+
+    def stage(self, name: str, host: str = None):
+        """
+        Контекстный менеджер, время выполнения блока прибавляется к этапу
+        :param name: Этап из STAGES
+        :param host: Хост, None - этап всего запуска
+        :return:
+        """
+        return StageTimer(self, name, host)
+
+    def writer(self, writer):
+        """
+        :param writer: Объект вывода
+        :return: Объект вывода, время работы которого учитывается как serialize
+        """
+        return TimedWriter(writer, self.source()) if self.enabled else writer
+
+    def body(self, host: str, res, parse=None):
+        """
+        Отдает части тела ответа или, если задана функция parse, результат её применения к ним.
+        Время чтения и распаковки учитывается как download, остальное время разбора - как decode
+        :param host: Хост
+        :param res: client.Response
+        :param parse: Функция, превращающая итератор частей тела в итератор элементов
+        :return:
+        """
+        chunks = Timed(res.iter_chunks())
+        items = Timed(parse(chunks)) if parse else chunks
+        try:
+            yield from items
+        finally:
+            self.add(host, download=chunks.spent, decode=items.spent - chunks.spent if parse else 0.0,
+                     bytes=res.bytes_received)
+
+    def records(self, records, accept, cast, post, host: str, complex_name: str = None):
+        """
+        Отбрасывает записи API, не прошедшие accept, и преобразует остальные в post(cast(record), record).
+        Если сбор включен, считает записи и время cast и post, а при --profile cprofile профилирует обработку
+        :param records: Записи API
+        :param accept: Проверка записи фильтром или None
+        :param cast: Преобразование полей из матчинга
+        :param post: Остальное преобразование, получает результат cast и запись API
+        :param host: Хост комплекса
+        :param complex_name: Название комплекса для отчета
+        :return:
+        """
+        if not self.enabled:
+            return transform_records(records, accept, cast, post)
+        stats = self.source(host)
+        stats.complex = complex_name or stats.complex
+        return self.measure_records(records, accept, cast, post, stats)
+
+    def measure_records(self, records, accept, cast, post, stats: SourceStats):
+        clock = time.perf_counter
+        cast_time = post_time = 0.0
+        records_in = filtered = 0
+        profile = None
+        if self.profiler == 'cprofile' and PROFILE_LOCK.acquire(blocking=False):
+            # Профилировщик действует в потоке обработки комплекса, пока его записи не прочитаны
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except BaseException:
+                PROFILE_LOCK.release()
+                raise
+        try:
+            for record in records:
+                records_in += 1
+                if accept is not None and not accept(record):
+                    filtered += 1
+                    continue
+                start = clock()
+                obj = cast(record)
+                middle = clock()
+                obj = post(obj, record)
+                cast_time += middle - start
+                post_time += clock() - middle
+                yield obj
+        finally:
+            if profile is not None:
+                profile.disable()
+                PROFILE_LOCK.release()
+                self.add_profile(profile)
+            stats.add(cast=cast_time, post=post_time, records_in=records_in, filtered=filtered,
+                      records_out=records_in - filtered)
+
+    def add_profile(self, profile: cProfile.Profile):
+        with self.lock:
+            if self.profile is None:
+                self.profile = pstats.Stats(profile)
+            else:
+                self.profile.add(profile)
+
+    def report(self, site: str):
+        """
+        Отчет о запуске: этапы и счетчики всего и по хостам, пиковая память и результат профилировщика.
+        Этапы хостов, обработанных параллельно, в сумме могут превышать время запуска
+        :param site: Имя парсера
+        :return: Словарь
+        """
+        with self.lock:
+            sources = list(self.sources.values())
+        stages = dict.fromkeys(STAGES, 0.0)
+        counters = dict.fromkeys(COUNTERS, 0)
+        for stats in sources:
+            for name, value in stats.times.items():
+                stages[name] += value
+            for name, value in stats.counts.items():
+                counters[name] += value
+        result = {
+            'site': site,
+            'finished': time.time(),
+            'wall': time.monotonic() - self.started,
+            'peak_rss': peak_rss(),
+            'stages': stages,
+            'counters': counters,
+            'run': self.source().report(),
+            'sources': [stats.report() for stats in sources if stats.host is not None],
+        }
+        if self.profiler == 'tracemalloc' and tracemalloc.is_tracing():
+            result['peak_traced'] = tracemalloc.get_traced_memory()[1]
+            statistics = tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP]
+            result['allocations'] = [{'location': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                                      'size': stat.size, 'count': stat.count} for stat in statistics]
+        if self.profile is not None:
+            rows = sorted(self.profile.stats.items(), key=lambda item: item[1][2], reverse=True)[:PROFILE_TOP]
+            result['functions'] = [{'function': f'{filename}:{line}({name})', 'calls': calls,
+                                    'self': own, 'cumulative': cumulative}
+                                   for (filename, line, name), (_, calls, own, cumulative, _) in rows]
+        return result
+
+    def finish(self, site: str, path: str = None):
+        """
+        Записывает отчет о запуске в файл: в формате Prometheus, если имя файла оканчивается на .prom, иначе в JSON.
+        Результат cProfile дополнительно сохраняется рядом в файл .pstats
+        :param site: Имя парсера
+        :param path: Путь к файлу, None - не записывать
+        :return: Отчет или None, если сбор выключен
+        """
+        if not self.enabled:
+            return None
+        result = self.report(site)
+        if self.profiler == 'tracemalloc':
+            stop_tracemalloc()
+        if path:
+            if path.endswith('.prom'):
+                text = prometheus(result)
+            else:
+                text = json.dumps(result, ensure_ascii=False, indent=2)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            if self.profile is not None:
+                self.profile.dump_stats(f'{os.path.splitext(path)[0]}.pstats')
+        return result
+
+
+class StageTimer:
+    def __init__(self, metrics: Metrics, name: str, host: str = None):
+        self.metrics = metrics
+        self.name = name
+        self.host = host
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.host, **{self.name: time.perf_counter() - self.start})
+
+
+def prometheus(result: dict):
+    """
+    Отчет в текстовом формате Prometheus, например для textfile collector node_exporter
+    :param result: Результат Metrics.report
+    :return: Текст
+    """
+    site = result['site']
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{{{format_labels(dict(site=site, **labels))}}} {value}')
+
+    # Итоги в формате Prometheus не дублируются: выводятся этапы всего запуска и этапы хостов, сумма по ним - итог
+    sources = [result['run']] + result['sources']
+    metric('scraper_run_seconds', 'gauge', 'Wall time of the run.', [({}, result['wall'])])
+    metric('scraper_run_finished_timestamp_seconds', 'gauge', 'Time the run finished.', [({}, result['finished'])])
+    if result['peak_rss'] is not None:
+        metric('scraper_peak_rss_bytes', 'gauge', 'Peak resident memory of the process.', [({}, result['peak_rss'])])
+    if 'peak_traced' in result:
+        metric('scraper_peak_traced_bytes', 'gauge', 'Peak memory traced by tracemalloc during the run.',
+               [({}, result['peak_traced'])])
+    metric('scraper_stage_seconds', 'gauge', 'Time spent per stage and host, without host - by the whole run.',
+           [({'host': stats['host'], 'complex': stats['complex'], 'stage': name}, value)
+            for stats in sources for name, value in stats['stages'].items()])
+    for counter, help_text in (('requests', 'HTTP requests sent.'), ('bytes', 'Response bytes received.'),
+                               ('records_in', 'API records parsed.'), ('filtered', 'API records dropped by filter.'),
+                               ('records_out', 'Records converted.')):
+        metric(f'scraper_{counter}_total', 'counter', help_text,
+               [({'host': stats['host'], 'complex': stats['complex']}, stats['counters'][counter])
+                for stats in sources])
+    return '\n'.join(lines) + '\n'
+
+
+# Метрики запуска в контексте его потока, в рабочие потоки переходят через concurrency.in_context
+CURRENT = contextvars.ContextVar('metrics')
+# Метрики вне запуска: сбор выключен
+IDLE = Metrics()
+
+
+class RunMetrics:
+    """
+    Метрики текущего запуска. start создает новый объект Metrics в контексте потока запуска,
+    остальные атрибуты и методы берутся у него
+    """
+    def start(self, enabled: bool = False, profiler: str = None):
+        """
+        Начинает новый запуск
+        :param enabled: Собирать метрики
+        :param profiler: Профилировщик из PROFILERS или None
+        :return: Metrics
+        """
+        metrics = Metrics(enabled, profiler)
+        CURRENT.set(metrics)
+        return metrics
+
+    def current(self):
+        return CURRENT.get(IDLE)
+
+    def __getattr__(self, name):
+        return getattr(CURRENT.get(IDLE), name)
+
+
+METRICS = RunMetrics()
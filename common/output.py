@@ -0,0 +1,139 @@
+"""
+Вывод записей в поток.
+json - весь результат одним JSON-массивом в конце работы (формат по умолчанию),
+json-stream - тот же JSON-массив, но записи выводятся по мере получения,
+ndjson - одна запись на строку, по мере получения,
+columnar - сжатые двоичные колоночные блоки по мере получения, читаются common/columnar.py.
+При параллельной обработке (concurrency.iter_ordered) записи комплекса приходят сюда все сразу, когда он получен
+целиком, по одной - только в последовательном режиме.
+"""
+import json
+import os
+import sys
+
+from common import history
+from common.columnar import ColumnarWriter
+from common.diff import DiffWriter, SnapshotIndex
+from common.files import cache_path
+from common.metrics import METRICS
+from common.plans import PlanChecker, PlanStore, PlanWriter
+from common.records import RecordBatch, write_json
+
+FORMATS = ['json', 'json-stream', 'ndjson', 'columnar']
+
+
+class JsonWriter:
+    """
+    Накапливает записи в колоночных RecordBatch и выводит их одним JSON-массивом при закрытии.
+    Записи с другими полями, например добавленными правилами акций, начинают новый RecordBatch
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.result = [RecordBatch()]
+
+    def write(self, obj: dict):
+        try:
+            self.result[-1].append(obj)
+        except ValueError:
+            batch = RecordBatch()
+            batch.append(obj)
+            self.result.append(batch)
+
+    def write_all(self, records):
+        for obj in records:
+            self.write(obj)
+
+    def fail(self, complex_name: str):
+        """
+        Сообщает, что записи комплекса не получены
+        :param complex_name: Название комплекса
+        :return:
+        """
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # Выводим данные в поток
+        write_json(self.result, self.stream)
+        self.stream.flush()
+
+
+class JsonStreamWriter(JsonWriter):
+    """
+    Выводит JSON-массив по частям, результат побайтно совпадает с JsonWriter
+    """
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.separator = '['
+
+    def write(self, obj: dict):
+        self.stream.write(self.separator)
+        self.stream.write(json.dumps(obj, ensure_ascii=False))
+        self.separator = ', '
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.write('[]' if self.separator == '[' else ']')
+        self.stream.flush()
+
+
+class NdjsonWriter(JsonStreamWriter):
+    """
+    Выводит по одной записи в строке
+    """
+    def write(self, obj: dict):
+        self.stream.write(json.dumps(obj, ensure_ascii=False))
+        self.stream.write('\n')
+
+    def close(self):
+        self.stream.flush()
+
+
+WRITERS = {
+    'json': JsonWriter,
+    'json-stream': JsonStreamWriter,
+    'ndjson': NdjsonWriter,
+    'columnar': ColumnarWriter,
+}
+
+
+def make_writer(fmt: str = 'json', stream=None, compression: str = 'gzip'):
+    """
+    Возвращает объект вывода записей в выбранном формате
+    :param fmt: Формат вывода из FORMATS
+    :param stream: Поток вывода, по умолчанию sys.stdout
+    :param compression: Сжатие двоичного формата, из columnar.COMPRESSIONS
+    :return:
+    """
+    if fmt == 'columnar':
+        return ColumnarWriter(stream or sys.stdout, compression)
+    return WRITERS[fmt](stream or sys.stdout)
+
+
+def open_output(options, site: str, stream=None):
+    """
+    Возвращает объект вывода по аргументам командной строки: с проверкой ссылок на планы при --check-plans
+    и --mirror-plans, в режиме --diff - с фильтром изменений, при --history - с сохранением истории цен
+    :param options: Результат разбора аргументов
+    :param site: Имя парсера, под ним хранится индекс снимка
+    :param stream: Поток вывода, по умолчанию sys.stdout
+    :return:
+    """
+    writer = METRICS.writer(make_writer(options.format, stream, options.compression))
+    if options.check_plans or options.mirror_plans:
+        store = None
+        if options.mirror_plans:
+            store = PlanStore(os.path.dirname(cache_path('plans', 'index.json', cache_dir=options.cache_dir)))
+        # Проверяются только выводимые записи: в режиме --diff - новые, изменившиеся и удаленные
+        writer = PlanWriter(writer, PlanChecker(options.workers, store))
+    if options.diff:
+        index = SnapshotIndex(cache_path('snapshots', f'{site}.pickle', cache_dir=options.cache_dir))
+        writer = DiffWriter(writer, index)
+    if options.history is not None:
+        # История получает все записи, до фильтра изменений
+        path = options.history or history.default_path(options.cache_dir)
+        writer = history.HistoryWriter(writer, history.connect(path), site)
+    return writer
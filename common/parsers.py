@@ -0,0 +1,34 @@
+"""
+Загрузка модулей парсеров по имени.
+Каталоги парсеров не являются пакетами, поэтому модули загружаются из файлов.
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARSERS = {
+    'nk': os.path.join('0-nk_ilike_ru', 'nk_ilike_ru.py'),
+    'nt': os.path.join('0-nt_ilike_ru', 'nt_ilike_ru.py'),
+    'loftfm': os.path.join('0-loftfm_mrloft_ru', 'loftfm_mrloft_ru.py'),
+}
+
+
+def load_parser(name: str):
+    """
+    Возвращает модуль парсера, загружая его один раз
+    :param name: Имя парсера из PARSERS
+    :return:
+    """
+    module_name = f'parsers_{name}'
+    module = sys.modules.get(module_name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, PARSERS[name]))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
+    return module
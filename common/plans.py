@@ -0,0 +1,225 @@
+"""
+Проверка ссылок на планы квартир и локальное хранилище планов.
+Ссылки проверяются параллельно HEAD-запросами на соединениях общего пула, каждый адрес - один раз за запуск:
+у многих квартир один и тот же план. Результат записывается в поле plan_alive: True, False или None,
+если плана нет или проверить его не успели.
+Хранилище адресуется по содержимому: файл плана называется SHA-256 его содержимого, одинаковые планы
+с разных адресов хранятся один раз. Индекс {адрес: хэш и валидаторы ответа} позволяет не скачивать планы повторно:
+известный адрес перепроверяется условным запросом или, если сервер не отдал ETag/Last-Modified, HEAD-запросом.
+Хэш плана записывается в поле plan_hash.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from common.client import CLIENT
+from common.concurrency import in_context
+from common.errors import DeadlineExceeded
+from common.files import read_json, write_json
+from common.metrics import METRICS
+
+# Статусы, на которые сервер отвечает, если не поддерживает HEAD: тогда ссылка проверяется GET-запросом
+HEAD_UNSUPPORTED = {405, 501}
+
+
+def split_url(url: str):
+    """
+    :param url: Полный адрес
+    :return: Кортеж (адрес сайта, путь запроса)
+    """
+    parts = urlsplit(url)
+    endpoint = parts.path or '/'
+    if parts.query:
+        endpoint = f'{endpoint}?{parts.query}'
+    return f'{parts.scheme}://{parts.netloc}', endpoint
+
+
+def check_url(url: str):
+    """
+    Проверяет ссылку HEAD-запросом, тело не скачивается
+    :param url: Адрес плана
+    :return: True, если сервер ответил не ошибкой
+    """
+    address, endpoint = split_url(url)
+    res = CLIENT.request(address, endpoint, 'HEAD')
+    res.read()
+    if res.status in HEAD_UNSUPPORTED:
+        # Ответ не дочитывается, соединение закрывается
+        res = CLIENT.request(address, endpoint, 'GET')
+        res.close()
+    return res.status < 400
+
+
+class PlanStore:
+    """
+    Каталог с планами: objects/<первые 2 символа хэша>/<хэш> и индекс index.json {адрес: {hash, etag, modified}}
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.json')
+        self.index = read_json(self.index_path, {})
+        self.lock = threading.Lock()
+
+    def object_path(self, digest: str):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def fetch(self, url: str):
+        """
+        Проверяет ссылку и сохраняет план, если его еще нет или он изменился
+        :param url: Адрес плана
+        :return: Кортеж (доступна ли ссылка, хэш плана или None)
+        """
+        with self.lock:
+            entry = self.index.get(url)
+        if entry is not None and not os.path.exists(self.object_path(entry['hash'])):
+            entry = None
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('modified'):
+                headers['If-Modified-Since'] = entry['modified']
+            if not headers:
+                # Проверить, не изменился ли план, нечем: считаем, что по одному адресу всегда один план
+                return check_url(url), entry['hash']
+        address, endpoint = split_url(url)
+        res = CLIENT.request(address, endpoint, 'GET', '', headers)
+        if entry is not None and res.status == 304:
+            res.read()
+            return True, entry['hash']
+        if res.status != 200:
+            res.close()
+            return res.status < 400, None
+        digest = self.save(res)
+        with self.lock:
+            self.index[url] = {'hash': digest, 'etag': res.getheader('ETag'),
+                               'modified': res.getheader('Last-Modified')}
+        return True, digest
+
+    def save(self, res):
+        """
+        Сохраняет тело ответа под его хэшем, уже сохраненное содержимое не дублируется
+        :param res: client.Response
+        :return: Хэш содержимого
+        """
+        objects = os.path.join(self.root, 'objects')
+        os.makedirs(objects, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=objects, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in res.iter_chunks():
+                    digest.update(chunk)
+                    f.write(chunk)
+            path = self.object_path(digest.hexdigest())
+            if os.path.exists(path):
+                os.unlink(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        return digest.hexdigest()
+
+    def save_index(self):
+        with self.lock:
+            write_json(self.index_path, self.index)
+
+
+class PlanChecker:
+    """
+    Проверяет ссылки на планы параллельно и запоминает результат по адресу на время запуска
+    """
+    def __init__(self, workers: int, store: PlanStore = None):
+        """
+        :param workers: Число одновременных запросов, к одному хосту их не больше размера пула соединений
+        :param store: Хранилище планов, None - только проверять ссылки
+        """
+        self.workers = max(workers, 1)
+        self.store = store
+        self.results = {}
+
+    def check(self, url: str):
+        """
+        :param url: Адрес плана
+        :return: Кортеж (доступна ли ссылка или None, если срок работы истек, хэш плана или None)
+        """
+        try:
+            if self.store is not None:
+                return self.store.fetch(url)
+            return check_url(url), None
+        except DeadlineExceeded:
+            return None, None
+        except Exception:
+            return False, None
+
+    def check_all(self, urls):
+        """
+        Проверяет адреса, которые еще не проверялись
+        :param urls: Адреса планов
+        :return:
+        """
+        urls = [url for url in dict.fromkeys(urls) if url and url not in self.results]
+        if not urls:
+            return
+        start = time.perf_counter()
+        if self.workers == 1 or len(urls) == 1:
+            self.results.update((url, self.check(url)) for url in urls)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(urls))) as executor:
+                futures = [executor.submit(in_context(self.check), url) for url in urls]
+                self.results.update((url, future.result()) for url, future in zip(urls, futures))
+        METRICS.add(plans=time.perf_counter() - start)
+
+    def annotate(self, obj: dict):
+        alive, digest = self.results.get(obj.get('plan'), (None, None))
+        obj['plan_alive'] = alive
+        if self.store is not None:
+            obj['plan_hash'] = digest
+        return obj
+
+    def close(self):
+        if self.store is not None:
+            self.store.save_index()
+
+
+class PlanWriter:
+    """
+    Обертка над объектом вывода, добавляющая к записям результат проверки ссылок на планы.
+    Записи комплекса копятся до flush, затем их ссылки проверяются одним параллельным проходом
+    """
+    def __init__(self, writer, checker: PlanChecker):
+        self.writer = writer
+        self.checker = checker
+        self.pending = []
+
+    def write(self, obj: dict):
+        self.pending.append(obj)
+
+    def write_all(self, records):
+        for obj in records:
+            self.write(obj)
+
+    def fail(self, complex_name: str):
+        self.writer.fail(complex_name)
+
+    def process(self):
+        pending, self.pending = self.pending, []
+        self.checker.check_all(obj.get('plan') for obj in pending)
+        for obj in pending:
+            self.writer.write(self.checker.annotate(obj))
+
+    def flush(self):
+        self.process()
+        self.writer.flush()
+
+    def close(self):
+        self.process()
+        self.checker.close()
+        self.writer.close()
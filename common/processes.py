@@ -0,0 +1,145 @@
+"""
+Преобразование записей в пуле процессов, для очень больших ответов.
+Записи, прошедшие фильтр, собираются в пачки по BATCH_SIZE и преобразуются в процессах пула функциями модуля
+парсера: cast_fields и post_process. Матчинг из lambda не передается между процессами, поэтому каждый процесс
+один раз при запуске загружает модуль парсера сам, а по каналу идут только записи и результаты.
+Пачки отправляются по мере разбора ответа, не больше PENDING_PER_PROCESS на процесс от одного комплекса,
+результаты отдаются в исходном порядке записей.
+Разбор JSON и вывод остаются в основном процессе, поэтому выигрыш есть, когда преобразование заметно дороже
+передачи записи в процесс: на тяжелом матчинге и на нескольких свободных ядрах.
+"""
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from common.metrics import METRICS
+from common.parsers import load_parser
+
+BATCH_SIZE = 1000
+PENDING_PER_PROCESS = 2
+
+
+def init_worker(site: str, setup):
+    """
+    Загружает модуль парсера в процессе пула
+    :param site: Имя парсера из PARSERS
+    :param setup: Кортеж (имя функции модуля, аргументы), повторяющий настройку основного процесса, или None
+    :return:
+    """
+    module = load_parser(site)
+    if setup is not None:
+        name, args = setup
+        getattr(module, name)(*args)
+
+
+def transform_batch(site: str, records: list, args: tuple):
+    """
+    Преобразует пачку записей в процессе пула
+    :param site: Имя парсера
+    :param records: Записи API
+    :param args: Дополнительные аргументы post_process
+    :return: Кортеж (список записей в формате FIELDS, время cast, время post)
+    """
+    module = load_parser(site)
+    cast, post = module.cast_fields, module.post_process
+    clock = time.perf_counter
+    cast_time = post_time = 0.0
+    result = []
+    for record in records:
+        start = clock()
+        obj = cast(record)
+        middle = clock()
+        result.append(post(obj, record, *args))
+        cast_time += middle - start
+        post_time += clock() - middle
+    return result, cast_time, post_time
+
+
+class TransformPool:
+    """
+    Пул процессов парсера, общий для всех комплексов запуска
+    """
+    def __init__(self, site: str, processes: int, setup=None, batch_size: int = BATCH_SIZE):
+        """
+        :param site: Имя парсера из PARSERS
+        :param processes: Число процессов
+        :param setup: Кортеж (имя функции модуля, аргументы), вызывается в каждом процессе после загрузки модуля
+        :param batch_size: Записей в пачке
+        """
+        self.site = site
+        self.processes = processes
+        self.batch_size = batch_size
+        # spawn: основной процесс к этому времени многопоточный, fork в нем небезопасен
+        self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=init_worker, initargs=(site, setup))
+
+    def records(self, records, accept, args=(), host: str = None, complex_name: str = None, key=None):
+        """
+        То же, что METRICS.records с cast_fields и post_process парсера, но преобразование идет в пуле
+        :param records: Записи API
+        :param accept: Проверка записи фильтром или None, выполняется в основном процессе
+        :param args: Дополнительные аргументы post_process парсера, должны передаваться между процессами
+        :param host: Хост комплекса для метрик
+        :param complex_name: Название комплекса для метрик
+        :param key: Функция записи API: если задана, отдаются пары (key(запись), результат)
+        :return:
+        """
+        stats = None
+        if METRICS.enabled:
+            stats = METRICS.source(host)
+            stats.complex = complex_name or stats.complex
+        pending = deque()
+        records_in = filtered = 0
+        cast_time = post_time = 0.0
+
+        def results(future, batch):
+            nonlocal cast_time, post_time
+            objs, batch_cast, batch_post = future.result()
+            cast_time += batch_cast
+            post_time += batch_post
+            if key is None:
+                return objs
+            return zip(map(key, batch), objs)
+
+        try:
+            batch = []
+            for record in records:
+                records_in += 1
+                if accept is not None and not accept(record):
+                    filtered += 1
+                    continue
+                batch.append(record)
+                if len(batch) < self.batch_size:
+                    continue
+                pending.append((self.executor.submit(transform_batch, self.site, batch, args), batch))
+                batch = []
+                if len(pending) >= self.processes * PENDING_PER_PROCESS:
+                    yield from results(*pending.popleft())
+            if batch:
+                pending.append((self.executor.submit(transform_batch, self.site, batch, args), batch))
+            while pending:
+                yield from results(*pending.popleft())
+        finally:
+            # Ошибка ответа или прерванное чтение: оставшиеся пачки не нужны
+            for future, _ in pending:
+                future.cancel()
+            if stats is not None:
+                stats.add(cast=cast_time, post=post_time, records_in=records_in, filtered=filtered,
+                          records_out=records_in - filtered)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def open_pool(options, site: str, setup=None):
+    """
+    Пул процессов по аргументу --processes
+    :param options: Результат разбора аргументов
+    :param site: Имя парсера из PARSERS
+    :param setup: Настройка модуля в процессах пула, см. TransformPool
+    :return: TransformPool или None, если преобразование идет в основном процессе
+    """
+    if options.processes <= 1:
+        return None
+    return TransformPool(site, options.processes, setup)
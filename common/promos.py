@@ -0,0 +1,128 @@
+"""
+Разбор текстов акций: скидки, отделка в подарок и т.п.
+Правила задаются таблицей и могут дополняться из JSON-файла без правки кода. Регулярные выражения компилируются
+один раз, результат разбора каждого различного текста запоминается в ограниченном LRU-кэше:
+на сайтах повторяется несколько текстов акций на тысячи квартир.
+"""
+import dataclasses
+import functools
+import json
+import re
+
+from common.errors import MyException
+from common.fields import FIELDS
+
+TYPES = {'float': float, 'int': int, 'str': str}
+
+
+@dataclasses.dataclass(frozen=True)
+class PromoRule:
+    """
+    Правило акции. Срабатывает, если в тексте есть marker. Значение - совпадения pattern, склеенные в строку,
+    из которой удалена подстрока strip, и приведенные к type
+    """
+    name: str
+    marker: str
+    pattern: str = None
+    strip: str = None
+    type: str = 'str'
+    # Поле записи, в которое пишется значение
+    field: str = None
+    # Поля записи, которые получают постоянные значения
+    set: dict = dataclasses.field(default_factory=dict)
+    # Поле, в которое переносится цена: акционная цена перестает быть базовой
+    price: str = None
+
+
+def load_rules(path: str):
+    """
+    Читает правила из JSON-файла: список объектов с полями PromoRule.
+    Правила пишут только в поля FIELDS: новое поле изменило бы набор колонок вывода
+    :param path: Путь к файлу
+    :return: Список PromoRule
+    """
+    with open(path, encoding='utf-8') as f:
+        items = json.load(f)
+    rules = []
+    for item in items:
+        try:
+            rule = PromoRule(**item)
+        except TypeError as e:
+            raise MyException(f'Неверное правило акции в {path}: {item}', e) from None
+        if rule.type not in TYPES:
+            raise MyException(f'Неизвестный тип {rule.type!r} правила акции {rule.name!r}, '
+                              f'ожидается один из {", ".join(TYPES)}', path)
+        unknown = [name for name in (rule.field, rule.price, *rule.set) if name is not None and name not in FIELDS]
+        if unknown:
+            raise MyException(f'Правило акции {rule.name!r} пишет в поля не из FIELDS: {", ".join(unknown)}', path)
+        rules.append(rule)
+    return rules
+
+
+def move_price(obj: dict, target: str):
+    """
+    Переносит цену в поле target. Если до этого сработала скидка, переносится уже цена со скидкой
+    :param obj: Запись в формате FIELDS
+    :param target: Поле цены
+    :return:
+    """
+    obj[target] = obj['price_base']
+    obj['price_base'] = None
+    if target != 'price_sale' and obj.get('price_sale'):
+        obj[target] = obj['price_sale']
+        obj['price_sale'] = None
+
+
+class PromoParser:
+    """
+    Разбирает тексты акций по таблице правил и применяет результат к записям
+    """
+    def __init__(self, rules: list, maxsize: int = 1024):
+        """
+        :param rules: Список PromoRule, применяются по порядку
+        :param maxsize: Сколько различных текстов помнить
+        """
+        self.maxsize = maxsize
+        self.configure(rules)
+
+    def configure(self, rules: list):
+        """
+        Заменяет таблицу правил, запомненные результаты сбрасываются
+        :param rules: Список PromoRule
+        :return:
+        """
+        self.rules = [(rule, re.compile(rule.pattern) if rule.pattern else None) for rule in rules]
+        self.parse = functools.lru_cache(maxsize=self.maxsize)(self.parse_text)
+
+    def parse_text(self, text: str):
+        """
+        Разбирает текст без кэша
+        :param text: Текст акции
+        :return: Кортеж пар (правило, значение) сработавших правил
+        """
+        result = []
+        for rule, pattern in self.rules:
+            if rule.marker not in text:
+                continue
+            value = None
+            if pattern is not None:
+                value = ''.join(pattern.findall(text))
+                if rule.strip:
+                    value = value.replace(rule.strip, '')
+                value = TYPES[rule.type](value)
+            result.append((rule, value))
+        return tuple(result)
+
+    def apply(self, obj: dict, text: str):
+        """
+        Применяет сработавшие правила к записи
+        :param obj: Запись в формате FIELDS
+        :param text: Текст акции
+        :return:
+        """
+        for rule, value in self.parse(text):
+            if rule.field:
+                obj[rule.field] = value
+            obj.update(rule.set)
+            if rule.price:
+                move_price(obj, rule.price)
@@ -0,0 +1,216 @@
+"""
+Компактное колоночное хранение записей FIELDS.
+Числовые поля хранятся в типизированных массивах с отдельной маской пустых значений,
+поля с небольшим числом различных значений (комплекс, тип, статус, отделка) - кодами в словаре значений,
+остальные - обычными списками. Если значение не подходит под тип колонки, колонка становится списком,
+поэтому записи восстанавливаются без изменений.
+"""
+import json
+from array import array
+
+FLOAT_FIELDS = {'price', 'price_base', 'price_finished', 'price_sale', 'price_finished_sale', 'area', 'living_area',
+                'ceil', 'furniture_price', 'discount_percent', 'discount'}
+INT_FIELDS = {'building', 'section', 'floor'}
+DICT_FIELDS = {'complex', 'type', 'phase', 'rooms', 'in_sale', 'sale_status', 'finished', 'currency',
+               'finishing_name', 'furniture', 'feature', 'view', 'euro_planning', 'sale', 'change'}
+
+
+class ObjectColumn(list):
+    def slice(self, start: int, stop: int):
+        return self[start:stop]
+
+    @property
+    def nbytes(self):
+        return len(self) * 8
+
+
+class FloatColumn:
+    kind = float
+    typecode = 'd'
+
+    def __init__(self):
+        self.values = array(self.typecode)
+        self.nulls = bytearray()
+
+    def append(self, value):
+        if value is None:
+            self.values.append(0)
+            self.nulls.append(1)
+        elif type(value) is self.kind:
+            self.values.append(value)
+            self.nulls.append(0)
+        else:
+            raise TypeError(value)
+
+    def __getitem__(self, i):
+        return None if self.nulls[i] else self.values[i]
+
+    def slice(self, start: int, stop: int):
+        values = self.values[start:stop].tolist()
+        nulls = self.nulls[start:stop]
+        if 1 not in nulls:
+            return values
+        return [None if null else value for value, null in zip(values, nulls)]
+
+    def __len__(self):
+        return len(self.nulls)
+
+    @property
+    def nbytes(self):
+        return len(self.values) * self.values.itemsize + len(self.nulls)
+
+
+class IntColumn(FloatColumn):
+    kind = int
+    typecode = 'q'
+
+
+class DictColumn:
+    """
+    Колонка со словарем значений: в строке хранится только код значения
+    """
+    def __init__(self):
+        self.codes = array('B')
+        self.values = []
+        self.index = {}
+
+    def append(self, value):
+        # Тип входит в ключ, чтобы 1, 1.0 и True не смешивались
+        key = (type(value), value)
+        code = self.index.get(key)
+        if code is None:
+            code = self.index[key] = len(self.values)
+            self.values.append(value)
+            if code > 255 and self.codes.typecode == 'B':
+                self.codes = array('H', self.codes)
+            elif code > 65535 and self.codes.typecode == 'H':
+                self.codes = array('I', self.codes)
+        self.codes.append(code)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def slice(self, start: int, stop: int):
+        values = self.values
+        if len(values) == 1:
+            return values * (stop - start)
+        return [values[code] for code in self.codes[start:stop]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return len(self.codes) * self.codes.itemsize + len(self.values) * 8
+
+
+def make_column(field: str):
+    if field in FLOAT_FIELDS:
+        return FloatColumn()
+    if field in INT_FIELDS:
+        return IntColumn()
+    if field in DICT_FIELDS:
+        return DictColumn()
+    return ObjectColumn()
+
+
+class RecordBatch:
+    """
+    Набор записей с одинаковыми полями в одинаковом порядке, хранящийся по колонкам.
+    Порядок полей входит в проверку, чтобы записи восстанавливались теми же словарями, что были добавлены
+    """
+    def __init__(self, fields: list = None):
+        """
+        :param fields: Поля записей, по умолчанию берутся из первой добавленной записи
+        """
+        self.fields = None
+        self.columns = []
+        self.size = 0
+        if fields is not None:
+            self.set_fields(fields)
+
+    def set_fields(self, fields: list):
+        self.fields = list(fields)
+        self.columns = [make_column(field) for field in self.fields]
+
+    def append(self, obj: dict):
+        if self.fields is None:
+            self.set_fields(obj)
+        elif list(obj) != self.fields:
+            # Проверка до изменения колонок: запись с другими полями не должна оставить их разной длины
+            raise ValueError(f'Record fields differ from batch fields: {list(obj)}')
+        values = obj.values()
+        columns = self.columns
+        for i, value in enumerate(values):
+            try:
+                columns[i].append(value)
+            except (TypeError, OverflowError):
+                # Значение не подходит под тип колонки - переводим её в список
+                column = ObjectColumn(columns[i][j] for j in range(self.size))
+                column.append(value)
+                columns[i] = column
+        self.size += 1
+
+    def extend(self, records):
+        for obj in records:
+            self.append(obj)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i: int):
+        if not -self.size <= i < self.size:
+            raise IndexError(i)
+        i %= self.size
+        return dict(zip(self.fields, [column[i] for column in self.columns]))
+
+    def __iter__(self):
+        for block in self.blocks():
+            yield from block
+
+    def blocks(self, size: int = 1000):
+        """
+        Отдает записи списками по size штук, колонки разворачиваются срезами целиком
+        :param size: Число записей в блоке
+        :return:
+        """
+        fields = self.fields
+        for start in range(0, self.size, size):
+            stop = min(start + size, self.size)
+            rows = zip(*[column.slice(start, stop) for column in self.columns])
+            yield [dict(zip(fields, row)) for row in rows]
+
+    @property
+    def nbytes(self):
+        """
+        Приблизительный объем данных колонок без учета самих строк и объектов в словарях
+        :return:
+        """
+        return sum(column.nbytes for column in self.columns)
+
+    def write_json(self, stream, chunk_size: int = 1000):
+        """
+        Пишет записи JSON-массивом, результат совпадает с json.dumps(list(batch), ensure_ascii=False)
+        :param stream: Поток вывода
+        :param chunk_size: Сколько записей сериализовать за одну запись в поток
+        :return:
+        """
+        write_json([self], stream, chunk_size)
+
+
+def write_json(batches, stream, chunk_size: int = 1000):
+    """
+    Пишет записи нескольких RecordBatch подряд одним JSON-массивом
+    :param batches: Наборы записей
+    :param stream: Поток вывода
+    :param chunk_size: Сколько записей сериализовать за одну запись в поток
+    :return:
+    """
+    stream.write('[')
+    separator = ''
+    for batch in batches:
+        for block in batch.blocks(chunk_size):
+            # json.dumps списка - это элементы через ', ' в квадратных скобках
+            stream.write(separator + json.dumps(block, ensure_ascii=False)[1:-1])
+            separator = ', '
+    stream.write(']')
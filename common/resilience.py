@@ -0,0 +1,110 @@
+"""
+Повторы запросов и учет времени ответа хостов.
+Повторяются только временные ошибки: сетевые сбои, таймауты и ответы 429/5xx шлюзов.
+По времени ответа хоста выбирается момент отправки дублирующего запроса (hedging).
+"""
+import collections
+import http.client
+import random
+import ssl
+import threading
+
+RETRIES = 2
+BACKOFF = 0.5
+MAX_BACKOFF = 10.0
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+TRANSIENT_ERRORS = (OSError, http.client.HTTPException)
+# Ошибки проверки сертификата - подкласс OSError, но повтор их не исправит
+PERMANENT_ERRORS = (ssl.SSLCertVerificationError,)
+
+
+def is_transient(error: BaseException):
+    return isinstance(error, TRANSIENT_ERRORS) and not isinstance(error, PERMANENT_ERRORS)
+
+
+class RetryPolicy:
+    """
+    Ограниченное число повторов с экспоненциальной задержкой и случайным разбросом (full jitter)
+    """
+    def __init__(self, retries: int = RETRIES, backoff: float = BACKOFF, max_backoff: float = MAX_BACKOFF):
+        """
+        :param retries: Сколько раз повторять запрос после первой попытки
+        :param backoff: Базовая задержка, секунды
+        :param max_backoff: Наибольшая задержка, секунды
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delay(self, attempt: int, retry_after: str = None):
+        """
+        Задержка перед повтором
+        :param attempt: Номер неудавшейся попытки, с 0
+        :param retry_after: Значение заголовка Retry-After, если сервер его прислал
+        :return: Секунды
+        """
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.backoff * 2 ** attempt, self.max_backoff))
+
+
+class LatencyTracker:
+    """
+    Время до получения заголовков ответа по хостам, последние window значений.
+    Пока у хоста мало значений, используются значения всех хостов: комплексы обычно запрашиваются по одному разу.
+    Первые запросы запуска уходят одновременно, поэтому значения прошлых запусков подставляются через seed
+    """
+    def __init__(self, window: int = 200, min_samples: int = 5):
+        """
+        :param window: Сколько последних значений хранить на хост
+        :param min_samples: Сколько значений нужно, чтобы считать перцентиль
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, host: str, seconds: float):
+        with self.lock:
+            for key in (host, None):
+                samples = self.samples.get(key)
+                if samples is None:
+                    samples = self.samples[key] = collections.deque(maxlen=self.window)
+                samples.append(seconds)
+
+    def seed(self, host: str, samples):
+        """
+        Добавляет значения, сохраненные прошлыми запусками, если у хоста своих еще нет
+        :param host: Хост
+        :param samples: Секунды
+        :return:
+        """
+        with self.lock:
+            if self.samples.get(host):
+                return
+        for seconds in samples:
+            self.record(host, seconds)
+
+    def recent(self, host: str, count: int):
+        """
+        :param host: Хост
+        :param count: Сколько значений вернуть
+        :return: Список последних значений хоста, секунды
+        """
+        with self.lock:
+            return list(self.samples.get(host, ()))[-count:]
+
+    def percentile(self, host: str, percentile: float):
+        """
+        :param host: Хост
+        :param percentile: Перцентиль от 0 до 100
+        :return: Секунды или None, если значений пока мало
+        """
+        with self.lock:
+            samples = self.samples.get(host, ())
+            if len(samples) < self.min_samples:
+                samples = self.samples.get(None, ())
+            samples = sorted(samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
@@ -0,0 +1,10 @@
+"""
+Демон парсеров: загружает парсеры один раз и выполняет запуски по HTTP-запросам, подробнее в common/daemon.py.
+
+    python scraperd.py --port 8765
+    curl http://127.0.0.1:8765/run/nk
+"""
+from common.daemon import main
+
+if __name__ == '__main__':
+    main()
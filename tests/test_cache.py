@@ -0,0 +1,99 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from bench import standin
+from common import cli, client
+from common.cache import CacheMiss, ResponseCache
+from common.parsers import load_parser
+
+
+class EtagStandIn(standin.StandIn):
+    """
+    Стенд, отдающий ответы API с ETag: пока version не меняется, на If-None-Match отвечает 304
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 1
+        self.api_requests = 0
+
+    def respond(self, method, host, path, accept_gzip, form=''):
+        status, headers, body = super().respond(method, host, path, accept_gzip, form)
+        if headers['Content-Type'] == 'application/json':
+            headers['ETag'] = f'"v{self.version}"'
+            with self.lock:
+                self.api_requests += 1
+        return status, headers, body
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.site = EtagStandIn(complexes=3, records=20)
+        self.server = standin.start(self.site)
+        self.cache = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        client.CLIENT.configure()
+        client.CLIENT.cache = None
+
+    def run_parser(self, name, *args):
+        options = cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, '--retries', '0', *args])
+        stream = io.StringIO()
+        failed = load_parser(name).main(options=options, stream=stream)
+        self.assertFalse(failed)
+        return json.loads(stream.getvalue())
+
+    def entry(self):
+        return client.CLIENT.cache.entry('nk.ilike.ru', 'GET', '/api/flatmodels/getAllFlatData', '')
+
+    def test_revalidation(self):
+        for name in ('nk', 'loftfm'):
+            with self.subTest(parser=name):
+                first = self.run_parser(name, '--http-cache')
+                self.assertTrue(first)
+                # ETag не изменился: сервер отвечает 304, записи берутся из кэша, хотя данные стенда другие
+                self.site.records = 10
+                self.assertEqual(self.run_parser(name, '--http-cache'), first)
+                self.site.version += 1
+                changed = self.run_parser(name, '--http-cache')
+                self.assertNotEqual(changed, first)
+                # Без кэша - текущие данные стенда
+                self.assertEqual(self.run_parser(name), changed)
+                self.site.records = 20
+
+    def test_replay(self):
+        expected = {name: self.run_parser(name, '--http-cache') for name in ('nk', 'nt', 'loftfm')}
+        requests = self.site.api_requests
+        self.server.shutdown()
+        for name, records in expected.items():
+            with self.subTest(parser=name):
+                self.assertEqual(self.run_parser(name, '--replay'), records)
+        self.assertEqual(self.site.api_requests, requests)
+
+    def test_replay_miss(self):
+        client.CLIENT.cache = ResponseCache(self.cache.name, replay=True)
+        with self.assertRaises(CacheMiss):
+            list(client.CLIENT.fetch('ilike.ru', '/#complexes'))
+
+    def test_incomplete_response_not_stored(self):
+        cli.configure(cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, '--http-cache']))
+        chunks = client.CLIENT.fetch('https://nk.ilike.ru/', '/api/flatmodels/getAllFlatData')
+        next(chunks)
+        chunks.close()
+        self.assertFalse(self.entry().exists())
+        self.assertEqual([name for _, _, names in os.walk(self.cache.name) for name in names
+                          if name.startswith('.tmp-')], [])
+        body = b''.join(client.CLIENT.fetch('https://nk.ilike.ru/', '/api/flatmodels/getAllFlatData'))
+        self.assertEqual(b''.join(self.entry().load()), body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+import argparse
+import collections
+import http.server
+import io
+import json
+import tempfile
+import threading
+import time
+import unittest
+
+from bench import standin
+from common import cli, client, history
+from common.errors import ComplexSkipped, DeadlineExceeded
+from common.parsers import load_parser
+
+
+def run_options(*args):
+    return cli.add_arguments(argparse.ArgumentParser()).parse_args(list(args))
+
+
+class StandInTestCase(unittest.TestCase):
+    records = 50
+
+    def setUp(self):
+        self.site = standin.StandIn(complexes=3, records=self.records)
+        self.server = standin.start(self.site)
+        self.url = self.server.url
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        client.CLIENT.configure()
+        client.CLIENT.latencies = client.LatencyTracker()
+
+
+class DeadlineTest(StandInTestCase):
+    def test_concurrent_runs_keep_own_deadline(self):
+        """
+        Как два одновременных запуска демона: срок одного не действует на другой
+        """
+        self.site.latency = 0.3
+        results = {}
+        started = threading.Barrier(2)
+
+        def run(name, *args):
+            deadline = cli.configure(run_options('--target', self.url, '--retries', '0', *args))
+            started.wait()
+            try:
+                results[name] = len(list(client.fetch_json('https://nk.ilike.ru/', '/api/flatmodels/getAllFlatData')))
+            except DeadlineExceeded as e:
+                results[name] = e
+            results[f'{name}_deadline'] = deadline
+
+        threads = [threading.Thread(target=run, args=('short', '--deadline', '0.1')),
+                   threading.Thread(target=run, args=('long',))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIsInstance(results['short'], DeadlineExceeded)
+        self.assertEqual(results['long'], self.records)
+        self.assertIsNone(results['long_deadline'])
+
+    def test_deadline_reaches_worker_threads(self):
+        from common.concurrency import iter_ordered
+        self.site.latency = 0.5
+        deadline = cli.configure(run_options('--target', self.url, '--retries', '0', '--deadline', '0.2'))
+        start = time.monotonic()
+        tasks = [('nk', f'https://c{i}.ilike.ru/') for i in range(3)]
+
+        def fetch(name, url):
+            return client.fetch_json(url, '/api/flatmodels/getAllFlatData')
+
+        errors = [e for _, _, e in iter_ordered(fetch, tasks, workers=3, handled=(DeadlineExceeded,),
+                                                deadline=deadline)]
+        self.assertTrue(all(isinstance(e, DeadlineExceeded) for e in errors))
+        self.assertLess(time.monotonic() - start, 0.45)
+
+
+class ClosingHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Сервер, закрывающий соединение после каждого ответа: HTTP/1.0 или HTTP/1.1 с Connection: close
+    """
+    def do_GET(self):
+        body = b'[{"id": 1}, {"id": 2}]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if self.protocol_version != 'HTTP/1.0':
+            self.send_header('Connection', 'close')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ClosingConnectionTest(unittest.TestCase):
+    def tearDown(self):
+        client.CLIENT.configure()
+
+    def test_deadline_with_connection_close(self):
+        for protocol in ('HTTP/1.0', 'HTTP/1.1'):
+            handler = type('Handler', (ClosingHandler,), {'protocol_version': protocol})
+            server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                url = f'http://127.0.0.1:{server.server_address[1]}'
+                for args in ((), ('--deadline', '30')):
+                    cli.configure(run_options('--target', url, '--retries', '0', *args))
+                    with self.subTest(protocol=protocol, args=args):
+                        for _ in range(2):
+                            self.assertEqual(list(client.fetch_json('https://nk.ilike.ru/', '/api/')),
+                                             [{'id': 1}, {'id': 2}])
+                        self.assertEqual(client.get_html('https://ilike.ru/', '/', 'GET', ''), '[{"id": 1}, {"id": 2}]')
+            finally:
+                server.shutdown()
+                server.server_close()
+
+
+class StallingStandIn(standin.StandIn):
+    """
+    Стенд, у которого первый запрос API одного хоста зависает
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stalled_host = None
+        self.stall_seconds = 0
+        self.api_requests = collections.Counter()
+
+    def respond(self, method, host, path, accept_gzip, form=''):
+        if path.startswith('/api/'):
+            with self.lock:
+                self.api_requests[host] += 1
+                stall = host == self.stalled_host and self.api_requests[host] == 1
+            if stall:
+                time.sleep(self.stall_seconds)
+        return super().respond(method, host, path, accept_gzip, form)
+
+
+class HedgeTest(StandInTestCase):
+    def setUp(self):
+        self.site = StallingStandIn(complexes=4, records=self.records)
+        self.server = standin.start(self.site)
+        self.url = self.server.url
+        self.cache = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.cache.cleanup()
+
+    def run_nk(self):
+        options = run_options('--target', self.url, '--cache-dir', self.cache.name, '--discovery-ttl', '0',
+                              '--hedge', '90')
+        start = time.monotonic()
+        failed = load_parser('nk').main(options=options, stream=io.StringIO())
+        return failed, time.monotonic() - start
+
+    def test_hedged_request_fires_in_single_run(self):
+        # Прошлый запуск: времена ответа хостов комплексов сохраняются в состоянии комплексов
+        failed, _ = self.run_nk()
+        self.assertEqual(failed, {})
+        # Новый процесс: в памяти времен ответа нет, все комплексы запрашиваются одновременно
+        client.CLIENT.latencies = client.LatencyTracker()
+        self.site.api_requests.clear()
+        self.site.stalled_host, self.site.stall_seconds = 'oblaka.ilike.ru', 3
+        failed, wall = self.run_nk()
+        self.assertEqual(failed, {})
+        # Зависший запрос продублирован, запуск не ждал его
+        self.assertEqual(self.site.api_requests['oblaka.ilike.ru'], 2)
+        self.assertLess(wall, 2)
+
+
+class BrokenStandIn(standin.StandIn):
+    """
+    Стенд, у которого API одного хоста (комплекса или loftfm) отдает страницу HTML вместо JSON
+    """
+    broken_host = 'oblaka.ilike.ru'
+
+    def respond(self, method, host, path, accept_gzip, form=''):
+        if host == self.broken_host and path.startswith(('/api/', '/getflatdatasearch')):
+            return 200, {'Content-Type': 'text/html; charset=utf-8'}, b'<html><div id="app"></div></html>'
+        return super().respond(method, host, path, accept_gzip, form)
+
+
+class HealthTest(StandInTestCase):
+    def setUp(self):
+        self.site = BrokenStandIn(complexes=3, records=self.records)
+        self.server = standin.start(self.site)
+        self.url = self.server.url
+        self.cache = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.cache.cleanup()
+
+    def run_nk(self, *args):
+        options = run_options('--target', self.url, '--cache-dir', self.cache.name, '--retries', '0', *args)
+        with self.assertLogs('ilike', 'WARNING') as logs:
+            failed = load_parser('nk').main(options=options, stream=io.StringIO())
+        return failed, logs.output
+
+    def test_skipped_complex_reported_as_failed(self):
+        for _ in range(2):
+            failed, _ = self.run_nk()
+            self.assertEqual(len(failed), 1)
+            self.assertNotIsInstance(list(failed.values())[0], ComplexSkipped)
+        name = list(failed)[0]
+        failed, logs = self.run_nk()
+        self.assertEqual(list(failed), [name])
+        self.assertIsInstance(failed[name], ComplexSkipped)
+        self.assertTrue(any('Пропущены комплексы' in line and name in line for line in logs))
+        # С --recheck-broken комплекс снова запрашивается
+        failed, _ = self.run_nk('--recheck-broken')
+        self.assertNotIsInstance(failed[name], ComplexSkipped)
+
+
+class LoftfmFailureTest(StandInTestCase):
+    def setUp(self):
+        self.site = BrokenStandIn(complexes=3, records=self.records)
+        self.site.broken_host = None
+        self.server = standin.start(self.site)
+        self.url = self.server.url
+        self.cache = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.cache.cleanup()
+
+    def run_loftfm(self, *args):
+        options = run_options('--target', self.url, '--cache-dir', self.cache.name, '--retries', '0', '--diff',
+                              '--history', *args)
+        stream = io.StringIO()
+        failed = load_parser('loftfm').main(options=options, stream=stream, shard_rooms=True)
+        return failed, [obj['change'] for obj in json.loads(stream.getvalue())]
+
+    def history_removals(self):
+        conn = history.connect(history.default_path(self.cache.name))
+        try:
+            return conn.execute('SELECT COUNT(*) FROM history WHERE removed').fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_failed_shards_do_not_remove_records(self):
+        failed, changes = self.run_loftfm()
+        self.assertFalse(failed)
+        self.assertEqual(set(changes), {'added'})
+        # Истекший срок: записи не считаются удаленными
+        self.site.latency = 0.3
+        with self.assertLogs('loftfm', 'WARNING'):
+            failed, changes = self.run_loftfm('--deadline', '0.1')
+        self.assertTrue(failed)
+        self.assertTrue(all(isinstance(e, DeadlineExceeded) for e in failed.values()))
+        self.assertEqual(changes, [])
+        # Ошибка API части поиска не прерывает запуск
+        self.site.latency, self.site.broken_host = 0, 'loftfm.mrloft.ru'
+        with self.assertLogs('loftfm', 'ERROR'):
+            failed, changes = self.run_loftfm()
+        self.assertTrue(failed)
+        self.assertEqual(changes, [])
+        self.site.broken_host = None
+        self.assertEqual(self.run_loftfm(), ({}, []))
+        self.assertEqual(self.history_removals(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
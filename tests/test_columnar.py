@@ -0,0 +1,87 @@
+import contextlib
+import io
+import json
+import unittest
+from unittest import mock
+
+from common import columnar
+from common.columnar import COMPRESSIONS, ColumnarWriter, iter_blocks, iter_records
+
+RECORDS = [
+    {'complex': 'A', 'price': 1.5, 'floor': 2, 'rooms': 1, 'plan': 'x', 'feature': ['a'], 'extra': {'k': 1}},
+    {'complex': 'A', 'price': None, 'floor': None, 'rooms': 'studio', 'plan': None, 'feature': None,
+     'extra': None},
+    {'complex': 'B', 'price': 3.0, 'floor': 7, 'rooms': 2, 'plan': 'Квартира', 'feature': [], 'extra': {}},
+]
+# Удаленная запись в режиме --diff: только поля идентификации
+REMOVED = {'complex': 'A', 'article': 'x1', 'building': '1', 'section': '1', 'number': 5, 'removed': True}
+# Другой набор из того же числа полей
+RENAMED = {'complex': 'C', 'price_base': 2.0, 'floor': 1, 'rooms': 3, 'plan': 'y', 'feature': [], 'other': 1}
+
+
+def encode(records, compression='gzip', flush_every=None):
+    stream = io.BytesIO()
+    writer = ColumnarWriter(stream, compression)
+    for i, obj in enumerate(records, 1):
+        writer.write(obj)
+        if flush_every and not i % flush_every:
+            writer.flush()
+    writer.close()
+    return stream.getvalue()
+
+
+class ColumnarTest(unittest.TestCase):
+    def test_round_trip(self):
+        records = RECORDS * 50 + [REMOVED] + RECORDS + [RENAMED, RENAMED] + RECORDS[:1]
+        for compression in COMPRESSIONS:
+            for flush_every in (None, 1, 7):
+                with self.subTest(compression=compression, flush_every=flush_every):
+                    data = encode(records, compression, flush_every)
+                    self.assertEqual(list(iter_records(io.BytesIO(data))), records)
+
+    def test_nulls_and_types(self):
+        records = [{'int': i, 'float': i / 2, 'nullable': None if i % 3 else i, 'empty': None,
+                    'mixed': 'text' if i == 5 else i, 'big': 2 ** 70 if i == 3 else i} for i in range(10)]
+        decoded = list(iter_records(io.BytesIO(encode(records))))
+        self.assertEqual(decoded, records)
+        self.assertEqual([type(obj['float']) for obj in decoded], [float] * 10)
+        self.assertEqual([type(obj['int']) for obj in decoded], [int] * 10)
+
+    def test_blocks(self):
+        with mock.patch.object(columnar, 'BLOCK_SIZE', 4):
+            data = encode(RECORDS * 3 + [REMOVED])
+        self.assertEqual([len(block) for block in iter_blocks(io.BytesIO(data))], [4, 4, 1, 1])
+
+    def test_stream_stays_open(self):
+        data = encode(RECORDS, 'none') + b'tail'
+        for compression in COMPRESSIONS:
+            stream = io.BytesIO(encode(RECORDS, compression))
+            with self.subTest(compression=compression):
+                self.assertEqual(list(iter_records(stream)), RECORDS)
+                self.assertFalse(stream.closed)
+                stream.seek(0)
+                self.assertEqual(list(iter_records(stream)), RECORDS)
+        # Несжатый поток читается ровно до конца данных
+        stream = io.BytesIO(data)
+        self.assertEqual(list(iter_records(stream)), RECORDS)
+        self.assertEqual(stream.read(), b'tail')
+
+    def test_errors(self):
+        for data in (b'', b'not columnar', encode(RECORDS, 'none')[:-10]):
+            with self.subTest(data=data):
+                with self.assertRaises(ValueError):
+                    list(iter_records(io.BytesIO(data)))
+
+    def test_cli_matches_json(self):
+        data = encode(RECORDS + [REMOVED], 'gzip', flush_every=2)
+        for argv, load in (([], json.loads), (['--ndjson'], lambda text: [json.loads(line)
+                                                                          for line in text.splitlines()])):
+            stdin, stdout = mock.Mock(buffer=io.BytesIO(data)), io.StringIO()
+            with mock.patch('sys.stdin', stdin), contextlib.redirect_stdout(stdout):
+                columnar.main(argv)
+            with self.subTest(argv=argv):
+                self.assertEqual(load(stdout.getvalue()), RECORDS + [REMOVED])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import argparse
+import http.client
+import io
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from bench import standin
+from common import cli, client, daemon
+from common.parsers import load_parser
+
+
+class GatedStandIn(standin.StandIn):
+    """
+    Стенд, задерживающий ответы API, пока не открыт gate: запуск остается идущим, сколько нужно тесту
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def respond(self, method, host, path, accept_gzip, form=''):
+        if host != 'ilike.ru':
+            self.gate.wait(10)
+        return super().respond(method, host, path, accept_gzip, form)
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.site = GatedStandIn(complexes=3, records=20)
+        self.server = standin.start(self.site)
+        self.cache = tempfile.TemporaryDirectory()
+        self.options = cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name])
+        self.scheduler = daemon.Scheduler(self.options)
+        self.daemon = daemon.serve(self.scheduler, port=0)
+        threading.Thread(target=self.daemon.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.site.gate.set()
+        self.daemon.shutdown()
+        self.daemon.server_close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        client.CLIENT.configure()
+        client.CLIENT.cache = None
+
+    def get(self, path):
+        conn = http.client.HTTPConnection(*self.daemon.server_address[:2], timeout=10)
+        try:
+            conn.request('GET', path)
+            res = conn.getresponse()
+            return res.status, res.read().decode('utf-8')
+        finally:
+            conn.close()
+
+    def direct(self, name, *args):
+        options = cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, *args])
+        stream = io.StringIO()
+        load_parser(name).main(options=options, stream=stream)
+        return stream.getvalue()
+
+    def test_run_matches_script(self):
+        for name in ('nk', 'nt', 'loftfm'):
+            with self.subTest(parser=name):
+                status, body = self.get(f'/run/{name}')
+                self.assertEqual(status, 200)
+                self.assertEqual(json.loads(body), json.loads(self.direct(name)))
+                self.assertEqual(self.get(f'/latest/{name}'), (200, body))
+        status, body = self.get('/run/nk?format=ndjson')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.direct('nk', '--format', 'ndjson'))
+
+    def test_run_all(self):
+        status, body = self.get('/run/all')
+        self.assertEqual(status, 200)
+        lines = body.splitlines()
+        self.assertEqual(len(lines), len(self.scheduler.sites))
+        for name, line in zip(self.scheduler.sites, lines):
+            self.assertEqual(json.loads(line), json.loads(self.direct(name)))
+
+    def test_merged_runs(self):
+        self.site.gate.clear()
+        first = self.scheduler.submit('nk')
+        self.assertIs(self.scheduler.submit('nk'), first)
+        self.assertIsNot(self.scheduler.submit('nk', 'ndjson'), first)
+        self.assertEqual(sorted((run['site'], run['format']) for run in self.scheduler.status()),
+                         [('nk', 'json'), ('nk', 'ndjson')])
+        # Подписчик, подключившийся к идущему запуску, получает вывод с начала
+        results = []
+        readers = [threading.Thread(target=lambda: results.append(self.get('/run/nk'))) for _ in range(2)]
+        for reader in readers:
+            reader.start()
+        self.site.gate.set()
+        for reader in readers:
+            reader.join(10)
+        body = ''.join(first)
+        self.assertEqual(json.loads(body), json.loads(self.direct('nk')))
+        self.assertEqual(results, [(200, body)] * 2)
+        # Следующий запрос после завершения начинает новый запуск
+        self.assertIsNot(self.scheduler.submit('nk'), first)
+
+    def test_client_configured_once(self):
+        # Запуски не перенастраивают клиент, разделяемый с другими идущими запусками
+        self.assertEqual(client.CLIENT.pool.target, self.server.url)
+        with mock.patch.object(client.CLIENT, 'configure', wraps=client.CLIENT.configure) as configure:
+            status, body = self.get('/run/all')
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body.splitlines()), len(self.scheduler.sites))
+        configure.assert_not_called()
+        self.assertFalse(self.options.client_configured)
+
+    def test_errors(self):
+        self.assertEqual(self.get('/latest/nk')[0], 404)
+        self.assertEqual(self.get('/run/unknown')[0], 404)
+        self.assertEqual(self.get('/run/nk?format=xml')[0], 400)
+        self.assertEqual(self.get('/run/all?format=columnar')[0], 400)
+        self.assertEqual(self.get('/other')[0], 404)
+        self.assertEqual(self.get('/status'), (200, '[]'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from bench import standin
+from common import cli, client
+from common.diff import DiffWriter, SnapshotIndex, record_key
+from common.fields import FIELDS
+from common.parsers import load_parser
+
+
+def flat(number, price, complex_name='A', article=None):
+    obj = dict.fromkeys(FIELDS)
+    obj.update(complex=complex_name, building='1', section='2', number=number, article=article, price=price)
+    return obj
+
+
+class ListWriter:
+    def __init__(self):
+        self.records = []
+        self.failed = []
+        self.closed = False
+
+    def write(self, obj):
+        self.records.append(obj)
+
+    def fail(self, complex_name):
+        self.failed.append(complex_name)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class DiffWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'site.pickle')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_diff(self, records, failed=()):
+        output = ListWriter()
+        writer = DiffWriter(output, SnapshotIndex(self.path))
+        for complex_name in failed:
+            writer.fail(complex_name)
+        writer.write_all(records)
+        writer.close()
+        self.assertTrue(output.closed)
+        self.assertEqual(output.failed, list(failed))
+        return [(obj['change'], obj['complex'], obj['number'], obj['price']) for obj in output.records]
+
+    def test_changes(self):
+        records = [flat(1, 100), flat(2, 200), flat(3, 300, 'B')]
+        self.assertEqual(self.run_diff(records), [('added', 'A', 1, 100), ('added', 'A', 2, 200),
+                                                  ('added', 'B', 3, 300)])
+        self.assertEqual(self.run_diff(records), [])
+        self.assertEqual(self.run_diff([flat(1, 100), flat(2, 250), flat(4, 400, 'B')]),
+                         [('changed', 'A', 2, 250), ('added', 'B', 4, 400), ('removed', 'B', 3, None)])
+        self.assertEqual(self.run_diff([flat(1, 100), flat(2, 250), flat(4, 400, 'B')]), [])
+
+    def test_removed_record(self):
+        self.run_diff([flat(1, 100, article='x1')])
+        output = ListWriter()
+        writer = DiffWriter(output, SnapshotIndex(self.path))
+        writer.close()
+        removed, = output.records
+        self.assertEqual(list(removed), FIELDS + ['change'])
+        self.assertEqual({key: value for key, value in removed.items() if value is not None},
+                         {'complex': 'A', 'building': '1', 'section': '2', 'number': 1, 'article': 'x1',
+                          'change': 'removed'})
+
+    def test_failed_complex_kept(self):
+        self.run_diff([flat(1, 100), flat(2, 200, 'B')])
+        # Комплекс B не получен: его записи не удалены и остаются в снимке
+        self.assertEqual(self.run_diff([flat(1, 100)], failed=['B']), [])
+        self.assertEqual(self.run_diff([flat(1, 100), flat(2, 200, 'B')]), [])
+
+    def test_index_saved_on_close(self):
+        self.run_diff([flat(1, 100)])
+        writer = DiffWriter(ListWriter(), SnapshotIndex(self.path))
+        writer.write(flat(1, 150))
+        # Запуск прервался до close: снимок прежний
+        self.assertEqual(self.run_diff([flat(1, 100)]), [])
+
+    def test_record_key(self):
+        self.assertEqual(record_key(flat(5, 1, article='x5')), 'A|x5')
+        self.assertEqual(record_key(flat(5, 1)), 'A|1|2|5')
+
+
+class ParserDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.site = standin.StandIn(complexes=3, records=20)
+        self.server = standin.start(self.site)
+        self.cache = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        client.CLIENT.configure()
+
+    def run_parser(self, name, *args):
+        options = cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, *args])
+        stream = io.StringIO()
+        load_parser(name).main(options=options, stream=stream)
+        return json.loads(stream.getvalue())
+
+    def test_runs(self):
+        for name in ('nk', 'nt', 'loftfm'):
+            with self.subTest(parser=name):
+                full = self.run_parser(name)
+                first = self.run_parser(name, '--diff')
+                self.assertEqual([{k: v for k, v in obj.items() if k != 'change'} for obj in first], full)
+                self.assertEqual({obj['change'] for obj in first}, {'added'})
+                self.assertEqual(self.run_parser(name, '--diff'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
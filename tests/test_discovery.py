@@ -0,0 +1,144 @@
+import argparse
+import os
+import tempfile
+import time
+import unittest
+
+from bench import standin
+from common import cli, client
+from common.discovery import get_subdomains, scan_complexes
+from common.files import read_json, write_json
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+PAGE = '''<html><head><title>ilike</title></head><body>
+<ul class="menu"><li class="item"><a href="/about">О нас</a></li></ul>
+<section id="complexes"><ul class="complexes">
+<li class="complexes__item"><a href="https://nk.ilike.ru/"><figure><img src="/nk.jpg">
+  <figcaption><h3>Новокрасково</h3><p> МО </p></figcaption></figure></a></li>
+<li class="complexes__item card" data-id="2"><a class="link" href="https://nt.ilike.ru/"><figure><img src="/nt.jpg"/>
+  <figcaption><h3>Наха<span>бино</span> &amp; Ко</h3><p>
+    Московская область </p><p>Второй абзац</p></figcaption></figure></a>
+  <ul><li class="tag">Новый</li></ul></li>
+<li class="complexes__item"><a href="https://empty.ilike.ru/"><figure><figcaption><h3>Без региона</h3>
+  </figcaption></figure></a></li>
+<li class="complexes__item"><a href="https://oblaka.ilike.ru/"><figure><figcaption><h3>Облака</h3><p>Москва</p>
+  </figcaption></figure></a></li>
+</ul></section></body></html>'''
+
+PAGE_LINKS = {
+    'Новокрасково (МО)': 'https://nk.ilike.ru/',
+    'Нахабино & Ко (Московская область)': 'https://nt.ilike.ru/',
+    'Облака (Москва)': 'https://oblaka.ilike.ru/',
+}
+
+
+def baseline(html: str):
+    """
+    Разбор страницы прежним кодом get_subdomains (BeautifulSoup), комплексы без полного описания пропускаются
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    links = {}
+    for item in soup.find_all('li', {'class': 'complexes__item'}):
+        caption = item.a.figure.figcaption
+        if caption.h3 is not None and caption.p is not None:
+            links[f'{caption.h3.text} ({str(caption.p.text).strip()})'] = item.a.attrs['href']
+    return links
+
+
+def split(body: bytes, size: int):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class ScanComplexesTest(unittest.TestCase):
+    def test_chunks(self):
+        body = PAGE.encode('utf-8')
+        # Части любого размера, в том числе разрезающие символы UTF-8 и теги
+        for size in (1, 2, 3, 7, 64, len(body)):
+            with self.subTest(size=size):
+                self.assertEqual(scan_complexes(split(body, size)), PAGE_LINKS)
+
+    @unittest.skipIf(BeautifulSoup is None, 'beautifulsoup4 is not installed')
+    def test_matches_beautifulsoup(self):
+        self.assertEqual(baseline(PAGE), PAGE_LINKS)
+
+    def test_standin_landing(self):
+        body = standin.StandIn(complexes=30).landing()
+        links = scan_complexes(split(body, 100))
+        self.assertEqual(len(links), 30)
+        if BeautifulSoup is not None:
+            self.assertEqual(links, baseline(body.decode('utf-8')))
+
+
+class CountingStandIn(standin.StandIn):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.landing_requests = 0
+
+    def respond(self, method, host, path, accept_gzip, form=''):
+        if host == 'ilike.ru':
+            with self.lock:
+                self.landing_requests += 1
+        return super().respond(method, host, path, accept_gzip, form)
+
+
+class DiscoveryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.site = CountingStandIn(complexes=5)
+        self.server = standin.start(self.site)
+        self.cache = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.cache.name, 'discovery', 'ilike.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        client.CLIENT.configure()
+        client.CLIENT.cache = None
+
+    def configure(self, *args):
+        cli.configure(cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, *args]))
+
+    def test_cached_within_ttl(self):
+        self.configure()
+        first = get_subdomains(ttl=60, cache_dir=self.cache.name)
+        self.assertEqual(len(first), 5)
+        self.assertEqual(get_subdomains(ttl=60, cache_dir=self.cache.name), first)
+        self.assertEqual(self.site.landing_requests, 1)
+        get_subdomains(ttl=60, refresh=True, cache_dir=self.cache.name)
+        self.assertEqual(self.site.landing_requests, 2)
+        # Устаревший кэш запрашивается заново
+        cached = read_json(self.path)
+        write_json(self.path, dict(cached, fetched=time.time() - 120))
+        get_subdomains(ttl=60, cache_dir=self.cache.name)
+        self.assertEqual(self.site.landing_requests, 3)
+
+    def test_ttl_zero_disables_cache(self):
+        self.configure()
+        for _ in range(2):
+            self.assertEqual(len(get_subdomains(ttl=0, cache_dir=self.cache.name)), 5)
+        self.assertEqual(self.site.landing_requests, 2)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_empty_result_not_cached(self):
+        self.configure()
+        self.site.complexes = 0
+        self.assertEqual(get_subdomains(ttl=60, cache_dir=self.cache.name), {})
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_replay_uses_stale_cache(self):
+        self.configure()
+        links = get_subdomains(ttl=60, cache_dir=self.cache.name)
+        cached = read_json(self.path)
+        write_json(self.path, dict(cached, fetched=0))
+        self.configure('--replay')
+        self.assertEqual(get_subdomains(ttl=60, cache_dir=self.cache.name), links)
+        self.assertEqual(self.site.landing_requests, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import random
+import unittest
+
+from bench import payloads
+from common.fields import FIELDS, cast_fields, compile_fields
+from common.parsers import PARSERS, load_parser
+
+SCALE = 10
+
+
+def scale(x):
+    return x * SCALE if x else None
+
+
+def make_closure(factor):
+    return lambda x: x * factor if x else None
+
+
+# Матчинг с тем, что встраивается в функцию, и тем, что остается вызовом
+MATCHING = {
+    'price': {
+        'name': 'price',
+        'calc': lambda x: float(x) * SCALE if x else None
+    },
+    'price_base': {
+        'name': 'price',
+        'calc': scale
+    },
+    'area': {
+        'name': 'space',
+        'calc': make_closure(2)
+    },
+    'rooms': {
+        'name': 'rooms',
+    },
+    'floor': {
+        'name': 'floor',
+        'calc': lambda x: [int(i) for i in str(x).split('-')] if x else None
+    },
+    'finished': {
+        'calc': lambda x: 0
+    },
+    'feature': {
+        'calc': lambda x: []
+    },
+    'view': {
+        'calc': lambda x: ('north', 1)
+    },
+    'sale': {
+        'name': 'sale',
+        'calc': lambda x: {x == 1: 'one', x == 2: 'two'}.get(True)
+    },
+}
+RECORDS = [
+    {'price': '100', 'space': 5, 'rooms': 2, 'floor': '3-4', 'sale': 1},
+    {'price': None, 'space': None, 'floor': 7, 'sale': 2},
+    {'price': 0, 'space': 0.5, 'rooms': 'studio', 'floor': '', 'sale': 3},
+    {},
+]
+
+
+class CompileFieldsTest(unittest.TestCase):
+    def test_matches_interpreted(self):
+        compiled = compile_fields(MATCHING)
+        for record in RECORDS:
+            with self.subTest(record=record):
+                obj = compiled(record)
+                self.assertEqual(obj, cast_fields(record, FIELDS, MATCHING))
+                self.assertEqual(list(obj), FIELDS)
+
+    def test_inlined_and_called(self):
+        source = compile_fields(MATCHING).source
+        self.assertIn('float(v_0) * SCALE', source)
+        # Замыкание не встраивается
+        self.assertRegex(source, r"obj\['area'\] = calc_\d+\(")
+
+    def test_records_do_not_share_values(self):
+        compiled = compile_fields(MATCHING)
+        first, second = compiled(RECORDS[0]), compiled(RECORDS[0])
+        first['feature'].append(1)
+        self.assertEqual(second['feature'], [])
+        self.assertEqual(compiled(RECORDS[0])['floor'], [3, 4])
+
+    def test_errors_match(self):
+        matching = {'price': {'name': 'price', 'calc': lambda x: float(x)}}
+        compiled = compile_fields(matching)
+        with self.assertRaises(TypeError):
+            cast_fields({}, FIELDS, matching)
+        with self.assertRaises(TypeError):
+            compiled({})
+
+    def test_parsers(self):
+        for name in PARSERS:
+            module = load_parser(name)
+            records = payloads.PAYLOADS[name](500, seed=1)
+            if name == 'loftfm':
+                records = records['data']
+            with self.subTest(parser=name):
+                for record in random.Random(0).sample(records, 200):
+                    self.assertEqual(module.cast_fields(record), cast_fields(record, FIELDS, module.MATCHING))
+
+
+if __name__ == '__main__':
+    unittest.main()
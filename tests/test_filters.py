@@ -0,0 +1,136 @@
+import argparse
+import io
+import json
+import tempfile
+import unittest
+
+from bench import standin
+from common import cli, client
+from common.filters import Filter, Range, format_filter, parse_filter
+from common.parsers import load_parser
+
+
+class RangeTest(unittest.TestCase):
+    def test_contains(self):
+        self.assertIn(5, Range(5, 10))
+        self.assertIn(10, Range(5, 10))
+        self.assertNotIn(5, Range(5, 10, strict_low=True))
+        self.assertNotIn(10, Range(5, 10, strict_high=True))
+        self.assertIn(-1e9, Range(high=0))
+        self.assertIn(1e9, Range())
+
+    def test_override(self):
+        default = Range(19, 96, True, True)
+        self.assertEqual(default.override(Range(30)), Range(30, 96, False, True))
+        self.assertEqual(default.override(Range(high=50)), Range(19, 50, True, False))
+        self.assertEqual(default.override(Range()), default)
+
+
+class ParseFilterTest(unittest.TestCase):
+    def test_parse(self):
+        spec = parse_filter('price=1000000..10000000, area=19.5..96,floor=2..,rooms=..3,available')
+        self.assertEqual((spec.price, spec.area, spec.floor, spec.rooms, spec.available),
+                         (Range(1000000, 10000000), Range(19.5, 96), Range(2), Range(high=3), True))
+        self.assertEqual(parse_filter('rooms=2').rooms, Range(2, 2))
+        self.assertIsInstance(parse_filter('price=1000..').price.low, int)
+        self.assertFalse(parse_filter(''))
+
+    def test_format_round_trip(self):
+        for text in ('price=1000000..10000000,area=19.5..96', 'floor=2..,rooms=..3,available', 'available', ''):
+            with self.subTest(text=text):
+                self.assertEqual(format_filter(parse_filter(text)), text)
+
+    def test_errors(self):
+        for text in ('height=1..2', 'price', 'price=a..b', 'area=1..2..3'):
+            with self.subTest(text=text):
+                with self.assertRaises(argparse.ArgumentTypeError):
+                    parse_filter(text)
+
+    def test_cli(self):
+        options = cli.add_arguments(argparse.ArgumentParser()).parse_args(['--filter', 'floor=2..'])
+        self.assertEqual(options.filter.floor, Range(2))
+        with self.assertRaises(SystemExit):
+            cli.add_arguments(argparse.ArgumentParser()).parse_args(['--filter', 'height=1'])
+
+
+class CompileTest(unittest.TestCase):
+    KEYS = {'price': 'cost', 'area': 'space'}
+
+    def test_nothing_to_check(self):
+        self.assertIsNone(Filter().compile(self.KEYS))
+        # Ограничение без ключа в записях API не проверяется
+        self.assertIsNone(Filter(floor=Range(2)).compile(self.KEYS))
+        self.assertIsNone(Filter().compile(self.KEYS, available=lambda record: False))
+
+    def test_accept(self):
+        accept = Filter(price=Range(100, 200, strict_high=True), area=Range(30), available=True).compile(
+            self.KEYS, available=lambda record: record.get('status') == 'free')
+        self.assertTrue(accept({'cost': '100', 'space': 30, 'status': 'free'}))
+        self.assertFalse(accept({'cost': '200', 'space': 30, 'status': 'free'}))
+        self.assertFalse(accept({'cost': 150, 'space': 29.9, 'status': 'free'}))
+        self.assertFalse(accept({'cost': 150, 'space': 30, 'status': 'sold'}))
+        # Нет значения - запись не проходит фильтр
+        for record in ({'space': 30}, {'cost': None, 'space': 30}, {'cost': 'n/a', 'space': 30}):
+            self.assertFalse(accept(dict(record, status='free')))
+
+    def test_override(self):
+        spec = Filter(price=Range(1, 10), available=True).override(Filter(price=Range(high=5), floor=Range(2)))
+        self.assertEqual((spec.price, spec.floor, spec.available), (Range(1, 5), Range(2), True))
+        self.assertIs(spec.override(None), spec)
+
+
+class PushFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.push_filter = load_parser('nt').push_filter
+
+    def test_body(self):
+        payload = json.dumps({'search': {'projectId': 1}})
+        endpoint, body = self.push_filter('/api/search', payload, parse_filter('price=100..200,floor=3..,rooms=2'))
+        self.assertEqual(endpoint, '/api/search')
+        self.assertEqual(json.loads(body), {'search': {'projectId': 1, 'priceMin': 100, 'priceMax': 200,
+                                                       'floorMin': 3}})
+
+    def test_query(self):
+        self.assertEqual(self.push_filter('/api/search?project=1', '', parse_filter('area=30..60')),
+                         ('/api/search?project=1&spaceMin=30&spaceMax=60', ''))
+        # Без строки запроса и тела параметры некуда передать
+        self.assertEqual(self.push_filter('/api/flats', '', parse_filter('area=30..60')), ('/api/flats', ''))
+
+    def test_unchanged(self):
+        payload = json.dumps({'search': {}})
+        self.assertEqual(self.push_filter('/api/search', payload, parse_filter('rooms=2,available')),
+                         ('/api/search', payload))
+
+
+class ParserFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.site = standin.StandIn(complexes=4, records=60)
+        self.server = standin.start(self.site)
+        self.cache = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        client.CLIENT.configure()
+
+    def run_parser(self, name, *args):
+        options = cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, *args])
+        stream = io.StringIO()
+        load_parser(name).main(options=options, stream=stream)
+        return json.loads(stream.getvalue())
+
+    def test_same_as_post_filter(self):
+        # Ограничения, переданные в запрос и проверенные на записях API, дают те же записи,
+        # что и отбор готового вывода без фильтра
+        for name in ('nk', 'nt', 'loftfm'):
+            with self.subTest(parser=name):
+                full = self.run_parser(name)
+                filtered = self.run_parser(name, '--filter', 'area=30..60,floor=3..10')
+                self.assertTrue(filtered)
+                self.assertEqual(filtered, [obj for obj in full if 30 <= obj['area'] <= 60 and 3 <= obj['floor'] <= 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from common import history
+
+
+def flat(number, price, complex_name='A'):
+    return {'complex': complex_name, 'article': None, 'building': '1', 'section': '1', 'number': number,
+            'price': price, 'in_sale': 1}
+
+
+class ListWriter:
+    def __init__(self):
+        self.records = []
+
+    def write(self, obj):
+        self.records.append(obj)
+
+    def fail(self, complex_name):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'history.sqlite3')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def open(self, busy_timeout=None, site='site'):
+        conn = history.connect(self.path)
+        if busy_timeout is not None:
+            conn.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+        return history.HistoryWriter(ListWriter(), conn, site)
+
+    def run_site(self, records, failed=(), ts=None, site='site'):
+        writer = self.open(site=site)
+        if ts is not None:
+            writer.ts = ts
+        for complex_name in failed:
+            writer.fail(complex_name)
+        writer.write_all(records)
+        writer.close()
+
+    def prices(self, number, complex_name='A'):
+        conn = history.connect(self.path)
+        try:
+            return [(price, bool(removed)) for _, price, _, removed in
+                    history.price_history(conn, f'{complex_name}|1|1|{number}', 'site')]
+        finally:
+            conn.close()
+
+    def runs(self):
+        conn = history.connect(self.path)
+        try:
+            return conn.execute('SELECT records, changes FROM runs ORDER BY id').fetchall()
+        finally:
+            conn.close()
+
+
+class HistoryWriterTest(HistoryTestCase):
+    def test_changes_and_removals(self):
+        self.run_site([flat(1, 100), flat(2, 200), flat(3, 300, 'B')])
+        self.run_site([flat(1, 100), flat(2, 150)], failed=['B'])
+        self.run_site([flat(2, 150), flat(3, 300, 'B')])
+        self.assertEqual(self.prices(1), [(100, False), (None, True)])
+        self.assertEqual(self.prices(2), [(200, False), (150, False)])
+        # Комплекс B не получен во втором запуске: квартира не считается пропавшей
+        self.assertEqual(self.prices(3, 'B'), [(300, False)])
+        self.assertEqual(self.runs(), [(3, 3), (2, 1), (2, 1)])
+
+    def test_running_writer_does_not_lock_database(self):
+        first = self.open()
+        first.write(flat(1, 100))
+        # Запуск целиком проходит, пока первый еще получает записи
+        start = time.monotonic()
+        second = self.open(busy_timeout=500)
+        second.write_all([flat(1, 110), flat(2, 200)])
+        second.close()
+        self.assertLess(time.monotonic() - start, 0.5)
+        first.write(flat(2, 200))
+        first.close()
+        # Строки истории упорядочены по началу запуска
+        self.assertEqual(self.prices(1), [(100, False), (110, False)])
+        # Изменение, уже сохраненное вторым запуском, не повторяется
+        self.assertEqual(self.prices(2), [(200, False)])
+        self.assertEqual(self.runs(), [(2, 2), (2, 1)])
+
+
+class HistoryQueryTest(HistoryTestCase):
+    def query(self, function, *args):
+        conn = history.connect(self.path)
+        try:
+            return function(conn, *args)
+        finally:
+            conn.close()
+
+    def test_price_history(self):
+        self.run_site([dict(flat(1, 100), price_sale=90)], ts=1000)
+        self.run_site([dict(flat(1, 100), price_sale=80, in_sale=0)], ts=2000)
+        self.run_site([flat(1, 500)], ts=1500, site='other')
+        # Цена - первое заполненное поле из PRICE_FIELDS
+        self.assertEqual(self.query(history.price_history, 'A|1|1|1', 'site'), [(1000, 90, 1, 0), (2000, 80, 0, 0)])
+        self.assertEqual(self.query(history.price_history, 'A|1|1|1'),
+                         [(1000, 90, 1, 0), (1500, 500, 1, 0), (2000, 80, 0, 0)])
+        self.assertEqual(self.query(history.price_history, 'A|1|1|2'), [])
+        self.run_site([dict(flat(5, 100), article='x5')], ts=3000)
+        self.assertEqual(self.query(history.price_history, 'A|x5', 'site'), [(3000, 100, 1, 0)])
+
+    def test_price_drops(self):
+        self.run_site([flat(1, 100), flat(2, 200), flat(3, 300), flat(4, 400, 'B')], ts=1000)
+        self.run_site([flat(1, 90), flat(2, 200), flat(3, 300), flat(4, 300, 'B')], ts=2000)
+        self.run_site([flat(1, 95), flat(2, 150), flat(4, 300, 'B')], ts=3000)
+        self.run_site([flat(1, 95), flat(2, 150), flat(3, 250), flat(4, 300, 'B')], ts=4000)
+        # Рост цены и снятие с продажи - не снижения, прежняя цена берется и до начала периода
+        self.assertEqual(self.query(history.price_drops, 'A', 0),
+                         [('A|1|1|1', 2000, 100, 90), ('A|1|1|2', 3000, 200, 150), ('A|1|1|3', 4000, 300, 250)])
+        self.assertEqual(self.query(history.price_drops, 'A', 2500),
+                         [('A|1|1|2', 3000, 200, 150), ('A|1|1|3', 4000, 300, 250)])
+        self.assertEqual(self.query(history.price_drops, 'B', 0), [('B|1|1|4', 2000, 400, 300)])
+        self.assertEqual(self.query(history.price_drops, 'C', 0), [])
+
+    def test_cli(self):
+        now = time.time()
+        self.run_site([flat(1, 100)], ts=now - 10 * 86400)
+        self.run_site([flat(1, 90)], ts=now - 3 * 86400)
+        self.run_site([], ts=now - 86400)
+
+        def main(*argv):
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                history.main(['--db', self.path, *argv])
+            return [line.split(' ', 2)[2] for line in stdout.getvalue().splitlines()]
+
+        self.assertEqual(main('flat', 'A|1|1|1'), ['100.0 in_sale=1', '90.0 in_sale=1', 'removed'])
+        self.assertEqual(main('flat', 'A|1|1|1', '--site', 'other'), [])
+        self.assertEqual(main('drops', 'A'), ['A|1|1|1 100.0 -> 90.0'])
+        self.assertEqual(main('drops', 'A', '--days', '2'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import json
+import random
+import unittest
+from json import JSONDecodeError
+
+from bench import payloads
+from common.jsonstream import iter_items
+
+DOCUMENTS = [
+    [],
+    [1, -2.5, 1e300, 15000000000, 0.1, -0.0, 1.5e-7, True, False, None],
+    ['', 'строка', 'эмодзи \U0001F600', 'escape \\ " \n  ', 'a' * 1000],
+    [{}, [], {'a': [1, {'b': None}], 'c': 'd'}, [[[]]], {'price': 12345678.9, 'name': 'Квартира'}],
+]
+
+
+def split(body: bytes, sizes):
+    """
+    Делит тело на части указанных размеров по кругу
+    """
+    chunks, i, n = [], 0, 0
+    while i < len(body):
+        size = sizes[n % len(sizes)]
+        chunks.append(body[i:i + size])
+        i += size
+        n += 1
+    return chunks
+
+
+class IterItemsTest(unittest.TestCase):
+    def assert_same(self, body: bytes, path=(), **kwargs):
+        expected = json.loads(body)
+        for key in path:
+            expected = expected[key]
+        for sizes in ([1], [2, 3], [7], [64], [len(body) or 1]):
+            with self.subTest(sizes=sizes):
+                self.assertEqual(list(iter_items(split(body, sizes), path, **kwargs)), expected)
+
+    def test_matches_json_loads(self):
+        for document in DOCUMENTS:
+            for ensure_ascii in (True, False):
+                self.assert_same(json.dumps(document, ensure_ascii=ensure_ascii).encode('utf-8'))
+
+    def test_whitespace(self):
+        self.assert_same(b' \n[ 1 ,\t{"a" : [ 2 , 3 ] } ,\r\n "x" ]\n ')
+
+    def test_numbers_at_chunk_boundaries(self):
+        body = json.dumps([15000000000, 1.5e10, -123.456, 7, 1e-5] * 10).encode()
+        for size in range(1, 12):
+            self.assertEqual(list(iter_items(split(body, [size]))), json.loads(body))
+
+    def test_nested_path(self):
+        body = json.dumps({'success': True, 'meta': {'data': [0]}, 'data': [{'id': 1}, {'id': 2}],
+                           'tail': 'x'}).encode()
+        self.assert_same(body, ('data',))
+        self.assert_same(json.dumps({'a': {'b': [1, 2]}}).encode(), ('a', 'b'))
+
+    def test_other_encoding(self):
+        body = json.dumps(['Новокрасково'], ensure_ascii=False).encode('cp1251')
+        self.assertEqual(list(iter_items(split(body, [3]), encoding='cp1251')), ['Новокрасково'])
+
+    def test_synthetic_payloads(self):
+        rnd = random.Random(0)
+        for name, make in payloads.PAYLOADS.items():
+            body = payloads.encode(make(300))
+            path = ('data',) if name == 'loftfm' else ()
+            chunks = split(body, [rnd.randint(1, 4096) for _ in range(50)])
+            expected = json.loads(body)
+            with self.subTest(name=name):
+                self.assertEqual(list(iter_items(chunks, path)), expected['data'] if path else expected)
+
+    def test_errors(self):
+        for body, path in ((b'<html>not found</html>', ()), (b'', ()), (b'{"data": 1}', ('data',)),
+                           (b'{"other": []}', ('data',)), (b'[1, 2', ()), (b'[1 2]', ())):
+            with self.subTest(body=body):
+                with self.assertRaises(JSONDecodeError):
+                    list(iter_items(split(body, [3]), path))
+
+    def test_error_before_first_record(self):
+        items = iter_items([b'not json'])
+        with self.assertRaises(JSONDecodeError):
+            next(items)
+
+
+if __name__ == '__main__':
+    unittest.main()
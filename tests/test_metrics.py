@@ -0,0 +1,89 @@
+import threading
+import unittest
+
+from common.concurrency import in_context, iter_ordered
+from common.metrics import METRICS, Metrics, prometheus
+
+
+class MetricsTest(unittest.TestCase):
+    def test_concurrent_runs_are_separate(self):
+        """
+        Как два одновременных запуска демона: второй start не сбрасывает значения первого
+        """
+        first_started, second_started = threading.Event(), threading.Event()
+        reports = {}
+
+        def run(name, count, wait_for, signal):
+            METRICS.start(enabled=True)
+            signal.set()
+            wait_for.wait()
+            for _ in range(count):
+                METRICS.add('example.com', requests=1)
+            reports[name] = METRICS.finish(name)
+
+        threads = [threading.Thread(target=run, args=('first', 3, second_started, first_started)),
+                   threading.Thread(target=run, args=('second', 5, first_started, second_started))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(reports['first']['counters']['requests'], 3)
+        self.assertEqual(reports['second']['counters']['requests'], 5)
+
+    def test_worker_threads_record_into_their_run(self):
+        metrics = METRICS.start(enabled=True)
+        items = [(f'host{i}', f'https://host{i}/') for i in range(4)]
+
+        def work(host, url):
+            METRICS.add(host, requests=2)
+            return []
+
+        list(iter_ordered(work, items, workers=4))
+        self.assertEqual(metrics.report('test')['counters']['requests'], 8)
+        METRICS.start()
+
+    def test_outside_run_disabled(self):
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(enabled=METRICS.enabled))
+        thread.start()
+        thread.join()
+        self.assertFalse(result['enabled'])
+
+    def test_overlapping_profiled_records(self):
+        metrics = Metrics(enabled=True, profiler='cprofile')
+        barrier = threading.Barrier(2, timeout=5)
+        errors = []
+
+        def records():
+            barrier.wait()
+            for i in range(2000):
+                yield {'i': i}
+
+        def run(host):
+            try:
+                list(metrics.records(records(), None, dict, lambda obj, record: obj, host))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=in_context(run), args=(f'h{i}',)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        report = metrics.report('test')
+        self.assertEqual(report['counters']['records_out'], 4000)
+        self.assertTrue(report['functions'])
+
+    def test_prometheus_counters(self):
+        metrics = Metrics(enabled=True)
+        metrics.add('example.com', requests=2, bytes=10)
+        text = prometheus(metrics.report('test'))
+        self.assertIn('# TYPE scraper_requests_total counter', text)
+        self.assertIn('# TYPE scraper_bytes_total counter', text)
+        self.assertIn('# TYPE scraper_run_seconds gauge', text)
+        self.assertIn('scraper_requests_total{site="test",host="example.com"} 2', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
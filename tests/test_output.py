@@ -0,0 +1,92 @@
+import argparse
+import io
+import json
+import tempfile
+import unittest
+
+from bench import standin
+from common import cli, client
+from common.output import make_writer
+from common.parsers import PARSERS, load_parser
+
+RECORDS = [
+    {'complex': 'A', 'price': 1.5, 'floor': 2},
+    {'complex': 'A', 'price': 2.5, 'floor': 3, 'gift': 'Кладовая'},
+    {'complex': 'B', 'price': None, 'floor': 4},
+    {'complex': 'B', 'floor': 5, 'price': 3.5},
+    {'complex': 'B', 'price': 4.5, 'gift': None},
+    {'complex': 'A', 'price': 5.5, 'floor': 6, 'change': 'removed'},
+]
+
+
+class WriterTest(unittest.TestCase):
+    def output(self, fmt, records):
+        stream = io.StringIO()
+        writer = make_writer(fmt, stream)
+        writer.write_all(records)
+        writer.flush()
+        writer.close()
+        return stream.getvalue()
+
+    def test_records_with_different_fields(self):
+        """
+        Записи с другими полями или другим порядком полей выводятся как есть, как json.dumps списка
+        """
+        expected = json.dumps(RECORDS, ensure_ascii=False)
+        for fmt in ('json', 'json-stream'):
+            with self.subTest(fmt=fmt):
+                self.assertEqual(self.output(fmt, RECORDS), expected)
+        lines = self.output('ndjson', RECORDS).splitlines()
+        self.assertEqual(lines, [json.dumps(obj, ensure_ascii=False) for obj in RECORDS])
+
+    def test_empty(self):
+        for fmt in ('json', 'json-stream'):
+            with self.subTest(fmt=fmt):
+                self.assertEqual(self.output(fmt, []), '[]')
+        self.assertEqual(self.output('ndjson', []), '')
+    def test_streaming_before_close(self):
+        for fmt in ('json', 'json-stream', 'ndjson'):
+            stream = io.StringIO()
+            writer = make_writer(fmt, stream)
+            writer.write_all(RECORDS[:2])
+            writer.flush()
+            with self.subTest(fmt=fmt):
+                # json выводит все при закрытии, потоковые форматы - сразу
+                if fmt == 'json':
+                    self.assertEqual(stream.getvalue(), '')
+                else:
+                    self.assertIn(json.dumps(RECORDS[1], ensure_ascii=False), stream.getvalue())
+            writer.close()
+
+
+class ParserFormatsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = standin.start(standin.StandIn(complexes=4, records=30))
+        self.cache = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        client.CLIENT.configure()
+
+    def output(self, name, *args):
+        options = cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, *args])
+        stream = io.StringIO()
+        load_parser(name).main(options=options, stream=stream)
+        return stream.getvalue()
+
+    def test_formats_match(self):
+        for name in PARSERS:
+            expected = self.output(name)
+            with self.subTest(parser=name):
+                self.assertTrue(json.loads(expected))
+                for workers in ('1', '4'):
+                    self.assertEqual(self.output(name, '--format', 'json-stream', '--workers', workers), expected)
+                    lines = self.output(name, '--format', 'ndjson', '--workers', workers).splitlines()
+                    self.assertEqual([json.loads(line) for line in lines], json.loads(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from urllib.parse import urlsplit
+
+from bench import standin
+from common import cli, client
+from common.parsers import load_parser
+from common.plans import PlanChecker, PlanStore, PlanWriter
+
+PLAN = 'https://mrloft.ru/files/flat/{}/Lot.png'
+
+
+def plan_hash(url):
+    return hashlib.sha256(standin.plan_file(urlsplit(url).path)).hexdigest()
+
+
+class PlanStandIn(standin.StandIn):
+    """
+    Стенд, запоминающий запросы планов. Может не отдавать ETag и не поддерживать HEAD
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.etag = True
+        self.head = True
+        self.plan_requests = []
+
+    def respond(self, method, host, path, accept_gzip, form=''):
+        if host == 'mrloft.ru':
+            with self.lock:
+                self.plan_requests.append((method, path))
+            if method == 'HEAD' and not self.head:
+                return 405, {'Content-Type': 'text/plain'}, b''
+        status, headers, body = super().respond(method, host, path, accept_gzip, form)
+        if not self.etag:
+            headers.pop('ETag', None)
+        return status, headers, body
+
+
+class PlansTest(unittest.TestCase):
+    def setUp(self):
+        self.site = PlanStandIn(complexes=1, records=100)
+        self.server = standin.start(self.site)
+        self.cache = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.cache.name, 'plans')
+        cli.configure(cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name]))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        client.CLIENT.configure()
+
+    def objects(self):
+        return sorted(name for _, _, names in os.walk(os.path.join(self.root, 'objects')) for name in names)
+
+    def test_check_links(self):
+        urls = [PLAN.format(i) for i in range(5)]
+        checker = PlanChecker(4)
+        checker.check_all(urls + urls + [None, 'https://mrloft.ru/missing.png'])
+        self.assertEqual(checker.results, dict({url: (True, None) for url in urls},
+                                               **{'https://mrloft.ru/missing.png': (False, None)}))
+        # Каждый адрес проверяется один раз HEAD-запросом
+        self.assertEqual(sorted(self.site.plan_requests), sorted(('HEAD', urlsplit(url).path)
+                                                                 for url in urls + ['https://mrloft.ru/missing.png']))
+        checker.check_all(urls)
+        self.assertEqual(len(self.site.plan_requests), 6)
+        self.assertEqual(checker.annotate({'plan': None}), {'plan': None, 'plan_alive': None})
+
+    def test_head_unsupported(self):
+        self.site.head = False
+        checker = PlanChecker(1)
+        checker.check_all([PLAN.format(1)])
+        self.assertEqual(checker.results, {PLAN.format(1): (True, None)})
+        self.assertEqual([method for method, _ in self.site.plan_requests], ['HEAD', 'GET'])
+
+    def test_store(self):
+        urls = [PLAN.format(i) for i in range(40)]
+        store = PlanStore(self.root)
+        self.assertEqual([store.fetch(url) for url in urls], [(True, plan_hash(url)) for url in urls])
+        # Одинаковые планы с разных адресов хранятся один раз
+        self.assertEqual(self.objects(), sorted({plan_hash(url) for url in urls}))
+        self.assertLessEqual(len(self.objects()), standin.PLAN_VARIANTS)
+        for digest in self.objects():
+            with open(store.object_path(digest), 'rb') as f:
+                self.assertEqual(hashlib.sha256(f.read()).hexdigest(), digest)
+        self.assertEqual(store.fetch('https://mrloft.ru/missing.png'), (False, None))
+        store.save_index()
+
+        # Известные планы перепроверяются условным запросом, сервер отвечает 304
+        self.site.plan_requests.clear()
+        store = PlanStore(self.root)
+        self.assertEqual(store.fetch(urls[0]), (True, plan_hash(urls[0])))
+        self.assertEqual(self.site.plan_requests, [('GET', urlsplit(urls[0]).path)])
+        # Удаленный файл плана скачивается заново
+        os.unlink(store.object_path(plan_hash(urls[1])))
+        self.assertEqual(store.fetch(urls[1]), (True, plan_hash(urls[1])))
+        self.assertTrue(os.path.exists(store.object_path(plan_hash(urls[1]))))
+
+    def test_store_without_validators(self):
+        self.site.etag = False
+        store = PlanStore(self.root)
+        url = PLAN.format(1)
+        store.fetch(url)
+        self.assertEqual(store.index[url], {'hash': plan_hash(url), 'etag': None, 'modified': None})
+        # Проверить изменения нечем: план не скачивается, ссылка проверяется HEAD-запросом
+        self.assertEqual(store.fetch(url), (True, plan_hash(url)))
+        self.assertEqual([method for method, _ in self.site.plan_requests], ['GET', 'HEAD'])
+
+    def test_writer(self):
+        records = []
+
+        class ListWriter:
+            def write(self, obj):
+                records.append(obj)
+
+            def flush(self):
+                pass
+
+            def close(self):
+                pass
+
+        writer = PlanWriter(ListWriter(), PlanChecker(4, PlanStore(self.root)))
+        writer.write_all([{'plan': PLAN.format(i % 3)} for i in range(6)])
+        self.assertEqual(records, [])
+        writer.flush()
+        self.assertEqual(records, [{'plan': PLAN.format(i % 3), 'plan_alive': True,
+                                    'plan_hash': plan_hash(PLAN.format(i % 3))} for i in range(6)])
+        self.assertEqual(len(self.site.plan_requests), 3)
+        writer.write({'plan': None})
+        writer.close()
+        self.assertEqual(records[-1], {'plan': None, 'plan_alive': None, 'plan_hash': None})
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'index.json')))
+
+    def run_parser(self, *args):
+        options = cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, *args])
+        stream = io.StringIO()
+        load_parser('loftfm').main(options=options, stream=stream)
+        return json.loads(stream.getvalue())
+
+    def test_mirror_run(self):
+        full = self.run_parser()
+        mirrored = self.run_parser('--mirror-plans')
+        self.assertEqual([{key: value for key, value in obj.items() if key not in ('plan_alive', 'plan_hash')}
+                          for obj in mirrored], full)
+        for obj in mirrored:
+            expected = (True, plan_hash(obj['plan'])) if obj['plan'] else (None, None)
+            self.assertEqual((obj['plan_alive'], obj['plan_hash']), expected)
+        # Повторный запуск перепроверяет планы условными запросами, новых файлов не появляется
+        self.site.plan_requests.clear()
+        self.assertEqual(self.run_parser('--mirror-plans'), mirrored)
+        self.assertEqual({method for method, _ in self.site.plan_requests}, {'GET'})
+        self.assertEqual(len(self.objects()), len({obj['plan_hash'] for obj in mirrored if obj['plan_hash']}))
+
+
+if __name__ == '__main__':
+    unittest.main()
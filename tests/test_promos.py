@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import unittest
+
+from common.errors import MyException
+from common.parsers import load_parser
+from common.promos import PromoParser, PromoRule, load_rules
+
+DISCOUNT = 'Цена указана с учетом скидки 10%'
+FINISHING = 'Черновая отделка в подарок'
+
+
+def record(sale):
+    return {'price_base': 100.0, 'price_sale': None, 'price_finished_sale': None, 'discount': None,
+            'finishing_name': None, 'finished': 0, 'feature': None, 'sale': sale}
+
+
+class PromoParserTest(unittest.TestCase):
+    def setUp(self):
+        self.loftfm = load_parser('loftfm')
+
+    def apply(self, rules, text):
+        obj = record(text)
+        PromoParser(rules).apply(obj, text)
+        return obj
+
+    def test_loftfm_rules(self):
+        rules = self.loftfm.PROMO_RULES
+        self.assertEqual(self.apply(rules, DISCOUNT), dict(record(DISCOUNT), price_base=None, price_sale=100.0,
+                                                            discount=10.0))
+        self.assertEqual(self.apply(rules, FINISHING), dict(record(FINISHING), price_base=None,
+                                                             price_finished_sale=100.0, finishing_name='Черновая',
+                                                             finished=1))
+        # Скидка и отделка: в цену с отделкой переносится цена со скидкой
+        text = f'{DISCOUNT}. {FINISHING}'
+        self.assertEqual(self.apply(rules, text), dict(record(text), price_base=None, price_finished_sale=100.0,
+                                                        discount=10.0, finishing_name='Черновая', finished=1))
+        self.assertEqual(self.apply(rules, 'Без акции'), record('Без акции'))
+
+    def test_parse_cached(self):
+        parser = PromoParser(self.loftfm.PROMO_RULES)
+        for _ in range(3):
+            parser.apply(record(DISCOUNT), DISCOUNT)
+        self.assertEqual(parser.parse.cache_info().misses, 1)
+
+    def test_rules_do_not_share_set(self):
+        first, second = PromoRule('a', 'x'), PromoRule('b', 'y')
+        self.assertIsNot(first.set, second.set)
+
+
+class LoadRulesTest(unittest.TestCase):
+    def load(self, items):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rules.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(items, f, ensure_ascii=False)
+            return load_rules(path)
+
+    def test_custom_rule(self):
+        rules = self.load([{'name': 'parking', 'marker': 'машиноместо в подарок', 'set': {'feature': 'parking'}}])
+        text = 'Машиноместо: машиноместо в подарок'
+        self.assertEqual(PromoParser(rules).parse(text), ((rules[0], None),))
+        obj = record(text)
+        PromoParser(rules).apply(obj, text)
+        self.assertEqual(obj['feature'], 'parking')
+
+    def test_invalid_rules(self):
+        for item in ({'name': 'gift', 'marker': 'подарок', 'set': {'gift': 'parking'}},
+                     {'name': 'gift', 'marker': 'подарок', 'pattern': r'\w+', 'field': 'gift'},
+                     {'name': 'gift', 'marker': 'подарок', 'price': 'price_gift'},
+                     {'name': 'gift', 'marker': 'подарок', 'type': 'date'},
+                     {'name': 'gift', 'marker': 'подарок', 'target': 'feature'},
+                     {'marker': 'подарок'}):
+            with self.subTest(item=item):
+                with self.assertRaises(MyException):
+                    self.load([item])
+
+
+if __name__ == '__main__':
+    unittest.main()
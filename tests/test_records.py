@@ -0,0 +1,62 @@
+import json
+import unittest
+from io import StringIO
+
+from common.records import DictColumn, FloatColumn, IntColumn, ObjectColumn, RecordBatch
+
+RECORDS = [
+    {'complex': 'A', 'price': 1.5, 'floor': 2, 'plan': 'x', 'in_sale': 1},
+    {'complex': 'A', 'price': None, 'floor': None, 'plan': None, 'in_sale': 0},
+    {'complex': 'B', 'price': 3.0, 'floor': 7, 'plan': 'y', 'in_sale': True},
+]
+
+
+class RecordBatchTest(unittest.TestCase):
+    def test_round_trip(self):
+        batch = RecordBatch()
+        batch.extend(RECORDS)
+        self.assertEqual(list(batch), RECORDS)
+        self.assertEqual(batch[-1], RECORDS[-1])
+        self.assertIsInstance(batch.columns[0], DictColumn)
+        self.assertIsInstance(batch.columns[1], FloatColumn)
+        self.assertIsInstance(batch.columns[2], IntColumn)
+
+    def test_column_falls_back_to_list(self):
+        batch = RecordBatch()
+        batch.extend(RECORDS)
+        batch.append({'complex': 'C', 'price': 'по запросу', 'floor': 2 ** 70, 'plan': None, 'in_sale': 1})
+        self.assertIsInstance(batch.columns[1], ObjectColumn)
+        self.assertIsInstance(batch.columns[2], ObjectColumn)
+        self.assertEqual(batch[-1]['price'], 'по запросу')
+        self.assertEqual(list(batch)[:3], RECORDS)
+
+    def test_missing_field_leaves_batch_intact(self):
+        batch = RecordBatch()
+        batch.extend(RECORDS)
+        obj = dict(RECORDS[0])
+        del obj['in_sale']
+        obj['other'] = 1
+        with self.assertRaises(ValueError):
+            batch.append(obj)
+        self.assertEqual([len(column) for column in batch.columns], [len(RECORDS)] * len(batch.fields))
+        self.assertEqual(list(batch), RECORDS)
+        batch.append(RECORDS[0])
+        self.assertEqual(list(batch), RECORDS + RECORDS[:1])
+
+    def test_field_order_checked(self):
+        batch = RecordBatch()
+        batch.extend(RECORDS)
+        with self.assertRaises(ValueError):
+            batch.append(dict(reversed(list(RECORDS[0].items()))))
+        self.assertEqual(list(batch), RECORDS)
+
+    def test_write_json(self):
+        batch = RecordBatch()
+        batch.extend(RECORDS * 5)
+        stream = StringIO()
+        batch.write_json(stream, chunk_size=4)
+        self.assertEqual(stream.getvalue(), json.dumps(RECORDS * 5, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import argparse
+import io
+import json
+import tempfile
+import unittest
+
+from bench import standin
+from common import cli, client
+from common.filters import Range
+from common.parsers import load_parser
+
+
+class MakeShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.loftfm = load_parser('loftfm')
+
+    def test_split_range(self):
+        split_range = self.loftfm.split_range
+        self.assertEqual(split_range(Range(0, 100), ()), [Range(0, 100)])
+        # Точки вне диапазона и повторы пропускаются, соседние части делят точку деления
+        self.assertEqual(split_range(Range(0, 100), (50, 20, 50, 0, 150)),
+                         [Range(0, 20), Range(20, 50), Range(50, 100)])
+
+    def test_make_shards(self):
+        make_shards = self.loftfm.make_shards
+        area, price = Range(0, 200), Range(0, 10 ** 8)
+        self.assertEqual(make_shards(area, price, range(3)),
+                         ['min_s=0&max_s=200&min_price=0&max_price=100000000'
+                          '&room%5B%5D=0&room%5B%5D=1&room%5B%5D=2'])
+        shards = make_shards(area, price, range(3), shard_rooms=True, shard_prices=(10 ** 7,), shard_areas=(50, 100))
+        self.assertEqual(len(shards), 3 * 2 * 3)
+        self.assertEqual(len(set(shards)), len(shards))
+        self.assertEqual(shards[0], 'min_s=0&max_s=50&min_price=0&max_price=10000000&room%5B%5D=0')
+
+
+class ShardedRunTest(unittest.TestCase):
+    def setUp(self):
+        self.site = standin.StandIn(complexes=1, records=300)
+        self.server = standin.start(self.site)
+        self.cache = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+        client.CLIENT.configure()
+
+    def run_parser(self, **shards):
+        options = cli.add_arguments(argparse.ArgumentParser()).parse_args(
+            ['--target', self.server.url, '--cache-dir', self.cache.name, '--workers', '4'])
+        stream = io.StringIO()
+        self.assertFalse(load_parser('loftfm').main(options=options, stream=stream, **shards))
+        return json.loads(stream.getvalue())
+
+    def test_same_as_unsharded(self):
+        full = self.run_parser()
+        records = self.site.payloads[('loftfm.mrloft.ru', 300)]['data']
+        # Точки деления совпадают со значениями квартир: такие квартиры приходят в двух частях
+        prices = [int(record['priceToSort']) for record in records[:3]]
+        areas = [record['s'] for record in records[3:6]]
+        expected = sorted(full, key=lambda obj: obj['number'])
+        for shards in ({'shard_rooms': True}, {'shard_prices': prices}, {'shard_areas': areas},
+                       {'shard_rooms': True, 'shard_prices': prices, 'shard_areas': areas}):
+            with self.subTest(**shards):
+                result = self.run_parser(**shards)
+                self.assertEqual(sorted(result, key=lambda obj: obj['number']), expected)
+                self.assertEqual(len({obj['number'] for obj in result}), len(result))
+
+
+if __name__ == '__main__':
+    unittest.main()